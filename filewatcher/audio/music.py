@@ -18,21 +18,16 @@
 from __future__ import print_function
 
 from filewatcher.core import settings
+from filewatcher.core.media import get_media_classifier
 
 
 def is_audio_folder(directory: str, dir_files: list[str]) -> bool:
-    for directory_file in dir_files:
-        settings.debug_message(
-            "Testing file {} for audio format!".format(directory_file)
-        )
-        if settings.get_extension(directory_file) in settings.audio_formats:
-            settings.debug_message("Found audio folder: {}".format(directory))
-            return True
-        else:
-            settings.debug_message(
-                "Folder does not contain first level audio files. Skipping."
-            )
-            return False
+    settings.debug_message("Testing files in {} for audio format!".format(directory))
+    if get_media_classifier().classify(dir_files).audio:
+        settings.debug_message("Found audio folder: {}".format(directory))
+        return True
+    settings.debug_message("Folder does not contain first level audio files. Skipping.")
+    return False
 
 
 def process_audio(directory: str) -> None:
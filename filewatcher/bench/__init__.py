@@ -0,0 +1,23 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: __init__.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Benchmarks for the slow parts of FileWatcher. Each module runs on its
+   own, e.g. `python -m filewatcher.bench.omdb`, and needs nothing beyond
+   the normal dependencies.
+*********************************************
+"""
+
+import time
+from typing import Callable
+
+
+def timed(function: Callable, *args, **kwargs) -> tuple[float, object]:
+    """Returns (seconds, result) for a single call."""
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - started, result
@@ -0,0 +1,89 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: fuzzy.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Builds a TrigramIndex over a synthetic library and times lookups of
+   release-name variants against it, next to the brute force approach of
+   scoring every title in the library.
+
+   python -m filewatcher.bench.fuzzy --titles 50000 --queries 2000
+*********************************************
+"""
+
+import argparse
+import random
+
+from filewatcher.bench import timed
+from filewatcher.movies.trigrams import TrigramIndex, similarity, trigrams
+
+WORDS = (
+    "the night dark last man return king city blood love house dead star "
+    "war black lost girl secret red world time fire iron kill moon shadow "
+    "heart river ghost storm wolf silent golden broken queen garden winter "
+    "summer edge crown rising empire stone glass angel devil hunter"
+).split()
+NOISE = ("REMASTERED", "1080p", "Final Cut", "Extended", "BluRay", "x264", "")
+
+
+def make_library(count: int, rng: random.Random) -> list[tuple[str, str, int]]:
+    library = []
+    for n in range(count):
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+        # plenty of real titles share words, but each needs to be its own
+        title = f"{title.title()} {n:x}"
+        year = rng.randint(1920, 2024)
+        library.append((f"{title} ({year})", title, year))
+    return library
+
+
+def make_queries(
+    library: list[tuple[str, str, int]], count: int, rng: random.Random
+) -> list[tuple[str, int]]:
+    queries = []
+    for _, title, year in rng.sample(library, count):
+        variant = title.replace(" ", rng.choice((" ", ".", "_")))
+        queries.append((f"{variant} {rng.choice(NOISE)}".strip(), year))
+    return queries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Trigram index benchmark.")
+    parser.add_argument("--titles", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--brute-force", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    library = make_library(args.titles, rng)
+    queries = make_queries(library, args.queries, rng)
+
+    seconds, index = timed(TrigramIndex.build, library)
+    print(f"build ({args.titles} titles):  {seconds:8.3f}s")
+
+    def run_queries() -> int:
+        return sum(bool(index.search(title, year)) for title, year in queries)
+
+    seconds, found = timed(run_queries)
+    print(
+        f"indexed search:  {seconds / len(queries) * 1e6:8.1f}us per lookup"
+        f" ({found}/{len(queries)} found)"
+    )
+
+    library_grams = [(name, trigrams(title)) for name, title, _ in library]
+
+    def brute_force() -> None:
+        for title, _ in queries[: args.brute_force]:
+            grams = trigrams(title)
+            max(library_grams, key=lambda item: similarity(grams, item[1]))
+
+    seconds, _ = timed(brute_force)
+    print(f"brute force:     {seconds / args.brute_force * 1e6:8.1f}us per lookup")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: omdb.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Looks up a batch of titles against a local stand-in for the OMDb that
+   takes --latency seconds to answer each request, first the old way (one
+   bare requests.get after another) and then through OMDbAPI.get_movies.
+
+   python -m filewatcher.bench.omdb --titles 200 --latency 0.05
+*********************************************
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from filewatcher.bench import timed
+from filewatcher.movies import OMDbAPI
+from filewatcher.movies.client import TokenBucket
+
+
+def start_server(latency: float) -> ThreadingHTTPServer:
+    class StandIn(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            title = parse_qs(urlparse(self.path).query).get("t", [""])[0]
+            time.sleep(latency)
+            body = json.dumps(
+                {"Response": "True", "Title": title, "Year": "1999"}
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serial(url: str, titles: list[str]) -> None:
+    for title in titles:
+        requests.get(url, params={"t": title, "r": "json"}).json()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("Purpose:")[0])
+    parser.add_argument("--titles", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--rate", type=float, default=0, help="requests per second, 0 = no limit"
+    )
+    args = parser.parse_args()
+
+    server = start_server(args.latency)
+    url = f"http://127.0.0.1:{server.server_port}/"
+    titles = [f"Movie Number {n}" for n in range(args.titles)]
+
+    seconds, _ = timed(serial, url, titles)
+    print(f"serial requests.get:  {seconds:6.2f}s")
+
+    omdb = OMDbAPI(
+        rate_limiter=TokenBucket(args.rate, burst=args.concurrency),
+        max_concurrency=args.concurrency,
+    )
+    omdb.url = url
+    seconds, results = timed(omdb.get_movies, titles)
+    failed = sum(result is None for result in results.values())
+    print(f"OMDbAPI.get_movies:   {seconds:6.2f}s ({failed} failed)")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: parser.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Checks the title parser against the release names in release_names.tsv
+   and times it. The parser runs with an empty cache and again warm, next
+   to the regex it replaced; each is the best of --repeat runs, since one
+   run on a busy machine says more about the machine than the parser.
+
+   python -m filewatcher.bench.parser --names 20000 --repeat 5
+*********************************************
+"""
+
+import argparse
+import os
+import re
+import sys
+from typing import Optional
+
+from filewatcher.bench import timed
+from filewatcher.movies.parser import clear_cache, parse_name, parse_names
+
+CORPUS = os.path.join(os.path.dirname(__file__), "release_names.tsv")
+
+# what folder_translator used to do, for comparison
+legacy_parser = re.compile(
+    r"""
+    (?P<title>[\w,.\-!'\s]+)
+    \s(?:[\(\[]?
+    (?P<year>(?:(?:20)|(?:19))
+    \d{2})[\)\]]?)
+    """,
+    re.MULTILINE | re.VERBOSE,
+)
+
+
+def legacy_parse(name: str) -> tuple[Optional[str], Optional[str]]:
+    extension = ""
+    if name.rfind(".") > 0 and name[name.rfind(".") :] in (".avi", ".mkv", ".mp4"):
+        extension = name[name.rfind(".") :]
+        name = name[: -len(extension)]
+    match = legacy_parser.match((name.replace(".", " ").replace("_", " ")).title())
+    if match is None:
+        return None, None
+    return match.group("title"), match.group("year")
+
+
+def load_corpus(path: str = CORPUS) -> list[tuple[str, Optional[str], Optional[str]]]:
+    corpus = []
+    with open(path, "r", encoding="utf-8") as corpus_file:
+        for line in corpus_file:
+            line = line.rstrip("\n")
+            if not line or line.startswith("#"):
+                continue
+            name, title, year = (line.split("\t") + ["", ""])[:3]
+            corpus.append((name, title or None, year or None))
+    return corpus
+
+
+def check(corpus: list[tuple[str, Optional[str], Optional[str]]]) -> int:
+    """Print every name the parser gets wrong; returns how many there were."""
+    wrong = 0
+    for name, title, year in corpus:
+        parsed = parse_name(name)
+        if (parsed.title, parsed.year) != (title, year):
+            wrong += 1
+            print(f"  {name!r}: got {parsed.title!r} {parsed.year!r}")
+    return wrong
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Title parser benchmark.")
+    parser.add_argument("--names", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    wrong = check(corpus)
+    legacy_right = sum(legacy_parse(name) == (t, y) for name, t, y in corpus)
+    print(
+        f"corpus: {len(corpus) - wrong}/{len(corpus)} right"
+        f" (the old regex gets {legacy_right})"
+    )
+
+    # distinct names, so the cold run really does parse every one of them
+    names = [
+        f"{corpus[n % len(corpus)][0]} {n}" if n >= len(corpus) else corpus[n][0]
+        for n in range(args.names)
+    ]
+
+    def best(function, *function_args, before=None) -> float:
+        runs = []
+        for _ in range(max(args.repeat, 1)):
+            if before is not None:
+                before()
+            runs.append(timed(function, *function_args)[0])
+        return min(runs)
+
+    seconds = best(lambda: [legacy_parse(name) for name in names])
+    print(f"old regex:    {seconds / len(names) * 1e6:6.2f}us per name")
+
+    seconds = best(parse_names, names, before=clear_cache)
+    print(f"cold:         {seconds / len(names) * 1e6:6.2f}us per name")
+
+    # what every cycle after the first looks like
+    recent = names[-1000:]
+    seconds = best(parse_names, recent)
+    print(f"warm:         {seconds / len(recent) * 1e6:6.2f}us per name")
+
+    long_name = "a" * 50000 + " (not a year)"
+    seconds, _ = timed(legacy_parse, long_name)
+    print(f"50k character name, old regex: {seconds * 1e3:8.2f}ms")
+    seconds, _ = timed(parse_name, long_name)
+    print(f"50k character name:            {seconds * 1e3:8.2f}ms")
+
+    if wrong:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
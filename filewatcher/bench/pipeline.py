@@ -0,0 +1,360 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: pipeline.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Runs the real main_loop over a synthetic incoming tree (see tree.py)
+   and a temporary library. Reports how long each stage took, how many
+   filesystem calls were made per entry, and peak memory. The first cycle
+   does all the work; the second is the steady state every cycle after it
+   looks like. --save writes the results out and --compare puts a saved
+   run next to this one, so a slower cycle shows up between versions.
+
+   With --memory the incoming directory and the library are kept in a
+   MemoryFileSystem, which leaves just the cost of deciding what to do with
+   everything; the difference from a run without it is what the disk costs.
+
+   python -m filewatcher.bench.pipeline --entries 10000
+   python -m filewatcher.bench.pipeline --entries 100000 --memory
+   python -m filewatcher.bench.pipeline --runtime async --workers 4
+   python -m filewatcher.bench.pipeline --save before.json
+   python -m filewatcher.bench.pipeline --compare before.json
+*********************************************
+"""
+
+import argparse
+import builtins
+import contextlib
+import functools
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Callable, Optional
+
+from filewatcher.bench import timed
+from filewatcher.bench.tree import generate_tree
+from filewatcher.core import settings
+import filewatcher.core.filewatcher as filewatcher
+from filewatcher.core import journal
+import filewatcher.core.pipeline as core_pipeline
+from filewatcher.core.fs import MemoryFileSystem, get_filesystem
+import filewatcher.movies.movies as movies
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# (module, function name, stage). Modules that imported a function by name
+# get their copy wrapped too.
+STAGES = (
+    (filewatcher, "process_folders", "process_folders"),
+    (filewatcher, "process_folder", "process_folder"),
+    (filewatcher, "root_level_files", "root_level_files"),
+    (filewatcher, "prefetch_lookups", "prefetch_lookups"),
+    (filewatcher, "process_movie", "process_movie"),
+    (filewatcher, "process_root_level_movie", "process_root_level_movie"),
+    (core_pipeline, "process_root_level_movie", "process_root_level_movie"),
+    (filewatcher, "rename_folder", "rename_folder"),
+    (movies, "folder_translator", "folder_translator"),
+    (filewatcher, "folder_translator", "folder_translator"),
+    (core_pipeline, "folder_translator", "folder_translator"),
+    (movies, "find_in_library", "find_in_library"),
+    (filewatcher, "find_in_library", "find_in_library"),
+    (filewatcher, "move_folder", "move_folder"),
+    (journal, "move", "journal.move"),
+)
+
+# everything that ends up as a filesystem syscall. DirEntry.stat() and
+# friends go straight to C and can't be seen from here; they're cached
+# per entry anyway.
+FS_CALLS = (
+    "stat",
+    "lstat",
+    "scandir",
+    "listdir",
+    "rename",
+    "replace",
+    "mkdir",
+    "remove",
+    "unlink",
+    "rmdir",
+    "open",
+    "link",
+    "utime",
+    "fsync",
+    "readlink",
+)
+
+# every lazily created helper hanging off settings
+SINGLETONS = (
+    "filesystem",
+    "watcher",
+    "notifier",
+    "scan_state",
+    "settle_detector",
+    "work_scheduler",
+    "device_slots",
+    "import_registry",
+    "journal",
+    "omdb_cache",
+    "omdb",
+    "title_index",
+    "library_index",
+    "fingerprint_store",
+    "media_classifier",
+    "roots",
+    "libraries",
+    "free_space",
+)
+
+
+class Stages:
+    """Total time and calls per stage, across however many threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds: dict[str, float] = {}
+        self.calls: dict[str, int] = {}
+
+    def wrap(self, function: Callable, stage: str) -> Callable:
+        @functools.wraps(function)
+        def timed_stage(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    self.seconds[stage] = self.seconds.get(stage, 0) + elapsed
+                    self.calls[stage] = self.calls.get(stage, 0) + 1
+
+        return timed_stage
+
+    def reset(self) -> None:
+        self.seconds = {}
+        self.calls = {}
+
+
+class FSCounter:
+    """Counts calls to the os functions in FS_CALLS, plus builtin open()."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls: dict[str, int] = {}
+
+    def wrap(self, function: Callable, name: str) -> Callable:
+        @functools.wraps(function)
+        def counted(*args, **kwargs):
+            with self._lock:
+                self.calls[name] = self.calls.get(name, 0) + 1
+            return function(*args, **kwargs)
+
+        return counted
+
+    @property
+    def total(self) -> int:
+        return sum(self.calls.values())
+
+    def reset(self) -> None:
+        self.calls = {}
+
+
+class BenchWatcher:
+    """Always says "look at everything" and never sleeps."""
+
+    name = "bench"
+
+    def __init__(self):
+        self.changed: Optional[set[str]] = None
+
+    def wait(self, timeout: float) -> Optional[set[str]]:
+        self.changed = None
+        return self.changed
+
+    def close(self) -> None:
+        pass
+
+
+def patch(target, name: str, replacement) -> Callable[[], None]:
+    original = getattr(target, name)
+    setattr(target, name, replacement)
+    return lambda: setattr(target, name, original)
+
+
+def configure(base: str, args: argparse.Namespace) -> None:
+    for attr in SINGLETONS:
+        setattr(settings, attr, None)
+    if args.memory:
+        settings.filesystem = MemoryFileSystem()
+    fs = get_filesystem()
+    for name in ("incoming", "movies", "audio"):
+        fs.makedirs(os.path.join(base, name))
+    if args.memory and args.cross_device:
+        # every movie has to be copied over instead of renamed
+        fs.mount(os.path.join(base, "movies"))
+    # state files are always on the disk
+    os.mkdir(os.path.join(base, "state"))
+    settings.incoming_dir = os.path.join(base, "incoming")
+    settings.movie_dir = os.path.join(base, "movies")
+    settings.audio_dir = os.path.join(base, "audio")
+    settings.state_dir = os.path.join(base, "state")
+    settings.video_formats = [".avi", ".mkv", ".mp4"]
+    settings.exts_to_delete = [".nfo", ".txt", ".jpg"]
+    settings.settle_mode = "quiescence"
+    settings.workers = str(args.workers)
+    settings.runtime = args.runtime
+    settings.debug = False
+    settings.watcher = BenchWatcher()
+
+
+def peak_memory_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1e6 if os.uname().sysname == "Darwin" else peak / 1e3
+
+
+def run(args: argparse.Namespace) -> dict:
+    base = tempfile.mkdtemp(prefix="filewatcher-bench-")
+    try:
+        configure(base, args)
+        seconds, counts = timed(
+            generate_tree,
+            settings.incoming_dir,
+            settings.movie_dir,
+            entries=args.entries,
+            library=args.library,
+            seed=args.seed,
+        )
+        print(f"generated {counts} in {seconds:.1f}s")
+        entries = sum(v for k, v in counts.items() if k != "library")
+
+        stages = Stages()
+        fs = FSCounter()
+        restore = [
+            patch(module, name, stages.wrap(getattr(module, name), stage))
+            for module, name, stage in STAGES
+        ]
+        restore += [
+            patch(os, name, fs.wrap(getattr(os, name), name))
+            for name in FS_CALLS
+            if hasattr(os, name)
+        ]
+        restore.append(patch(builtins, "open", fs.wrap(builtins.open, "open()")))
+
+        if args.runtime == "async":
+            main_loop = core_pipeline.main_loop
+        else:
+            main_loop = filewatcher.main_loop
+        results = {"entries": entries, "counts": counts, "cycles": []}
+        try:
+            for _ in range(args.cycles):
+                stages.reset()
+                fs.reset()
+                # what it prints about each folder would drown out the report
+                with contextlib.redirect_stdout(
+                    None if args.verbose else io.StringIO()
+                ):
+                    seconds, _ = timed(main_loop)
+                results["cycles"].append(
+                    {
+                        "seconds": seconds,
+                        "stages": {
+                            stage: [stages.seconds[stage], stages.calls[stage]]
+                            for stage in stages.seconds
+                        },
+                        "fs_calls": dict(fs.calls),
+                        "fs_calls_per_entry": fs.total / entries,
+                    }
+                )
+        finally:
+            for undo in reversed(restore):
+                undo()
+        results["peak_memory_mb"] = peak_memory_mb()
+        return results
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+
+def report(results: dict, previous: Optional[dict] = None) -> None:
+    def versus(current: float, before: Optional[float]) -> str:
+        if not before:
+            return ""
+        return f"  ({(current - before) / before * 100:+.0f}%)"
+
+    for n, cycle in enumerate(results["cycles"]):
+        before = (
+            previous["cycles"][n] if previous and n < len(previous["cycles"]) else None
+        )
+        print(
+            f"\ncycle {n + 1}: {cycle['seconds']:.3f}s"
+            + versus(cycle["seconds"], before and before["seconds"])
+        )
+        for stage, (seconds, calls) in sorted(
+            cycle["stages"].items(), key=lambda item: -item[1][0]
+        ):
+            old = before and before["stages"].get(stage, [None])[0]
+            print(
+                f"  {stage:<26}{seconds:9.3f}s {calls:7} calls"
+                f" {seconds / calls * 1e6:10.1f}us each" + versus(seconds, old)
+            )
+        calls = ", ".join(
+            f"{name} {count}"
+            for name, count in sorted(cycle["fs_calls"].items(), key=lambda i: -i[1])
+        )
+        print(
+            f"  filesystem calls: {cycle['fs_calls_per_entry']:.1f} per entry"
+            + versus(
+                cycle["fs_calls_per_entry"], before and before["fs_calls_per_entry"]
+            )
+        )
+        print(f"    {calls}")
+    if results["peak_memory_mb"] is not None:
+        print(f"\npeak memory: {results['peak_memory_mb']:.0f} MB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Scan/classify/move benchmark.")
+    parser.add_argument("--entries", type=int, default=10000)
+    parser.add_argument("--library", type=int, default=2000)
+    parser.add_argument("--cycles", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--runtime", choices=("serial", "async"), default="serial")
+    parser.add_argument(
+        "--memory", action="store_true", help="keep the tree in memory, not on disk"
+    )
+    parser.add_argument(
+        "--cross-device",
+        action="store_true",
+        help="with --memory, put the library on a device of its own",
+    )
+    parser.add_argument("--verbose", action="store_true", help="show its output")
+    parser.add_argument("--save", help="write the results to this file")
+    parser.add_argument("--compare", help="results saved from an earlier run")
+    args = parser.parse_args()
+
+    previous = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as previous_file:
+            previous = json.load(previous_file)
+
+    results = run(args)
+    report(results, previous)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as results_file:
+            json.dump(results, results_file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
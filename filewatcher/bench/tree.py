@@ -0,0 +1,133 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: tree.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Builds a fake incoming directory that looks like a real one: movie
+   folders with samples and junk in them, TV folders, root level movies,
+   and folders we've already tagged, plus a library that some of the
+   movies are duplicates of. Every video is a sparse file, so a 10,000
+   entry tree takes up next to no space. The same seed always gives the
+   same tree. It's built on whatever get_filesystem() returns, so it can
+   just as well be a MemoryFileSystem.
+*********************************************
+"""
+
+import os
+import random
+import time
+
+from filewatcher.bench.fuzzy import NOISE, WORDS
+from filewatcher.core.fs import get_filesystem
+
+MB = 1000 * 1000
+# a day old, so the settle detector doesn't make us wait for it
+AGE = 24 * 60 * 60
+
+
+def _release_name(title: str, year: int, rng: random.Random) -> str:
+    separator = rng.choice((".", " ", "_"))
+    noise = rng.choice(NOISE)
+    name = f"{title} {year} {noise}".strip()
+    if rng.random() < 0.3:
+        name = f"{title} ({year}) [{noise or '720p'}]"
+    return name.replace(" ", separator)
+
+
+def generate_tree(
+    incoming_dir: str,
+    movie_dir: str,
+    entries: int = 10000,
+    library: int = 2000,
+    duplicates: float = 0.1,
+    seed: int = 1,
+) -> dict[str, int]:
+    """
+    Fill incoming_dir with `entries` top level things (60% movie folders,
+    15% TV folders, 15% root level movies, 10% already tagged) and
+    movie_dir with `library` movies. `duplicates` of the movie folders are
+    already in the library. Returns how many of each kind there are.
+    """
+    fs = get_filesystem()
+    rng = random.Random(seed)
+    mtime = time.time() - AGE
+    counts = {"movies": 0, "tv": 0, "root_files": 0, "tagged": 0, "library": 0}
+
+    titles = set()
+
+    def new_title() -> tuple[str, int]:
+        while True:
+            words = rng.randint(1, 4)
+            title = " ".join(rng.choice(WORDS) for _ in range(words)).title()
+            year = rng.randint(1930, 2024)
+            if (title, year) not in titles:
+                titles.add((title, year))
+                return title, year
+
+    library_titles = []
+    for _ in range(library):
+        title, year = new_title()
+        folder = os.path.join(movie_dir, f"{title} ({year})")
+        fs.mkdir(folder)
+        fs.create_file(
+            os.path.join(folder, "movie.mkv"), rng.randint(1000, 8000) * MB, mtime
+        )
+        library_titles.append((title, year))
+        counts["library"] += 1
+
+    movies = int(entries * 0.6)
+    tv = int(entries * 0.15)
+    root_files = int(entries * 0.15)
+    tagged = entries - movies - tv - root_files
+
+    for _ in range(movies):
+        if library_titles and rng.random() < duplicates:
+            # each one only once; a second copy of the same duplicate would
+            # just be a rename collision in incoming
+            title, year = library_titles.pop(rng.randrange(len(library_titles)))
+        else:
+            title, year = new_title()
+        folder = os.path.join(incoming_dir, _release_name(title, year, rng))
+        if fs.exists(folder):
+            continue
+        fs.mkdir(folder)
+        fs.create_file(
+            os.path.join(folder, "movie.mkv"), rng.randint(700, 8000) * MB, mtime
+        )
+        if rng.random() < 0.5:
+            fs.create_file(
+                os.path.join(folder, "sample.mkv"), rng.randint(5, 20) * MB, mtime
+            )
+        for junk in rng.sample(("info.nfo", "cover.jpg", "readme.txt"), 2):
+            fs.create_file(os.path.join(folder, junk), 512, mtime)
+        counts["movies"] += 1
+
+    for n in range(tv):
+        folder = os.path.join(incoming_dir, f"Show.{n}.S{rng.randint(1, 12):02}.720p")
+        fs.mkdir(folder)
+        for episode in range(rng.randint(3, 10)):
+            fs.create_file(
+                os.path.join(folder, f"Show.{n}.E{episode + 1:02}.mkv"),
+                rng.randint(100, 500) * MB,
+                mtime,
+            )
+        counts["tv"] += 1
+
+    for _ in range(root_files):
+        title, year = new_title()
+        name = _release_name(title, year, rng) + rng.choice((".mkv", ".mp4", ".avi"))
+        fs.create_file(
+            os.path.join(incoming_dir, name), rng.randint(700, 4000) * MB, mtime
+        )
+        counts["root_files"] += 1
+
+    for n in range(tagged):
+        tag = rng.choice(("[TV]", "[SKIP]", "[DUPLICATE]"))
+        folder = os.path.join(incoming_dir, f"{tag} Something {n}")
+        fs.mkdir(folder)
+        fs.create_file(os.path.join(folder, "file.nfo"), 512, mtime)
+        counts["tagged"] += 1
+    return counts
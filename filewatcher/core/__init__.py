@@ -1,5 +1,7 @@
+import contextlib
+import contextvars
 import os
-from typing import Optional
+from typing import Iterable, Iterator, Optional
 
 from filewatcher.core.console import console
 
@@ -35,39 +37,174 @@ class StatusTag:
     SKIP: str = "[SKIP]"
 
 
-def get_root_directories() -> list[Optional[str]]:
-    return [
-        x
-        for x in os.listdir(settings.incoming_dir)
-        if os.path.isdir(os.path.join(settings.incoming_dir, x))
-    ]
+class DirectorySnapshot:
+    """
+    A single scandir() pass over one directory. The DirEntry objects hang
+    on to their stat results, so asking for a size or a type after the fact
+    doesn't go back to the disk. Given `names`, it stats just those instead
+    of listing the whole directory.
+    """
 
+    def __init__(self, path: str, names: Optional[Iterable[str]] = None):
+        # fs needs settings from here, so it can't be imported up top
+        from filewatcher.core.fs import get_filesystem
 
-def get_root_files() -> list[Optional[str]]:
-    return [
-        f
-        for f in os.listdir(settings.incoming_dir)
-        if os.path.isfile(os.path.join(settings.incoming_dir, f))
-    ]
+        self.path = path
+        self.files: dict[str, os.DirEntry] = {}
+        self.folders: dict[str, os.DirEntry] = {}
+        self._manifest = None
+
+        if names is None:
+            with get_filesystem().scandir(path) as entries:
+                for entry in entries:
+                    self._add(entry)
+        else:
+            for name in names:
+                try:
+                    self._add(get_filesystem().entry(os.path.join(path, name)))
+                except OSError:
+                    continue
+
+    def _add(self, entry: os.DirEntry) -> None:
+        try:
+            if entry.is_dir():
+                self.folders[entry.name] = entry
+            elif entry.is_file():
+                self.files[entry.name] = entry
+        except OSError:
+            # vanished out from under us; next cycle will sort it out
+            pass
+
+    def size(self, filename: str) -> int:
+        return self.files[filename].stat().st_size
+
+    def manifest(self):
+        """The FolderManifest for this folder, built the first time it's needed."""
+        if self._manifest is None:
+            # media needs settings from here, so it can't be imported up top
+            from filewatcher.core.media import FolderManifest
+
+            self._manifest = FolderManifest(self)
+        return self._manifest
+
+
+class IncomingSnapshot(DirectorySnapshot):
+    """
+    Snapshot of the incoming directory. Folders underneath it are scanned
+    the first time somebody asks for them and then reused for the rest of
+    the cycle.
+    """
+
+    def __init__(
+        self, path: Optional[str] = None, names: Optional[Iterable[str]] = None
+    ):
+        super().__init__(path or settings.incoming_dir, names)
+        self._children: dict[str, DirectorySnapshot] = {}
+
+    def folder(self, directory: str) -> DirectorySnapshot:
+        if directory not in self._children:
+            self._children[directory] = DirectorySnapshot(
+                os.path.join(self.path, directory)
+            )
+        return self._children[directory]
+
+
+def get_root_directories(
+    snapshot: Optional[IncomingSnapshot] = None,
+) -> list[Optional[str]]:
+    snapshot = snapshot or IncomingSnapshot()
+    return list(snapshot.folders)
+
+
+def get_root_files(snapshot: Optional[IncomingSnapshot] = None) -> list[Optional[str]]:
+    snapshot = snapshot or IncomingSnapshot()
+    return list(snapshot.files)
+
+
+def get_folder_snapshot(
+    directory: str, snapshot: Optional[IncomingSnapshot] = None
+) -> DirectorySnapshot:
+    if snapshot is None:
+        return DirectorySnapshot(os.path.join(settings.incoming_dir, directory))
+    return snapshot.folder(directory)
+
+
+def get_files(
+    directory: str, snapshot: Optional[IncomingSnapshot] = None
+) -> list[Optional[str]]:
+    return list(get_folder_snapshot(directory, snapshot).files)
 
 
-def get_files(directory: str) -> list[Optional[str]]:
-    return [
-        f
-        for f in os.listdir(os.path.join(settings.incoming_dir, directory))
-        if os.path.isfile(os.path.join(settings.incoming_dir, directory, f))
-    ]
+def get_folders(
+    directory: str, snapshot: Optional[IncomingSnapshot] = None
+) -> list[Optional[str]]:
+    return list(get_folder_snapshot(directory, snapshot).folders)
 
 
-def get_folders(directory: str) -> list[Optional[str]]:
-    return [
-        f
-        for f in os.listdir(os.path.join(settings.incoming_dir, directory))
-        if os.path.isdir(os.path.join(settings.incoming_dir, directory, f))
-    ]
+# the settings that belong to whichever incoming root and library we're
+# working on right now, innermost last; see base_settings.scoped()
+_scopes: contextvars.ContextVar = contextvars.ContextVar("settings_scopes", default=())
+
+
+def _scoped(name: str) -> property:
+    """
+    A setting that each incoming root or library can have its own value of.
+    Outside of settings.scoped() it's an ordinary setting.
+    """
+    private = "_" + name
+
+    def getter(self):
+        for scope in reversed(_scopes.get()):
+            if name in scope:
+                return scope[name]
+        return getattr(self, private)
+
+    def setter(self, value):
+        for scope in reversed(_scopes.get()):
+            if name in scope:
+                scope[name] = value
+                return
+        setattr(self, private, value)
+
+    return property(getter, setter)
+
+
+class _Unscoped:
+    """
+    Stands in for a scope's dict, but reads and writes the ordinary
+    settings; for the first incoming root and library, which have always
+    used those, so they still get them from inside somebody else's scope.
+    """
+
+    def __init__(self, owner: "base_settings", names: Iterable[str]):
+        self._owner = owner
+        self._names = frozenset(names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._names
+
+    def __getitem__(self, name: str):
+        return getattr(self._owner, "_" + name)
+
+    def __setitem__(self, name: str, value) -> None:
+        setattr(self._owner, "_" + name, value)
 
 
 class base_settings:
+    # one of each of these per incoming root (see core.volumes)
+    incoming_dir = _scoped("incoming_dir")
+    incoming_state_dir = _scoped("incoming_state_dir")
+    watcher = _scoped("watcher")
+    scan_state = _scoped("scan_state")
+    settle_detector = _scoped("settle_detector")
+    work_scheduler = _scoped("work_scheduler")
+    import_registry = _scoped("import_registry")
+    # ...and per library
+    movie_dir = _scoped("movie_dir")
+    library_state_dir = _scoped("library_state_dir")
+    library_index = _scoped("library_index")
+    fingerprint_store = _scoped("fingerprint_store")
+
     def __init__(self):
         self._app_name = "FileWatcher"
         self._version = 3.1
@@ -77,6 +214,13 @@ class base_settings:
         self._incoming_dir = "C:\--INCOMING--"
         self._movie_dir = "C:\Movies"
         self._audio_dir = "C:\Audio"
+        # any incoming roots and libraries after the first
+        self._more_incoming_dirs = []
+        self._more_movie_dirs = []
+        # where the first root's and library's state goes; empty means
+        # state_dir
+        self._incoming_state_dir = ""
+        self._library_state_dir = ""
 
         self._min_movie_size = "650"
         self._min_episode_size = "25"
@@ -84,6 +228,86 @@ class base_settings:
         self._video_formats = ".avi, .mkv, .mp4"
         self._audio_formats = ".mp3, .ogg, .flac, .aac, .wav, .m4a, .alac, .aiff"
 
+        self._watch_mode = "auto"
+        self._notify_socket = ""
+        self._poll_interval_min = "2"
+        self._full_scan_interval = "900"
+        self._settle_mode = "auto"
+        self._settle_time = "15"
+        self._state_dir = ".filewatcher"
+        self._import_mode = "move"
+        self._link_retention_days = "0"
+        self._duplicate_similarity = "0.85"
+        self._duplicate_year_tolerance = "1"
+        self._content_duplicates = False
+        self._verify_imports = False
+        self._workers = "1"
+        self._runtime = "serial"
+        self._retry_backoff_max = "900"
+        self._cycle_budget = "0"
+        self._copies_per_device = "1"
+        self._omdb_hit_ttl_days = "30"
+        self._omdb_miss_ttl_hours = "24"
+        self._omdb_requests_per_second = "5"
+        self._omdb_concurrency = "4"
+        self._title_index_path = ""
+        # set up on first use by filewatcher.core.fs.get_filesystem()
+        self.filesystem = None
+        # set up on first use by filewatcher.core.watcher.get_watcher()
+        self.watcher = None
+        # set up on first use by filewatcher.core.notify.get_notifier()
+        self.notifier = None
+        # set up on first use by filewatcher.core.state.get_scan_state()
+        self.scan_state = None
+        # set up on first use by filewatcher.core.settle.get_settle_detector()
+        self.settle_detector = None
+        # set up on first use by core.scheduler.get_work_scheduler()
+        self.work_scheduler = None
+        # set up on first use by filewatcher.core.workers.get_device_slots()
+        self.device_slots = None
+        # set up on first use by filewatcher.core.linking.get_import_registry()
+        self.import_registry = None
+        # set up on first use by filewatcher.core.journal.get_journal()
+        self.journal = None
+        # set up on first use by filewatcher.movies.cache.get_omdb_cache()
+        self.omdb_cache = None
+        # set up on first use by filewatcher.movies.get_omdb()
+        self.omdb = None
+        # set up on first use by filewatcher.movies.titles.get_title_index()
+        self.title_index = None
+        # set up on first use by filewatcher.movies.library.get_library_index()
+        self.library_index = None
+        # set up on first use by core.fingerprint.get_fingerprint_store()
+        self.fingerprint_store = None
+        # set up on first use by filewatcher.core.media.get_media_classifier()
+        self.media_classifier = None
+        # set up on first use by filewatcher.core.volumes.get_roots()
+        self.roots = None
+        # set up on first use by filewatcher.core.volumes.get_libraries()
+        self.libraries = None
+        # set up on first use by filewatcher.core.volumes.get_free_space()
+        self.free_space = None
+
+    @contextlib.contextmanager
+    def scoped(self, values: dict) -> Iterator[None]:
+        """
+        Within the with block, the settings in values take the place of
+        the usual ones; for this thread and whatever it hands work to, and
+        nowhere else. Setting one of them changes it in values.
+        """
+        token = _scopes.set(_scopes.get() + (values,))
+        try:
+            yield
+        finally:
+            _scopes.reset(token)
+
+    def unscoped(self, names: Iterable[str]) -> _Unscoped:
+        """
+        A scope for settings.scoped() that brings back the ordinary values
+        of names, whatever scope it's used inside of.
+        """
+        return _Unscoped(self, names)
+
     @property
     def app_name(self):
         return self._app_name
@@ -120,20 +344,24 @@ class base_settings:
         self._debug = bool(new_value)
 
     @property
-    def incoming_dir(self):
-        return self._incoming_dir
+    def incoming_dirs(self):
+        return [self._incoming_dir] + self._more_incoming_dirs
 
-    @incoming_dir.setter
-    def incoming_dir(self, new_value):
-        self._incoming_dir = new_value
+    @incoming_dirs.setter
+    def incoming_dirs(self, paths):
+        if not paths:
+            raise ValueError("incoming_directory: Needs at least one directory!")
+        self._incoming_dir, *self._more_incoming_dirs = paths
 
     @property
-    def movie_dir(self):
-        return self._movie_dir
+    def movie_dirs(self):
+        return [self._movie_dir] + self._more_movie_dirs
 
-    @movie_dir.setter
-    def movie_dir(self, new_value):
-        self._movie_dir = new_value
+    @movie_dirs.setter
+    def movie_dirs(self, paths):
+        if not paths:
+            raise ValueError("movie_directory: Needs at least one directory!")
+        self._movie_dir, *self._more_movie_dirs = paths
 
     @property
     def audio_dir(self):
@@ -143,6 +371,192 @@ class base_settings:
     def audio_dir(self, new_value):
         self._audio_dir = new_value
 
+    @property
+    def settle_mode(self):
+        return self._settle_mode
+
+    @settle_mode.setter
+    def settle_mode(self, value):
+        if value not in ("auto", "quiescence", "rename"):
+            raise ValueError("settle_mode: Must be one of auto, quiescence, or rename!")
+        self._settle_mode = value
+
+    @property
+    def settle_time(self):
+        return self._settle_time
+
+    @settle_time.setter
+    def settle_time(self, value):
+        if int(value) < 0:
+            raise ValueError("settle_time: Cannot be less than 0!")
+        self._settle_time = value
+
+    @property
+    def state_dir(self):
+        return self._state_dir
+
+    @state_dir.setter
+    def state_dir(self, new_value):
+        self._state_dir = new_value
+
+    @property
+    def import_mode(self):
+        return self._import_mode
+
+    @import_mode.setter
+    def import_mode(self, value):
+        if value not in ("move", "link"):
+            raise ValueError("import_mode: Must be either move or link!")
+        self._import_mode = value
+
+    @property
+    def link_retention_days(self):
+        return self._link_retention_days
+
+    @link_retention_days.setter
+    def link_retention_days(self, value):
+        if float(value) < 0:
+            raise ValueError("link_retention_days: Cannot be less than 0!")
+        self._link_retention_days = value
+
+    @property
+    def duplicate_similarity(self):
+        return self._duplicate_similarity
+
+    @duplicate_similarity.setter
+    def duplicate_similarity(self, value):
+        if not 0 < float(value) <= 1:
+            raise ValueError("duplicate_similarity: Must be between 0 and 1!")
+        self._duplicate_similarity = value
+
+    @property
+    def duplicate_year_tolerance(self):
+        return self._duplicate_year_tolerance
+
+    @duplicate_year_tolerance.setter
+    def duplicate_year_tolerance(self, value):
+        if int(value) < 0:
+            raise ValueError("duplicate_year_tolerance: Cannot be less than 0!")
+        self._duplicate_year_tolerance = value
+
+    @property
+    def content_duplicates(self):
+        return self._content_duplicates
+
+    @content_duplicates.setter
+    def content_duplicates(self, value):
+        if isinstance(value, str):
+            value = value.strip().lower() in ("true", "yes", "on", "1")
+        self._content_duplicates = bool(value)
+
+    @property
+    def verify_imports(self):
+        return self._verify_imports
+
+    @verify_imports.setter
+    def verify_imports(self, value):
+        if isinstance(value, str):
+            value = value.strip().lower() in ("true", "yes", "on", "1")
+        self._verify_imports = bool(value)
+
+    @property
+    def workers(self):
+        return self._workers
+
+    @workers.setter
+    def workers(self, value):
+        if int(value) < 1:
+            raise ValueError("workers: Cannot be less than 1!")
+        self._workers = value
+
+    @property
+    def runtime(self):
+        return self._runtime
+
+    @runtime.setter
+    def runtime(self, value):
+        if value not in ("serial", "async"):
+            raise ValueError("runtime: Must be either serial or async!")
+        self._runtime = value
+
+    @property
+    def retry_backoff_max(self):
+        return self._retry_backoff_max
+
+    @retry_backoff_max.setter
+    def retry_backoff_max(self, value):
+        if float(value) < 1:
+            raise ValueError("retry_backoff_max: Cannot be less than 1!")
+        self._retry_backoff_max = value
+
+    @property
+    def cycle_budget(self):
+        return self._cycle_budget
+
+    @cycle_budget.setter
+    def cycle_budget(self, value):
+        if float(value) < 0:
+            raise ValueError("cycle_budget: Cannot be less than 0!")
+        self._cycle_budget = value
+
+    @property
+    def copies_per_device(self):
+        return self._copies_per_device
+
+    @copies_per_device.setter
+    def copies_per_device(self, value):
+        if int(value) < 1:
+            raise ValueError("copies_per_device: Cannot be less than 1!")
+        self._copies_per_device = value
+
+    @property
+    def omdb_hit_ttl_days(self):
+        return self._omdb_hit_ttl_days
+
+    @omdb_hit_ttl_days.setter
+    def omdb_hit_ttl_days(self, value):
+        if float(value) < 0:
+            raise ValueError("omdb_hit_ttl_days: Cannot be less than 0!")
+        self._omdb_hit_ttl_days = value
+
+    @property
+    def omdb_miss_ttl_hours(self):
+        return self._omdb_miss_ttl_hours
+
+    @omdb_miss_ttl_hours.setter
+    def omdb_miss_ttl_hours(self, value):
+        if float(value) < 0:
+            raise ValueError("omdb_miss_ttl_hours: Cannot be less than 0!")
+        self._omdb_miss_ttl_hours = value
+
+    @property
+    def omdb_requests_per_second(self):
+        return self._omdb_requests_per_second
+
+    @omdb_requests_per_second.setter
+    def omdb_requests_per_second(self, value):
+        if float(value) < 0:
+            raise ValueError("omdb_requests_per_second: Cannot be less than 0!")
+        self._omdb_requests_per_second = value
+
+    @property
+    def omdb_concurrency(self):
+        return self._omdb_concurrency
+
+    @omdb_concurrency.setter
+    def omdb_concurrency(self, value):
+        if int(value) < 1:
+            raise ValueError("omdb_concurrency: Cannot be less than 1!")
+        self._omdb_concurrency = value
+
+    @property
+    def title_index_path(self):
+        return self._title_index_path
+
+    @title_index_path.setter
+    def title_index_path(self, new_value):
+        self._title_index_path = new_value
+
     @property
     def min_movie_size(self):
         return self._min_movie_size
@@ -170,6 +584,8 @@ class base_settings:
     @exts_to_delete.setter
     def exts_to_delete(self, value):
         self._exts_to_delete = value
+        # rebuilt with the new list next time somebody asks for it
+        self.media_classifier = None
 
     @property
     def video_formats(self):
@@ -178,6 +594,7 @@ class base_settings:
     @video_formats.setter
     def video_formats(self, value):
         self._video_formats = value
+        self.media_classifier = None
 
     @property
     def audio_formats(self):
@@ -186,6 +603,47 @@ class base_settings:
     @audio_formats.setter
     def audio_formats(self, value):
         self._audio_formats = value
+        self.media_classifier = None
+
+    @property
+    def watch_mode(self):
+        return self._watch_mode
+
+    @watch_mode.setter
+    def watch_mode(self, value):
+        if value not in ("auto", "inotify", "adaptive", "poll"):
+            raise ValueError(
+                "watch_mode: Must be one of auto, inotify, adaptive, or poll!"
+            )
+        self._watch_mode = value
+
+    @property
+    def notify_socket(self):
+        return self._notify_socket
+
+    @notify_socket.setter
+    def notify_socket(self, value):
+        self._notify_socket = value
+
+    @property
+    def poll_interval_min(self):
+        return self._poll_interval_min
+
+    @poll_interval_min.setter
+    def poll_interval_min(self, value):
+        if float(value) <= 0:
+            raise ValueError("poll_interval_min: Must be greater than 0!")
+        self._poll_interval_min = value
+
+    @property
+    def full_scan_interval(self):
+        return self._full_scan_interval
+
+    @full_scan_interval.setter
+    def full_scan_interval(self, value):
+        if float(value) < 0:
+            raise ValueError("full_scan_interval: Cannot be less than 0!")
+        self._full_scan_interval = value
 
     @property
     def banned_characters(self):
@@ -1,3 +1,14 @@
+import threading
+
 from rich.console import Console
 
 console = Console()
+
+# the workers all talk at once; this keeps their lines from running together
+output_lock = threading.RLock()
+
+
+def say(*args, **kwargs) -> None:
+    """print(), but one thread at a time."""
+    with output_lock:
+        print(*args, **kwargs)
@@ -19,70 +19,104 @@
 from __future__ import print_function
 
 import os
-import shutil
-import time
-from typing import Optional
+from typing import Callable, Optional
 
 from filewatcher.core import (
+    DirectorySnapshot,
+    IncomingSnapshot,
     StatusTag,
     settings,
-    get_files,
     get_folders,
     get_root_files,
     get_root_directories,
 )
 from filewatcher.movies.movies import (
+    files_to_delete,
     is_video_folder,
+    prefetch_lookups,
     process_movie,
     rename_duplicate,
     rename_skipped,
     folder_translator,
     process_root_level_movie,
 )
-from filewatcher.core.console import console
+from filewatcher.movies.library import (
+    find_in_library,
+    get_library_index,
+    report_similar,
+)
+from filewatcher.core import journal
+from filewatcher.core.console import console, output_lock, say
+from filewatcher.core.fs import get_filesystem
+from filewatcher.core.linking import IMPORTED, get_import_registry, link_tree
+from filewatcher.core.media import get_media_classifier
+from filewatcher.core.notify import get_notifier
+from filewatcher.core.scheduler import get_work_scheduler
+from filewatcher.core.settle import get_settle_detector
+from filewatcher.core.state import ScanState, get_scan_state
+from filewatcher.core.verify import VerificationError, record_import
+from filewatcher.core.volumes import get_libraries, placed
+from filewatcher.core.watcher import get_watcher
+from filewatcher.core.workers import (
+    CopyQueue,
+    get_copy_queue,
+    get_device_slots,
+    run_in_pool,
+    will_copy,
+)
 
 # from audio.music import is_audio_folder
 
 
 def debug_message(message: str) -> None:
     if settings.debug:
-        console.log(message)
+        with output_lock:
+            console.log(message)
 
 
 settings.debug_message = debug_message
 
 
-def in_use(test_file: str) -> bool:
-    # yes, possible race condition, but due to the system we're putting this
-    # into race conditions will not be an issue.
+def in_use(test_file: str, folder: Optional[DirectorySnapshot] = None) -> bool:
+    # hand over the folder snapshot and every file in it gets checked using
+    # the stat results we already have
+    detector = get_settle_detector()
 
-    try:
-        settings.debug_message("Testing to see if {} is in use".format(test_file))
-        os.rename(test_file, test_file + "_")
-        os.rename(test_file + "_", test_file)
+    settings.debug_message("Testing to see if {} is in use".format(test_file))
+    notifier = get_notifier()
+    if notifier is not None and notifier.is_complete(
+        os.path.relpath(test_file, settings.incoming_dir).split(os.sep)[0]
+    ):
+        # the download client says it's done, and it would know
+        settings.debug_message("Download client says it's finished! Proceed!")
+        return False
+    if folder is not None:
+        settled = detector.folder_is_settled(folder)
+    else:
+        settled = detector.is_settled(test_file)
+
+    if settled:
         settings.debug_message("Not in use! Proceed!")
         return False
-    except OSError:
-        settings.debug_message("File in use!")
-        return True
+    settings.debug_message("File in use!")
+    return True
 
 
 settings.in_use = in_use
 
 
 def get_extension(filename: str) -> Optional[str]:
-    last_dot = filename.rfind(".")
-    # if rfind fails, it returns -1
-    if last_dot > 0:
-        return filename[last_dot:]
-    else:
-        return None
+    return get_media_classifier().extension(filename)
 
 
 settings.get_extension = get_extension
 
 
-def move_folder(new_directory: str, dir_type="movie") -> None:
+def move_folder(
+    new_directory: str, dir_type="movie", source_directory: Optional[str] = None
+) -> None:
+    # source_directory is only given in link mode, where the download keeps
+    # its original name in the incoming directory
     if dir_type == "movie":
         settings_dir = settings.movie_dir
     elif dir_type == "audio":
@@ -92,30 +126,77 @@ def move_folder(new_directory: str, dir_type="movie") -> None:
 
     if new_directory is None:
         settings.debug_message("Something went wrong! Skipping!")
+        return
+
+    # in link mode the download is still sitting there under its own name
+    incoming_name = source_directory or new_directory
+
+    if dir_type == "movie":
+        # catches `Aladdin 1992` when we're about to bring in `Aladdin (1992)`
+        existing = find_in_library(new_directory)
+    elif get_filesystem().isdir(os.path.join(settings_dir, new_directory)):
+        existing = new_directory
     else:
-        if not os.path.isdir(os.path.join(settings_dir, new_directory)):
-            try:
-                shutil.move(
-                    os.path.join(settings.incoming_dir, new_directory),
-                    os.path.join(settings_dir, new_directory),
-                )
+        existing = None
+
+    if existing is None:
+        if dir_type == "movie":
+            report_similar(new_directory)
+        try:
+            if source_directory is not None:
+                link_folder(source_directory, new_directory, settings_dir)
+            else:
+                source = os.path.join(settings.incoming_dir, new_directory)
+                destination = os.path.join(settings_dir, new_directory)
+                with get_device_slots().transfer(source, settings_dir):
+                    stats = journal.move(
+                        source, destination, verify=settings.verify_imports
+                    )
                 settings.debug_message(
-                    "Move successful! Folder {} now located at {}".format(
-                        new_directory, os.path.join(settings_dir, new_directory)
+                    "Move successful! Folder {} now located at {} ({})".format(
+                        new_directory, destination, stats
                     )
                 )
-            except (OSError, shutil.Error):
-                print(
-                    f"{new_directory} is already in the destination directory! Renaming!"
-                )
-                rename_duplicate(new_directory)
-        else:
-            print(
+                record_import(destination, stats.hashes)
+        except VerificationError as e:
+            # the original is still there; try again next time around
+            say(f"{new_directory} didn't copy over intact! Leaving it be. ({e})")
+            return
+        except OSError:
+            say(f"{new_directory} is already in the destination directory! Renaming!")
+            rename_duplicate(incoming_name)
+            return
+        if dir_type == "movie":
+            get_library_index().add(new_directory)
+    else:
+        if existing == new_directory:
+            say(
                 "{} is already in the destination directory! Renaming!".format(
                     new_directory
                 )
             )
-            rename_duplicate(new_directory)
+        else:
+            say(f"{new_directory} is already in the library as {existing}! Renaming!")
+        rename_duplicate(incoming_name)
+
+
+def link_folder(source_directory: str, new_directory: str, settings_dir: str) -> None:
+    source = os.path.join(settings.incoming_dir, source_directory)
+    destination = os.path.join(settings_dir, new_directory)
+
+    folder = DirectorySnapshot(source)
+    exclude = files_to_delete(source_directory, list(folder.files), folder)
+
+    # links can't cross devices, so anything that isn't a same-device link
+    # ends up as a copy and waits its turn like any other
+    with get_device_slots().transfer(source, settings_dir):
+        methods = link_tree(source, destination, exclude)
+    get_import_registry().record(source_directory, destination)
+    record_import(destination)
+    settings.debug_message(
+        f"Link successful! {source_directory} now available at {destination}"
+        f" ({methods})"
+    )
 
 
 def rename_folder(directory: str) -> Optional[str]:
@@ -124,7 +205,7 @@ def rename_folder(directory: str) -> Optional[str]:
     translated_folder = folder_translator(directory)
 
     if translated_folder is None:
-        print(f"{directory} has an issue I can't recover from. Skipping!")
+        say(f"{directory} has an issue I can't recover from. Skipping!")
         try:
             rename_skipped(directory)
         except OSError:
@@ -133,7 +214,7 @@ def rename_folder(directory: str) -> Optional[str]:
         title, year = translated_folder
         new_directory = f"{title} ({year})"
         try:
-            os.rename(
+            journal.rename(
                 os.path.join(settings.incoming_dir, directory),
                 os.path.join(settings.incoming_dir, new_directory),
             )
@@ -147,26 +228,123 @@ def rename_folder(directory: str) -> Optional[str]:
         return new_directory
 
 
+@placed
 def rename_and_move(directory: str) -> None:
-    new_folder = rename_folder(directory)
-    if type(new_folder) is None:
-        settings.debug_message(f"Encountered an issue with {directory}! Skipping!")
-    else:
-        move_folder(new_folder)
+    if settings.import_mode == "link":
+        # leave the download alone so it can keep seeding; the library gets
+        # the nicely named version
+        translated_folder = folder_translator(directory)
+        if translated_folder is None:
+            say(f"{directory} has an issue I can't recover from. Skipping!")
+            try:
+                rename_skipped(directory)
+            except OSError:
+                settings.debug_message(f"Unable to mark {directory} as skipped!")
+        else:
+            title, year = translated_folder
+            move_folder(f"{title} ({year})", source_directory=directory)
+        return
+
+    # if we go down part way through, the journal knows whether to finish
+    # the move or put the original name back
+    with journal.transaction(f"import of {directory}", ["rename", "move"]):
+        new_folder = rename_folder(directory)
+        if type(new_folder) is None:
+            settings.debug_message(f"Encountered an issue with {directory}! Skipping!")
+        else:
+            move_folder(new_folder)
+
 
+def import_or_queue(
+    import_function: Callable[[str], None], copies: CopyQueue, name: str
+) -> None:
+    """
+    import_function(name) right here if it's a rename, or on `copies` if
+    it's a copy, so whoever called us can get on with something else.
+    """
+    if not will_copy(os.path.join(settings.incoming_dir, name)):
+        import_function(name)
+        return
 
-def root_level_files(files):
+    scheduler = get_work_scheduler()
+
+    def copy() -> None:
+        try:
+            import_function(name)
+        except OSError as e:
+            scheduler.error(name, e)
+
+    settings.debug_message(f"{name} is a copy; queueing it")
+    copies.submit(copy)
+
+
+def fresh_entries(
+    kind: str, names: list[str], entries: dict, state: Optional[ScanState]
+) -> list[str]:
+    """The names that have changed since we last decided to leave them be."""
+    if state is None:
+        return names
+    fresh = [name for name in names if not state.unchanged(kind, entries.get(name))]
+    settings.debug_message(
+        f"{len(names) - len(fresh)} {kind} unchanged since last time."
+    )
+    return fresh
+
+
+def root_file_wanted(
+    prospect_file: str,
+    snapshot: Optional[IncomingSnapshot] = None,
+    state: Optional[ScanState] = None,
+) -> bool:
+    """
+    Is prospect_file a movie we should be importing? Anything that isn't is
+    remembered, so it's left alone until it changes.
+    """
+    if not check_for_skips(prospect_file):
+        if get_media_classifier().is_video(prospect_file):
+            return True
+
+    # nothing we'll ever do with this one unless it changes
+    if state is not None:
+        entries = snapshot.files if snapshot else {}
+        state.remember(ScanState.FILES, entries.get(prospect_file))
+    return False
+
+
+def root_level_files(
+    files,
+    snapshot: Optional[IncomingSnapshot] = None,
+    state: Optional[ScanState] = None,
+    copies: Optional[CopyQueue] = None,
+):
     settings.debug_message(f"Found root level files: {files}")
 
-    files = [f for f in files if f not in settings.filenames_to_ignore]
+    classifier = get_media_classifier()
+    files = [f for f in files if classifier.kind(f) != classifier.IGNORE]
+    entries = snapshot.files if snapshot else {}
+    files = fresh_entries(ScanState.FILES, files, entries, state)
+    scheduler = get_work_scheduler()
+    files = scheduler.plan(files, entries)
+
+    # anything without a year is going to need the OMDb; ask about all of
+    # them at once instead of one at a time in the loop below
+    prefetch_lookups(
+        [f for f in classifier.classify(files).video if not check_for_skips(f)]
+    )
+
+    queue = copies or get_copy_queue()
+
+    def process_file(prospect_file: str) -> None:
+        if root_file_wanted(prospect_file, snapshot, state):
+            if not settings.in_use(os.path.join(settings.incoming_dir, prospect_file)):
+                import_or_queue(process_root_level_movie, queue, prospect_file)
+            # either it's gone now or it needs another look later
 
     for prospect_file in files:
-        if not check_for_skips(prospect_file):
-            if get_extension(prospect_file) in settings.video_formats:
-                if not settings.in_use(
-                    os.path.join(settings.incoming_dir, prospect_file)
-                ):
-                    process_root_level_movie(prospect_file)
+        scheduler.run(prospect_file, lambda: process_file(prospect_file))
+
+    if copies is None:
+        queue.join()
 
         # if get_extension(prospect_file) in settings.audio_formats:
         #     if not settings.in_use(os.path.join(settings.incoming_dir,
@@ -175,7 +353,14 @@ def root_level_files(files):
 
 
 def check_for_skips(item: str) -> bool:
-    if StatusTag.TV in item:
+    status = get_import_registry().status(item)
+    if status == IMPORTED:
+        settings.debug_message("Found previously linked download. Skipping!")
+        return True
+    elif status is not None:
+        settings.debug_message(f"Found download previously marked {status}. Skipping!")
+        return True
+    elif StatusTag.TV in item:
         settings.debug_message("Found previously scanned TV folder. Skipping!")
         return True
     elif StatusTag.DUPLICATE in item:
@@ -192,72 +377,258 @@ def check_for_skips(item: str) -> bool:
         return False
 
 
-def process_folders(dirs):
-    for directory in dirs:
-        settings.debug_message(f"Switching to directory {directory}")
-
-        if not check_for_skips(directory):
+def _remember_folder(
+    directory: str, snapshot: IncomingSnapshot, state: Optional[ScanState]
+) -> None:
+    # a directory's mtime only moves when entries are added, removed, or
+    # renamed, which is exactly when our answers about it could change
+    if state is not None:
+        state.remember(ScanState.FOLDERS, snapshot.folders.get(directory))
+
+
+def settle_folder(
+    directory: str,
+    snapshot: IncomingSnapshot,
+    state: Optional[ScanState] = None,
+    importer: Optional[Callable[[str], None]] = None,
+) -> Optional[DirectorySnapshot]:
+    """
+    The first half of process_folder(): leaves tagged folders alone, deals
+    with the ones that don't have any files in them, and makes sure the
+    download is finished. Returns the folder's snapshot if it's ready for
+    classify_folder(). `importer` is what to hand a DVD rip (a VIDEO_TS
+    folder) to; rename_and_move() unless somebody says otherwise.
+    """
+    settings.debug_message(f"Switching to directory {directory}")
+
+    if check_for_skips(directory):
+        _remember_folder(directory, snapshot, state)
+        return None
 
-            dir_files = get_files(directory)
+    try:
+        folder = snapshot.folder(directory)
+    except OSError:
+        settings.debug_message(f"{directory} disappeared! Skipping!")
+        return None
+    dir_files = list(folder.files)
 
-            try:
-                if not in_use(
-                    os.path.join(settings.incoming_dir, directory, dir_files[0])
-                ):
-                    settings.debug_message(
-                        "Folder is good to go - time to see if it's a video folder!"
-                    )
-                    if is_video_folder(directory, dir_files):
-                        process_movie(directory, dir_files, rename_and_move)
-                    else:
-                        settings.debug_message(
-                            "Folder does not appear to be a movie. Skipping."
-                        )
-
-                    # if is_audio_folder(directory, dir_files):
-                    #     #  There will eventually be a process_audio() function
-                    #     #  here, but for now we just need to move stuff.
-                    #     move_folder(directory, 'audio')
-                    # else:
-                    #     settings.debug_message(
-                    #         "Folder does not appear to be an album. Skipping."
-                    #     )
-
-            except IndexError:
-                try:
-                    dir_folders = get_folders(directory)
-
-                    if "video_ts" in dir_folders:
-                        rename_and_move(directory)
-
-                except IndexError:
-                    settings.debug_message(
-                        "Folder appears to be empty. Will mark as skip and move on."
-                    )
-                    rename_skipped(directory)
+    if not dir_files:
+        try:
+            dir_folders = get_folders(directory, snapshot)
 
+            if "video_ts" in dir_folders:
+                (importer or rename_and_move)(directory)
             else:
-                settings.debug_message("Can't use folder! Moving to next folder.")
+                _remember_folder(directory, snapshot, state)
 
+        except IndexError:
+            settings.debug_message(
+                "Folder appears to be empty. Will mark as skip and move on."
+            )
+            rename_skipped(directory)
+        return None
 
-def main_loop():
+    if in_use(os.path.join(settings.incoming_dir, directory, dir_files[0]), folder):
+        settings.debug_message("Can't use folder! Moving to next folder.")
+        return None
+
+    settings.debug_message("Folder is good to go - time to see if it's a video folder!")
+    return folder
+
+
+def classify_folder(
+    directory: str,
+    folder: DirectorySnapshot,
+    snapshot: IncomingSnapshot,
+    state: Optional[ScanState] = None,
+    importer: Optional[Callable[[str], None]] = None,
+) -> None:
+    """
+    The second half of process_folder(): works out what's in a finished
+    download and cleans it up. Movies are handed to `importer`
+    (rename_and_move() unless somebody says otherwise).
+    """
+    dir_files = list(folder.files)
+    if is_video_folder(directory, dir_files):
+        process_movie(directory, dir_files, importer or rename_and_move, folder)
+    else:
+        settings.debug_message("Folder does not appear to be a movie. Skipping.")
+        _remember_folder(directory, snapshot, state)
+
+    # if is_audio_folder(directory, dir_files):
+    #     #  There will eventually be a process_audio() function
+    #     #  here, but for now we just need to move stuff.
+    #     move_folder(directory, 'audio')
+    # else:
+    #     settings.debug_message(
+    #         "Folder does not appear to be an album. Skipping."
+    #     )
+
+
+def process_folder(
+    directory: str,
+    snapshot: IncomingSnapshot,
+    state: Optional[ScanState] = None,
+    importer: Optional[Callable[[str], None]] = None,
+) -> None:
+    folder = settle_folder(directory, snapshot, state, importer)
+    if folder is not None:
+        classify_folder(directory, folder, snapshot, state, importer)
+
+
+def process_folders(
+    dirs,
+    snapshot: Optional[IncomingSnapshot] = None,
+    state: Optional[ScanState] = None,
+    copies: Optional[CopyQueue] = None,
+):
+    """
+    Settle, classify and import dirs, `workers` at a time. Copies go on
+    `copies` if we're given one, and are waited for before we return if
+    we aren't.
+    """
+    snapshot = snapshot or IncomingSnapshot()
+    dirs = fresh_entries(ScanState.FOLDERS, dirs, snapshot.folders, state)
+    scheduler = get_work_scheduler()
+    dirs = scheduler.plan(dirs, snapshot.folders)
+
+    # make sure the shared helpers exist before any worker threads go
+    # looking for them
+    get_settle_detector()
+    get_device_slots()
+    get_import_registry()
+
+    queue = copies or get_copy_queue()
+
+    def importer(directory: str) -> None:
+        import_or_queue(rename_and_move, queue, directory)
+
+    run_in_pool(
+        lambda directory: scheduler.run(
+            directory, lambda: process_folder(directory, snapshot, state, importer)
+        ),
+        dirs,
+        int(settings.workers),
+    )
+
+    if copies is None:
+        queue.join()
+
+
+def wait_for_work(watcher) -> None:
+    # anything that was still being written or failed to move gets another
+    # look once it's backed off, and anything we didn't get to gets one
+    # right away, whether or not the watcher hears about them
+    scheduler = get_work_scheduler()
+    watcher.wait(scheduler.wait_time(int(settings.delay_time)))
+    if watcher.changed is not None:
+        watcher.changed |= scheduler.pending()
+
+    # finished downloads we've been told about don't wait for anything
+    notifier = get_notifier()
+    notified = notifier.take() if notifier is not None else set()
+    if notified:
+        scheduler.forgive(notified)
+        if watcher.changed is not None:
+            watcher.changed |= notified
+
+
+def start_cycle(
+    watcher,
+) -> Optional[tuple[IncomingSnapshot, list[str], list[str], ScanState]]:
+    """
+    Everything a cycle does before it gets down to work: the snapshot of the
+    incoming directory, the root level folders and files worth looking at,
+    and the scan state. None if the watcher says there's nothing to do (in
+    which case we've already waited for it).
+    """
     # search directories and start figuring out what's what
     # returns first level folder names under dir
+    changed = watcher.changed
+
+    if changed is not None and not changed:
+        # the watcher says nothing happened, so don't bother looking
+        wait_for_work(watcher)
+        return None
+
+    # pick up anything that's been added to or removed from the libraries
+    # by hand; this is a single stat each if nothing has
+    for library in get_libraries():
+        with library.active():
+            get_library_index().refresh()
+
+    # clean up linked downloads that are done seeding
+    get_import_registry().expire(float(settings.link_retention_days))
+
+    notifier = get_notifier()
+    notified = set() if notifier is None else notifier.completed & (changed or set())
+    state = get_scan_state()
+
+    if changed and changed == notified:
+        # only what the download client told us about, so there's no need
+        # to go through the rest of the incoming directory
+        snapshot = IncomingSnapshot(names=changed)
+        dirs = get_root_directories(snapshot)
+        files = get_root_files(snapshot)
+        notifier.prune(notifier.completed - (changed - set(dirs + files)))
+        get_work_scheduler().begin_cycle(None, float(settings.cycle_budget))
+    else:
+        # one pass over the incoming directory serves the whole cycle
+        snapshot = IncomingSnapshot()
+        dirs = get_root_directories(snapshot)
+        # check for files that aren't under their own folders for some
+        # godforsaken reason
+        files = get_root_files(snapshot)
+
+        state.prune(ScanState.FOLDERS, dirs)
+        state.prune(ScanState.FILES, files)
+        get_import_registry().prune(dirs + files)
+        get_work_scheduler().begin_cycle(dirs + files, float(settings.cycle_budget))
+        if notifier is not None:
+            notifier.prune(dirs + files)
+
+    # whatever we decided about these before, they're done now
+    for name in notified:
+        state.forget(ScanState.FOLDERS, name)
+        state.forget(ScanState.FILES, name)
+
+    detector = get_settle_detector()
+    detector.begin_cycle()
+
+    if changed is not None:
+        dirs = [d for d in dirs if d in changed]
+        files = [f for f in files if f in changed]
 
-    dirs = get_root_directories()
     settings.debug_message("Found directories: {}".format(dirs))
 
-    process_folders(dirs)
+    return snapshot, dirs, files, state
 
-    # check for files that aren't under their own folders for some
-    # godforsaken reason
-    files = get_root_files()
 
-    if files is not []:
-        root_level_files(files)
+def finish_cycle(watcher, state: ScanState) -> None:
+    """Save what we learned and wait for the next cycle."""
+    state.save()
+    for library in get_libraries():
+        with library.active():
+            get_library_index().save()
+    wait_for_work(watcher)
+
+
+def main_loop():
+    watcher = get_watcher()
+    cycle = start_cycle(watcher)
+    if cycle is None:
+        return
+    snapshot, dirs, files, state = cycle
+
+    # one queue for the whole cycle, so the root level files don't have to
+    # wait for the folders' copies to finish
+    copies = get_copy_queue()
+    try:
+        process_folders(dirs, snapshot, state, copies)
 
-    settings.debug_message("Sleeping for {} seconds!".format(settings.delay_time))
+        if files:
+            root_level_files(files, snapshot, state, copies)
+    finally:
+        copies.join()
 
-    console.print(f"Sleeping for {settings.delay_time} seconds!\r")
-    time.sleep(int(settings.delay_time))
-    console.print("Working...                  \r")
+    finish_cycle(watcher, state)
@@ -0,0 +1,269 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: fingerprint.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Recognizes the same file under a different name without reading all of
+   it. A fingerprint is the file's size plus a hash of a few sampled blocks
+   (the start, the end, and some evenly spaced ones in between), which is
+   plenty to tell two 50GB movies apart while only reading a few hundred
+   KB of each. Fingerprints are remembered by inode, size, and mtime so a
+   file is only ever sampled once, and a batch of them gets worked on by a
+   pool of processes.
+*********************************************
+"""
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Optional
+
+from filewatcher.core import settings
+
+FINGERPRINT_FILENAME = "fingerprints.json"
+SAMPLE_SIZE = 64 * 1024
+# blocks sampled between the first and last ones
+STRIDES = 4
+
+
+def _pread(fd: int, length: int, offset: int) -> bytes:
+    if hasattr(os, "pread"):
+        return os.pread(fd, length, offset)
+    # Windows
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, length)
+
+
+def sample_offsets(size: int) -> list[int]:
+    """Where the sampled blocks start in a file of this size."""
+    if size <= SAMPLE_SIZE * (STRIDES + 2):
+        # small enough to just read the whole thing
+        return list(range(0, size, SAMPLE_SIZE))
+    middle = [size * (n + 1) // (STRIDES + 1) for n in range(STRIDES)]
+    return [0, *middle, size - SAMPLE_SIZE]
+
+
+def sample_fingerprint(path: str) -> str:
+    """Size plus a hash of sampled blocks, e.g. '5f5e100-3b1f...'."""
+    fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        size = os.fstat(fd).st_size
+        digest = hashlib.blake2b(digest_size=16)
+        for offset in sample_offsets(size):
+            digest.update(_pread(fd, SAMPLE_SIZE, offset))
+    finally:
+        os.close(fd)
+    return f"{size:x}-{digest.hexdigest()}"
+
+
+def _fingerprint_or_none(path: str) -> Optional[str]:
+    # runs in a worker process; an OSError there would take the whole batch
+    # down with it
+    try:
+        return sample_fingerprint(path)
+    except OSError:
+        return None
+
+
+class FingerprintStore:
+    """
+    Remembers fingerprints by path along with the inode, size, and mtime
+    they were taken at, and which fingerprints belong to files in the
+    library.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dirty = False
+        self._lock = threading.Lock()
+        # one library update at a time; they'd only duplicate each other's work
+        self._index_lock = threading.Lock()
+        # path -> [ino, size, mtime_ns, fingerprint]
+        self._files: dict[str, list] = {}
+        # library entry name -> mtime_ns when we last fingerprinted it
+        self._library_entries: dict[str, int] = {}
+        # fingerprint -> library path
+        self._library: dict[str, str] = {}
+        self._library_dir: Optional[str] = None
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as store_file:
+                loaded = json.load(store_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            settings.debug_message(f"Fingerprints at {self.path} are unreadable!")
+            return
+        self._files = loaded.get("files", {})
+        self._library_entries = loaded.get("library_entries", {})
+        self._library_dir = loaded.get("library_dir")
+        self._rebuild_library()
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with self._lock:
+            with open(temp_path, "w", encoding="utf-8") as store_file:
+                json.dump(
+                    {
+                        "files": self._files,
+                        "library_entries": self._library_entries,
+                        "library_dir": self._library_dir,
+                    },
+                    store_file,
+                )
+                self.dirty = False
+            # every incoming root checks against the same libraries, so two
+            # of them can end up in here at once
+            os.replace(temp_path, self.path)
+
+    def _rebuild_library(self) -> None:
+        self._library = {}
+        if self._library_dir is None:
+            return
+        prefix = os.path.join(self._library_dir, "")
+        for file_path, (_, _, _, fingerprint) in self._files.items():
+            if file_path.startswith(prefix):
+                self._library[fingerprint] = file_path
+
+    def _cached(self, path: str, stat: os.stat_result) -> Optional[str]:
+        known = self._files.get(path)
+        if known and known[:3] == [stat.st_ino, stat.st_size, stat.st_mtime_ns]:
+            return known[3]
+        return None
+
+    def fingerprints(self, paths: Iterable[str]) -> dict[str, str]:
+        """Fingerprint every path we can, reusing what we already know."""
+        results = {}
+        missing = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            cached = self._cached(path, stat)
+            if cached is not None:
+                results[path] = cached
+            else:
+                missing[path] = stat
+
+        if not missing:
+            return results
+
+        settings.debug_message(f"Fingerprinting {len(missing)} file(s)...")
+        if len(missing) == 1:
+            computed = map(_fingerprint_or_none, missing)
+        else:
+            workers = min(len(missing), os.cpu_count() or 1, 8)
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                computed = list(pool.map(_fingerprint_or_none, missing))
+
+        with self._lock:
+            for (path, stat), fingerprint in zip(missing.items(), computed):
+                if fingerprint is None:
+                    continue
+                results[path] = fingerprint
+                self._files[path] = [
+                    stat.st_ino,
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    fingerprint,
+                ]
+                self.dirty = True
+        return results
+
+    def _by_entry(self, library_dir: str) -> dict[str, list[str]]:
+        """Known library files, grouped by the top level entry they're in."""
+        prefix = os.path.join(library_dir, "")
+        grouped: dict[str, list[str]] = {}
+        for file_path in self._files:
+            if file_path.startswith(prefix):
+                name = file_path[len(prefix) :].split(os.sep, 1)[0]
+                grouped.setdefault(name, []).append(file_path)
+        return grouped
+
+    def index_library(
+        self, library_dir: str, entries: dict[str, int], wanted: Callable[[str], bool]
+    ) -> None:
+        """
+        Make sure every file in the library that wanted(filename) likes has
+        a fingerprint. `entries` maps each top level library entry to its
+        mtime; only the ones that changed since last time get looked into.
+        """
+        with self._index_lock:
+            self._index_library(library_dir, entries, wanted)
+
+    def _index_library(
+        self, library_dir: str, entries: dict[str, int], wanted: Callable[[str], bool]
+    ) -> None:
+        with self._lock:
+            if library_dir != self._library_dir:
+                self._library_dir = library_dir
+                self._library_entries = {}
+                self.dirty = True
+            # anything we fingerprinted on its way in has moved on by now
+            for file_path in list(self._files):
+                if not file_path.startswith(
+                    os.path.join(library_dir, "")
+                ) and not os.path.exists(file_path):
+                    del self._files[file_path]
+                    self.dirty = True
+
+        changed = [
+            name
+            for name, mtime_ns in entries.items()
+            if self._library_entries.get(name) != mtime_ns
+        ]
+        gone = [name for name in self._library_entries if name not in entries]
+
+        current = set()
+        for name in changed:
+            entry_path = os.path.join(library_dir, name)
+            if os.path.isdir(entry_path):
+                for dirpath, _, filenames in os.walk(entry_path):
+                    current.update(
+                        os.path.join(dirpath, f) for f in filenames if wanted(f)
+                    )
+            elif wanted(name):
+                current.add(entry_path)
+        if current:
+            self.fingerprints(current)
+
+        with self._lock:
+            known = self._by_entry(library_dir)
+            for name in changed:
+                self._library_entries[name] = entries[name]
+                for file_path in known.get(name, ()):
+                    if file_path not in current:
+                        del self._files[file_path]
+            for name in gone:
+                del self._library_entries[name]
+                for file_path in known.get(name, ()):
+                    del self._files[file_path]
+            if changed or gone:
+                self._rebuild_library()
+                self.dirty = True
+        self.save()
+
+    def in_library(self, fingerprint: str) -> Optional[str]:
+        """The library file with this fingerprint, if there is one."""
+        return self._library.get(fingerprint)
+
+
+def get_fingerprint_store() -> FingerprintStore:
+    if settings.fingerprint_store is None:
+        settings.fingerprint_store = FingerprintStore(
+            os.path.join(
+                settings.library_state_dir or settings.state_dir, FINGERPRINT_FILENAME
+            )
+        )
+    return settings.fingerprint_store
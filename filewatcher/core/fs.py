@@ -0,0 +1,628 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: fs.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Everything that looks at or rearranges the incoming and library
+   directories goes through get_filesystem() instead of calling os and
+   shutil itself. Normally that's LocalFileSystem, which is just os and
+   shutil (and transfer.move for moves). MemoryFileSystem keeps the whole
+   tree in memory instead: sizes, inodes, link counts, mtimes, and which
+   device everything is on, with rename and link failing the way they
+   would on a real disk (EXDEV across devices, ENOTEMPTY onto a folder
+   that has something in it, and so on). File contents aren't kept, so
+   whatever needs the actual bytes (checksums and fingerprints) still goes
+   to the disk.
+
+   The state files (scan state, library index, and friends) always live on
+   the real disk. The journal goes wherever the files it describes are.
+*********************************************
+"""
+
+import errno
+import os
+import shutil
+import stat
+import threading
+import time
+from typing import Callable, Iterator, Optional
+
+from filewatcher.core import settings
+from filewatcher.core.transfer import TransferStats, copy_file
+from filewatcher.core.transfer import move as transfer_move
+
+# how big a MemoryFileSystem device is unless mount() says otherwise
+MEMORY_DEVICE_SIZE = 1 << 40
+
+
+class _Listing(list):
+    """A scandir() result that can be used as a context manager like os's."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+class StatEntry:
+    """
+    Stands in for os.DirEntry when we've been handed a path instead of
+    listing its folder. The stat is taken up front.
+    """
+
+    __slots__ = ("name", "path", "_stat")
+
+    def __init__(self, name: str, path: str, stat_result: os.stat_result):
+        self.name = name
+        self.path = path
+        self._stat = stat_result
+
+    def is_dir(self, follow_symlinks: bool = True) -> bool:
+        return stat.S_ISDIR(self._stat.st_mode)
+
+    def is_file(self, follow_symlinks: bool = True) -> bool:
+        return stat.S_ISREG(self._stat.st_mode)
+
+    def is_symlink(self) -> bool:
+        return stat.S_ISLNK(self._stat.st_mode)
+
+    def stat(self, follow_symlinks: bool = True) -> os.stat_result:
+        return self._stat
+
+    def inode(self) -> int:
+        return self._stat.st_ino
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} {self.name!r}>"
+
+
+class LocalFileSystem:
+    name = "local"
+    # is there anything on the disk to read? (checksums, fingerprints, and
+    # the /proc walk all need there to be)
+    on_disk = True
+
+    def scandir(self, path: str):
+        return os.scandir(path)
+
+    def entry(self, path: str) -> StatEntry:
+        """A DirEntry-alike for path, without listing its folder."""
+        return StatEntry(os.path.basename(path), path, os.stat(path))
+
+    def stat(self, path: str) -> os.stat_result:
+        return os.stat(path)
+
+    def lstat(self, path: str) -> os.stat_result:
+        return os.lstat(path)
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(path)
+
+    def lexists(self, path: str) -> bool:
+        return os.path.lexists(path)
+
+    def isdir(self, path: str) -> bool:
+        return os.path.isdir(path)
+
+    def isfile(self, path: str) -> bool:
+        return os.path.isfile(path)
+
+    def islink(self, path: str) -> bool:
+        return os.path.islink(path)
+
+    def getsize(self, path: str) -> int:
+        return os.path.getsize(path)
+
+    def free_space(self, path: str) -> int:
+        """Bytes left on the disk path is on."""
+        return shutil.disk_usage(path).free
+
+    def listdir(self, path: str) -> list[str]:
+        return os.listdir(path)
+
+    def walk(self, top: str) -> Iterator[tuple[str, list[str], list[str]]]:
+        return os.walk(top)
+
+    def mkdir(self, path: str) -> None:
+        os.mkdir(path)
+
+    def makedirs(self, path: str, exist_ok: bool = False) -> None:
+        os.makedirs(path, exist_ok=exist_ok)
+
+    def rename(self, source: str, destination: str) -> None:
+        os.rename(source, destination)
+
+    def replace(self, source: str, destination: str) -> None:
+        os.replace(source, destination)
+
+    def remove(self, path: str) -> None:
+        os.remove(path)
+
+    def rmdir(self, path: str) -> None:
+        os.rmdir(path)
+
+    def rmtree(self, path: str, ignore_errors: bool = False) -> None:
+        shutil.rmtree(path, ignore_errors=ignore_errors)
+
+    def link(self, source: str, destination: str) -> None:
+        os.link(source, destination)
+
+    def copy_file(self, source: str, destination: str) -> int:
+        return copy_file(source, destination)
+
+    def move(
+        self,
+        source: str,
+        destination: str,
+        checkpoint: Optional[Callable[[str, int], None]] = None,
+        resume: Optional[dict] = None,
+        verify: bool = False,
+    ) -> TransferStats:
+        return transfer_move(source, destination, checkpoint, resume, verify)
+
+    def append(self, path: str, text: str, sync: bool = False) -> None:
+        """
+        Add text to the end of path. With `sync`, it (and everything that
+        was appended before it) is synced to the disk before we return.
+        """
+        with open(path, "a", encoding="utf-8") as append_file:
+            append_file.write(text)
+            if sync:
+                append_file.flush()
+                os.fsync(append_file.fileno())
+
+    def read_text(self, path: str) -> str:
+        with open(path, "r", encoding="utf-8") as text_file:
+            return text_file.read()
+
+    def write_text(self, path: str, text: str) -> None:
+        with open(path, "w", encoding="utf-8") as text_file:
+            text_file.write(text)
+
+    def create_file(self, path: str, size: int, mtime: Optional[float] = None) -> None:
+        """A sparse file of `size` bytes; for building test and benchmark trees."""
+        with open(path, "wb") as new_file:
+            new_file.truncate(size)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+
+def _error(code: int, path: str, *others: str) -> OSError:
+    return OSError(code, os.strerror(code), path, None, *others)
+
+
+class _Node:
+    __slots__ = ("inode", "device", "is_dir", "size", "mtime_ns", "nlink", "children")
+
+    def __init__(self, inode: int, device: int, is_dir: bool, size: int = 0):
+        self.inode = inode
+        self.device = device
+        self.is_dir = is_dir
+        self.size = size
+        self.mtime_ns = time.time_ns()
+        self.nlink = 2 if is_dir else 1
+        self.children: Optional[dict[str, "_Node"]] = {} if is_dir else None
+
+    def stat(self) -> os.stat_result:
+        if self.is_dir:
+            mode, size = stat.S_IFDIR | 0o755, 4096
+        else:
+            mode, size = stat.S_IFREG | 0o644, self.size
+        mtime = self.mtime_ns / 1e9
+        return os.stat_result(
+            (
+                mode,
+                self.inode,
+                self.device,
+                self.nlink,
+                0,
+                0,
+                size,
+                int(mtime),
+                int(mtime),
+                int(mtime),
+                mtime,
+                mtime,
+                mtime,
+                self.mtime_ns,
+                self.mtime_ns,
+                self.mtime_ns,
+            )
+        )
+
+
+class MemoryDirEntry(StatEntry):
+    """Stands in for os.DirEntry. The stat is taken when the folder is listed."""
+
+    __slots__ = ()
+
+    def __init__(self, name: str, path: str, node: _Node):
+        super().__init__(name, path, node.stat())
+
+
+class MemoryFileSystem:
+    """
+    A filesystem that only exists in memory, for tests and benchmarks.
+    Everything starts out on one device; mount() makes a folder (and
+    everything that ends up under it) a device of its own. Every device
+    holds MEMORY_DEVICE_SIZE bytes unless it's mounted with a size.
+    """
+
+    name = "memory"
+    on_disk = False
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._next_inode = 2
+        self._next_device = 1
+        self.root = self._new_node(self._new_device(), is_dir=True)
+        # journal records and the like, by path
+        self._text: dict[str, str] = {}
+        # device -> bytes, for the ones that aren't MEMORY_DEVICE_SIZE
+        self._capacity: dict[int, int] = {}
+
+    def _new_device(self) -> int:
+        device = self._next_device
+        self._next_device += 1
+        return device
+
+    def _new_node(self, device: int, is_dir: bool, size: int = 0) -> _Node:
+        node = _Node(self._next_inode, device, is_dir, size)
+        self._next_inode += 1
+        return node
+
+    @classmethod
+    def _parts(cls, path: str) -> list[str]:
+        # os.path.abspath() on every call adds up; only relative paths and
+        # ones with a .. in them need it
+        if not path.startswith(os.sep):
+            path = os.path.abspath(path)
+        parts = [part for part in path.split(os.sep) if part and part != "."]
+        if ".." in parts:
+            return cls._parts(os.path.normpath(path))
+        return parts
+
+    def _find(self, path: str) -> Optional[_Node]:
+        node = self.root
+        for part in self._parts(path):
+            if not node.is_dir:
+                return None
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def _get(self, path: str) -> _Node:
+        node = self._find(path)
+        if node is None:
+            raise _error(errno.ENOENT, path)
+        return node
+
+    def _parent(self, path: str) -> tuple[_Node, str]:
+        """The folder path goes in, and its name there."""
+        parts = self._parts(path)
+        if not parts:
+            raise _error(errno.EBUSY, path)
+        parent = self._find(os.sep + os.sep.join(parts[:-1]))
+        if parent is None:
+            raise _error(errno.ENOENT, path)
+        if not parent.is_dir:
+            raise _error(errno.ENOTDIR, path)
+        return parent, parts[-1]
+
+    @staticmethod
+    def _touch(node: _Node) -> None:
+        node.mtime_ns = time.time_ns()
+
+    def _add(self, path: str, is_dir: bool, size: int = 0) -> _Node:
+        parent, name = self._parent(path)
+        if name in parent.children:
+            raise _error(errno.EEXIST, path)
+        node = self._new_node(parent.device, is_dir, size)
+        parent.children[name] = node
+        if is_dir:
+            parent.nlink += 1
+        self._touch(parent)
+        return node
+
+    # looking around
+
+    def scandir(self, path: str) -> _Listing:
+        with self._lock:
+            node = self._get(path)
+            if not node.is_dir:
+                raise _error(errno.ENOTDIR, path)
+            return _Listing(
+                MemoryDirEntry(name, os.path.join(path, name), child)
+                for name, child in node.children.items()
+            )
+
+    def entry(self, path: str) -> MemoryDirEntry:
+        with self._lock:
+            return MemoryDirEntry(os.path.basename(path), path, self._get(path))
+
+    def stat(self, path: str) -> os.stat_result:
+        with self._lock:
+            return self._get(path).stat()
+
+    lstat = stat
+
+    def exists(self, path: str) -> bool:
+        with self._lock:
+            return self._find(path) is not None
+
+    lexists = exists
+
+    def isdir(self, path: str) -> bool:
+        with self._lock:
+            node = self._find(path)
+            return node is not None and node.is_dir
+
+    def isfile(self, path: str) -> bool:
+        with self._lock:
+            node = self._find(path)
+            return node is not None and not node.is_dir
+
+    def islink(self, path: str) -> bool:
+        return False
+
+    def getsize(self, path: str) -> int:
+        return self.stat(path).st_size
+
+    def listdir(self, path: str) -> list[str]:
+        return [entry.name for entry in self.scandir(path)]
+
+    def walk(self, top: str) -> Iterator[tuple[str, list[str], list[str]]]:
+        try:
+            entries = self.scandir(top)
+        except OSError:
+            return
+        dirnames = [entry.name for entry in entries if entry.is_dir()]
+        filenames = [entry.name for entry in entries if not entry.is_dir()]
+        yield top, dirnames, filenames
+        for dirname in dirnames:
+            yield from self.walk(os.path.join(top, dirname))
+
+    # changing things
+
+    def mkdir(self, path: str) -> None:
+        with self._lock:
+            self._add(path, is_dir=True)
+
+    def makedirs(self, path: str, exist_ok: bool = False) -> None:
+        with self._lock:
+            node = self._find(path)
+            if node is not None:
+                if not (exist_ok and node.is_dir):
+                    raise _error(errno.EEXIST, path)
+                return
+            parent = os.path.dirname(os.path.abspath(path))
+            if not self.isdir(parent):
+                self.makedirs(parent, exist_ok=True)
+            self._add(path, is_dir=True)
+
+    def mount(self, path: str, size: Optional[int] = None) -> int:
+        """
+        Make path a folder on a device of its own, size bytes big. Returns
+        the device.
+        """
+        with self._lock:
+            self.makedirs(path, exist_ok=True)
+            node = self._get(path)
+            if node.children:
+                raise _error(errno.EBUSY, path)
+            node.device = self._new_device()
+            if size is not None:
+                self._capacity[node.device] = size
+            return node.device
+
+    def free_space(self, path: str) -> int:
+        with self._lock:
+            device = self._get(path).device
+            used = 0
+            # hard links show up more than once, but only take up room once
+            seen = set()
+            pending = [self.root]
+            while pending:
+                node = pending.pop()
+                if node.inode in seen:
+                    continue
+                seen.add(node.inode)
+                if node.is_dir:
+                    pending.extend(node.children.values())
+                elif node.device == device:
+                    used += node.size
+            capacity = self._capacity.get(device, MEMORY_DEVICE_SIZE)
+            return max(capacity - used, 0)
+
+    def create_file(self, path: str, size: int, mtime: Optional[float] = None) -> None:
+        with self._lock:
+            node = self._find(path)
+            if node is None:
+                node = self._add(path, is_dir=False, size=size)
+            elif node.is_dir:
+                raise _error(errno.EISDIR, path)
+            node.size = size
+            if mtime is not None:
+                node.mtime_ns = int(mtime * 1e9)
+
+    def rename(self, source: str, destination: str) -> None:
+        with self._lock:
+            source_parent, source_name = self._parent(source)
+            node = source_parent.children.get(source_name)
+            if node is None:
+                raise _error(errno.ENOENT, source, destination)
+            target_parent, target_name = self._parent(destination)
+            if node.device != target_parent.device:
+                raise _error(errno.EXDEV, source, destination)
+            if source_parent is target_parent and source_name == target_name:
+                return
+
+            # can't put a folder inside itself
+            inside = os.path.join(os.path.abspath(source), "")
+            if node.is_dir and os.path.abspath(destination).startswith(inside):
+                raise _error(errno.EINVAL, source, destination)
+
+            existing = target_parent.children.get(target_name)
+            if existing is not None:
+                if existing.is_dir and not node.is_dir:
+                    raise _error(errno.EISDIR, source, destination)
+                if node.is_dir and not existing.is_dir:
+                    raise _error(errno.ENOTDIR, source, destination)
+                if existing.is_dir and existing.children:
+                    raise _error(errno.ENOTEMPTY, source, destination)
+                self._unlink(target_parent, target_name)
+
+            del source_parent.children[source_name]
+            target_parent.children[target_name] = node
+            if node.is_dir:
+                source_parent.nlink -= 1
+                target_parent.nlink += 1
+            self._touch(source_parent)
+            self._touch(target_parent)
+
+    replace = rename
+
+    def _unlink(self, parent: _Node, name: str) -> None:
+        node = parent.children.pop(name)
+        if node.is_dir:
+            parent.nlink -= 1
+            # anything linked from elsewhere loses this link, too
+            for child_name in list(node.children):
+                self._unlink(node, child_name)
+        else:
+            node.nlink -= 1
+        self._touch(parent)
+
+    def remove(self, path: str) -> None:
+        with self._lock:
+            parent, name = self._parent(path)
+            node = parent.children.get(name)
+            if node is None:
+                raise _error(errno.ENOENT, path)
+            if node.is_dir:
+                raise _error(errno.EISDIR, path)
+            self._unlink(parent, name)
+
+    def rmdir(self, path: str) -> None:
+        with self._lock:
+            parent, name = self._parent(path)
+            node = parent.children.get(name)
+            if node is None:
+                raise _error(errno.ENOENT, path)
+            if not node.is_dir:
+                raise _error(errno.ENOTDIR, path)
+            if node.children:
+                raise _error(errno.ENOTEMPTY, path)
+            self._unlink(parent, name)
+
+    def rmtree(self, path: str, ignore_errors: bool = False) -> None:
+        with self._lock:
+            try:
+                parent, name = self._parent(path)
+                node = parent.children.get(name)
+                if node is None:
+                    raise _error(errno.ENOENT, path)
+                if not node.is_dir:
+                    raise _error(errno.ENOTDIR, path)
+            except OSError:
+                if ignore_errors:
+                    return
+                raise
+            self._unlink(parent, name)
+
+    def link(self, source: str, destination: str) -> None:
+        with self._lock:
+            node = self._get(source)
+            if node.is_dir:
+                raise _error(errno.EPERM, source, destination)
+            target_parent, target_name = self._parent(destination)
+            if target_name in target_parent.children:
+                raise _error(errno.EEXIST, source, destination)
+            if node.device != target_parent.device:
+                raise _error(errno.EXDEV, source, destination)
+            target_parent.children[target_name] = node
+            node.nlink += 1
+            self._touch(target_parent)
+
+    def copy_file(self, source: str, destination: str) -> int:
+        with self._lock:
+            node = self._get(source)
+            if node.is_dir:
+                raise _error(errno.EISDIR, source)
+            self.create_file(destination, node.size, node.mtime_ns / 1e9)
+            return node.size
+
+    def _copy_tree(self, source: str, destination: str, stats: TransferStats) -> None:
+        self.mkdir(destination)
+        for entry in self.scandir(source):
+            target = os.path.join(destination, entry.name)
+            if entry.is_dir():
+                self._copy_tree(entry.path, target, stats)
+            else:
+                stats.bytes_copied += self.copy_file(entry.path, target)
+                stats.files += 1
+
+    def move(
+        self,
+        source: str,
+        destination: str,
+        checkpoint: Optional[Callable[[str, int], None]] = None,
+        resume: Optional[dict] = None,
+        verify: bool = False,
+    ) -> TransferStats:
+        """
+        transfer.move(): a rename on the same device, otherwise a copy and
+        then getting rid of the source. There aren't any bytes to verify or
+        checkpoint, so those are ignored.
+        """
+        stats = TransferStats()
+        started = time.monotonic()
+        with self._lock:
+            if self.lexists(destination):
+                raise FileExistsError(
+                    errno.EEXIST, "Destination already exists", destination
+                )
+            try:
+                self.rename(source, destination)
+                stats.renamed = True
+                return stats
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+
+            if self.isdir(source):
+                self._copy_tree(source, destination, stats)
+                self.rmtree(source)
+            else:
+                stats.bytes_copied = self.copy_file(source, destination)
+                stats.files = 1
+                self.remove(source)
+        stats.seconds = time.monotonic() - started
+        return stats
+
+    def append(self, path: str, text: str, sync: bool = False) -> None:
+        key = os.path.abspath(path)
+        with self._lock:
+            self._text[key] = self._text.get(key, "") + text
+            self.create_file(path, len(self._text[key]))
+
+    def read_text(self, path: str) -> str:
+        with self._lock:
+            self._get(path)
+            return self._text.get(os.path.abspath(path), "")
+
+    def write_text(self, path: str, text: str) -> None:
+        with self._lock:
+            self._text[os.path.abspath(path)] = text
+            self.create_file(path, len(text))
+
+
+def get_filesystem() -> LocalFileSystem | MemoryFileSystem:
+    if settings.filesystem is None:
+        settings.filesystem = LocalFileSystem()
+    return settings.filesystem
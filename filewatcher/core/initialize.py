@@ -24,6 +24,17 @@ import pkg_resources
 
 from filewatcher.core import init_endings, init_phrases, settings
 from filewatcher.core.console import console
+from filewatcher.core.journal import get_journal
+from filewatcher.core.notify import get_notifier
+from filewatcher.core.volumes import get_roots
+from filewatcher.core.watcher import get_watcher
+
+
+def directories(value: str | list[str]) -> list[str]:
+    # ConfigObj hands back a list if the commas weren't in quotes
+    if isinstance(value, str):
+        value = value.split(",")
+    return [path.strip() for path in value if path.strip()]
 
 
 def generate_config(updated_config: bool = False) -> NoReturn:
@@ -42,14 +53,76 @@ def generate_config(updated_config: bool = False) -> NoReturn:
         }
     )
     config["Info"]["delay_time"] = settings.delay_time
+    config["Info"].comments.update(
+        {
+            "Info": [
+                "# How to notice new downloads: auto, inotify, adaptive, or",
+                "# poll. inotify reacts instantly but only works on local Linux",
+                "# filesystems; poll rescans every delay_time seconds.",
+                "# adaptive (what auto falls back to) checks whether the",
+                "# incoming directory changed, every poll_interval_min seconds",
+                "# after something arrives and backing off to delay_time while",
+                "# nothing does, and only rescans everything when it has (or",
+                "# every full_scan_interval seconds regardless).",
+            ],
+            "key": ["watch_mode"],
+        }
+    )
+    config["Info"]["watch_mode"] = settings.watch_mode
+    config["Info"]["poll_interval_min"] = settings.poll_interval_min
+    config["Info"]["full_scan_interval"] = settings.full_scan_interval
+    config["Info"].comments.update(
+        {
+            "Info": [
+                "# notify_socket: path to a Unix socket that download clients",
+                "# can report finished downloads to, so they're imported right",
+                "# away (see the README). Leave it empty to turn it off.",
+            ],
+            "key": ["notify_socket"],
+        }
+    )
+    config["Info"]["notify_socket"] = settings.notify_socket
+    config["Info"].comments.update(
+        {
+            "Info": [
+                "# How to tell a download is finished: auto, quiescence, or",
+                "# rename. quiescence waits until nothing has the file open",
+                "# for writing and it has stopped changing for settle_time",
+                "# seconds; rename is the old Windows-only lock check.",
+            ],
+            "key": ["settle_mode"],
+        }
+    )
+    config["Info"]["settle_mode"] = settings.settle_mode
+    config["Info"]["settle_time"] = settings.settle_time
 
     config["Directories"] = {}
     config["Directories"].comments.update(
         {"Directories": ['# Example: "C:\Things" or "/Users/[you]/Things"'], "key": []}
     )
+    config["Directories"].comments.update(
+        {
+            "Directories": [
+                "# incoming_directory and movie_directory can each be a comma",
+                "# separated list. Every incoming directory is watched at once,",
+                "# and movies go to a library on the same disk if there is one",
+                "# (so they're moved instantly), otherwise the emptiest one.",
+            ],
+            "key": ["incoming_directory"],
+        }
+    )
     config["Directories"]["incoming_directory"] = settings.incoming_dir
     config["Directories"]["movie_directory"] = settings.movie_dir
     config["Directories"]["audio_directory"] = settings.audio_dir
+    config["Directories"].comments.update(
+        {
+            "Directories": [
+                "# Where FileWatcher keeps track of what it has already seen.",
+            ],
+            "key": ["state_directory"],
+        }
+    )
+    config["Directories"]["state_directory"] = settings.state_dir
 
     config["File Information"] = {}
     config["File Information"].comments.update(
@@ -86,6 +159,133 @@ def generate_config(updated_config: bool = False) -> NoReturn:
     config["File Information"]["video_formats"] = settings.video_formats
     config["File Information"]["audio_formats"] = settings.audio_formats
 
+    config["Library"] = {}
+    config["Library"].comments.update(
+        {
+            "Library": [
+                "# import_mode: move (the default) moves downloads into the",
+                "# library. link hardlinks or reflinks them in instead and",
+                "# leaves the original in place so it can keep seeding; the",
+                "# original is deleted after link_retention_days (0 = never).",
+            ],
+            "key": [],
+        }
+    )
+    config["Library"]["import_mode"] = settings.import_mode
+    config["Library"]["link_retention_days"] = settings.link_retention_days
+    config["Library"].comments.update(
+        {
+            "Library": [
+                "# Anything whose title is at least duplicate_similarity alike",
+                "# (0-1) to something in the library, with a year within",
+                "# duplicate_year_tolerance years, gets pointed out when it's",
+                "# imported. Only exact title and year matches are duplicates.",
+            ],
+            "key": ["duplicate_similarity"],
+        }
+    )
+    config["Library"]["duplicate_similarity"] = settings.duplicate_similarity
+    config["Library"]["duplicate_year_tolerance"] = settings.duplicate_year_tolerance
+    config["Library"].comments.update(
+        {
+            "Library": [
+                "# content_duplicates also compares a sample of each movie's",
+                "# bytes against everything in the library, which catches the",
+                "# same file under a different name. The first run has to",
+                "# sample the whole library, which can take a while.",
+            ],
+            "key": ["content_duplicates"],
+        }
+    )
+    config["Library"]["content_duplicates"] = settings.content_duplicates
+    config["Library"].comments.update(
+        {
+            "Library": [
+                "# verify_imports checks a copy onto another disk against the",
+                "# original before the original is deleted, and leaves a",
+                "# manifest of checksums in every movie folder it imports.",
+            ],
+            "key": ["verify_imports"],
+        }
+    )
+    config["Library"]["verify_imports"] = settings.verify_imports
+
+    config["Performance"] = {}
+    config["Performance"].comments.update(
+        {
+            "Performance": [
+                "# How many folders to work on at once. Moves to another disk",
+                "# are limited to copies_per_device at a time per disk, so a",
+                "# big copy never holds up a quick same-disk rename.",
+            ],
+            "key": [],
+        }
+    )
+    config["Performance"]["workers"] = settings.workers
+    config["Performance"]["copies_per_device"] = settings.copies_per_device
+    config["Performance"].comments.update(
+        {
+            "Performance": [
+                "# runtime: serial (the default) deals with one folder at a",
+                "# time per worker. async runs settling, OMDb lookups, and",
+                "# imports side by side, so a slow lookup or a big copy",
+                "# doesn't hold up the folders behind it.",
+            ],
+            "key": ["runtime"],
+        }
+    )
+    config["Performance"]["runtime"] = settings.runtime
+    config["Performance"].comments.update(
+        {
+            "Performance": [
+                "# Anything still downloading or failing to move is looked at",
+                "# less and less often, up to every retry_backoff_max seconds.",
+                "# cycle_budget caps how many seconds a cycle spends starting",
+                "# new work (0 = no limit); the rest waits for the next one.",
+            ],
+            "key": ["retry_backoff_max"],
+        }
+    )
+    config["Performance"]["retry_backoff_max"] = settings.retry_backoff_max
+    config["Performance"]["cycle_budget"] = settings.cycle_budget
+
+    config["OMDb"] = {}
+    config["OMDb"].comments.update(
+        {
+            "OMDb": [
+                "# OMDb lookups are cached in the state directory. Titles it",
+                "# found are trusted for hit_ttl_days; titles it didn't are",
+                "# asked about again after miss_ttl_hours.",
+            ],
+            "key": [],
+        }
+    )
+    config["OMDb"]["hit_ttl_days"] = settings.omdb_hit_ttl_days
+    config["OMDb"]["miss_ttl_hours"] = settings.omdb_miss_ttl_hours
+    config["OMDb"].comments.update(
+        {
+            "OMDb": [
+                "# Lookups share one connection pool; no more than concurrency",
+                "# run at once, and no more than requests_per_second are",
+                "# started (0 = no limit).",
+            ],
+            "key": ["requests_per_second"],
+        }
+    )
+    config["OMDb"]["requests_per_second"] = settings.omdb_requests_per_second
+    config["OMDb"]["concurrency"] = settings.omdb_concurrency
+    config["OMDb"].comments.update(
+        {
+            "OMDb": [
+                "# Optional offline title index, checked before the OMDb. Build",
+                "# one from an IMDb title.basics.tsv.gz dump with",
+                "# python -m filewatcher.movies.titles <dump> <index>",
+            ],
+            "key": ["title_index"],
+        }
+    )
+    config["OMDb"]["title_index"] = settings.title_index_path
+
     config.write()
 
     config_nonexist_error = textwrap.fill(
@@ -117,11 +317,30 @@ def load_config(loaded_config: dict) -> Optional[NoReturn]:
     settings.app_name = loaded_config["Info"]["application_name"]
 
     settings.delay_time = int(loaded_config["Info"]["delay_time"])
+    # newer option; older configs just get the default
+    settings.watch_mode = loaded_config["Info"].get("watch_mode", settings.watch_mode)
+    settings.poll_interval_min = loaded_config["Info"].get(
+        "poll_interval_min", settings.poll_interval_min
+    )
+    settings.full_scan_interval = loaded_config["Info"].get(
+        "full_scan_interval", settings.full_scan_interval
+    )
+    settings.notify_socket = loaded_config["Info"].get(
+        "notify_socket", settings.notify_socket
+    )
+    settings.settle_mode = loaded_config["Info"].get(
+        "settle_mode", settings.settle_mode
+    )
+    settings.settle_time = loaded_config["Info"].get(
+        "settle_time", settings.settle_time
+    )
 
     settings.debug = True
 
-    settings.incoming_dir = loaded_config["Directories"]["incoming_directory"]
-    settings.movie_dir = loaded_config["Directories"]["movie_directory"]
+    settings.incoming_dirs = directories(
+        loaded_config["Directories"]["incoming_directory"]
+    )
+    settings.movie_dirs = directories(loaded_config["Directories"]["movie_directory"])
 
     settings.min_movie_size = loaded_config["File Information"]["minimum_movie_size"]
     settings.min_episode_size = loaded_config["File Information"][
@@ -138,12 +357,61 @@ def load_config(loaded_config: dict) -> Optional[NoReturn]:
     ]
 
     settings.audio_dir = loaded_config["Directories"]["audio_directory"]
+    settings.state_dir = loaded_config["Directories"].get(
+        "state_directory", settings.state_dir
+    )
     settings.audio_formats = [
-        e.strip() for e in loaded_config["File Information"]["video_formats"].split(",")
+        e.strip()
+        for e in loaded_config["File Information"]
+        .get("audio_formats", settings.audio_formats)
+        .split(",")
     ]
 
+    # the Library and Performance sections are newer than most configs
+    library = loaded_config.get("Library", {})
+    settings.import_mode = library.get("import_mode", settings.import_mode)
+    settings.link_retention_days = library.get(
+        "link_retention_days", settings.link_retention_days
+    )
+    settings.duplicate_similarity = library.get(
+        "duplicate_similarity", settings.duplicate_similarity
+    )
+    settings.duplicate_year_tolerance = library.get(
+        "duplicate_year_tolerance", settings.duplicate_year_tolerance
+    )
+    settings.content_duplicates = library.get(
+        "content_duplicates", settings.content_duplicates
+    )
+    settings.verify_imports = library.get("verify_imports", settings.verify_imports)
+
+    performance = loaded_config.get("Performance", {})
+    settings.workers = performance.get("workers", settings.workers)
+    settings.copies_per_device = performance.get(
+        "copies_per_device", settings.copies_per_device
+    )
+    settings.runtime = performance.get("runtime", settings.runtime)
+    settings.retry_backoff_max = performance.get(
+        "retry_backoff_max", settings.retry_backoff_max
+    )
+    settings.cycle_budget = performance.get("cycle_budget", settings.cycle_budget)
+
+    omdb = loaded_config.get("OMDb", {})
+    settings.omdb_hit_ttl_days = omdb.get("hit_ttl_days", settings.omdb_hit_ttl_days)
+    settings.omdb_miss_ttl_hours = omdb.get(
+        "miss_ttl_hours", settings.omdb_miss_ttl_hours
+    )
+    settings.omdb_requests_per_second = omdb.get(
+        "requests_per_second", settings.omdb_requests_per_second
+    )
+    settings.omdb_concurrency = omdb.get("concurrency", settings.omdb_concurrency)
+    settings.title_index_path = omdb.get("title_index", settings.title_index_path)
+
     # check validity of config entries
-    for dir_checker in (settings.incoming_dir, settings.movie_dir, settings.audio_dir):
+    for dir_checker in (
+        *settings.incoming_dirs,
+        *settings.movie_dirs,
+        settings.audio_dir,
+    ):
         if not os.path.isdir(dir_checker):
             console.print(
                 f'[red]Directory "{dir_checker}" is invalid! Please check the config!',
@@ -169,15 +437,25 @@ def initialize(settings: dict = settings) -> bool | NoReturn:
     # noinspection PyUnboundLocalVariable
     load_config(loaded_config)
 
+    # if we went down in the middle of moving something last time, sort
+    # that out before we go looking for new work
+    get_journal().recover()
+
     console.log(init_endings[set_init_phrase])
     console.print()
     __version__ = pkg_resources.get_distribution("filewatcher").version
 
     console.print("Ready to go - starting main loop!")
     console.print(f"Running {settings.app_name}, version {__version__}")
-    console.print(f"\nIncoming file directory: {settings.incoming_dir}")
-    console.print(f"Movie directory: {settings.movie_dir}")
+    for root in get_roots():
+        with root.active():
+            console.print(f"\nIncoming file directory: {settings.incoming_dir}")
+            console.print(f"Watching for changes with: {get_watcher().name}")
+    for movie_dir in settings.movie_dirs:
+        console.print(f"Movie directory: {movie_dir}")
     console.print(f"Audio directory: {settings.audio_dir}")
+    if get_notifier() is not None:
+        console.print(f"Listening for finished downloads on {settings.notify_socket}")
 
     intro_text = (
         "Folders identified as containing movies (along with root level "
@@ -0,0 +1,364 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: journal.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Write-ahead journal for the multi-step shuffles we do when importing
+   something (rename, then move; or mkdir, move, move). Every step is
+   written down before it happens, so if the power goes out part way
+   through, initialize() can look at what was in flight and either finish
+   it (resuming a big copy from its last synced checkpoint) or put
+   everything back the way it was. Renames and mkdirs are atomic and
+   recovery copes with finding them done or not, so the journal is only
+   synced to the disk along with a copy's checkpoints; that's the only
+   thing that's expensive to lose.
+*********************************************
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from filewatcher.core import settings
+from filewatcher.core.fs import get_filesystem
+from filewatcher.core.transfer import PARTIAL_SUFFIX, TransferStats
+
+JOURNAL_FILENAME = "journal.jsonl"
+
+
+class Transaction:
+    def __init__(self, journal: "Journal", txn_id: int, planned: list[str]):
+        self.journal = journal
+        self.id = txn_id
+        self.planned = planned
+        self.steps = 0
+
+    def _begin_step(self, op: str, *paths: str) -> int:
+        step = self.steps
+        self.steps += 1
+        self.journal.write(
+            {"txn": self.id, "event": "step", "n": step, "op": op, "paths": paths}
+        )
+        return step
+
+    def _finish_step(self, step: int) -> None:
+        self.journal.write({"txn": self.id, "event": "done", "n": step})
+
+    def rename(self, source: str, destination: str) -> None:
+        step = self._begin_step("rename", source, destination)
+        get_filesystem().rename(source, destination)
+        self._finish_step(step)
+
+    def mkdir(self, path: str) -> None:
+        step = self._begin_step("mkdir", path)
+        get_filesystem().mkdir(path)
+        self._finish_step(step)
+
+    def move(
+        self, source: str, destination: str, verify: bool = False
+    ) -> TransferStats:
+        # check before writing anything down; recovery assumes that whatever
+        # is at the destination of a journaled move was put there by us
+        fs = get_filesystem()
+        if fs.lexists(destination):
+            raise FileExistsError(destination)
+        step = self._begin_step("move", source, destination)
+        stats = fs.move(
+            source, destination, checkpoint=self._checkpointer(step), verify=verify
+        )
+        self._finish_step(step)
+        return stats
+
+    def _checkpointer(self, step: int):
+        def checkpoint(relative_path: str, offset: int) -> None:
+            # the copy's been synced up to offset; this (and the records
+            # before it) need to be too, or there's nothing to resume from
+            self.journal.write(
+                {
+                    "txn": self.id,
+                    "event": "checkpoint",
+                    "n": step,
+                    "file": relative_path,
+                    "offset": offset,
+                },
+                sync=True,
+            )
+
+        return checkpoint
+
+
+class Journal:
+    """
+    Kept on the same filesystem as the files it keeps track of; there's no
+    point syncing records about an in-memory tree to the disk.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fs = get_filesystem()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # unique across restarts, so leftovers from a crash never get mixed
+        # up with anything new
+        self._next_id = int(time.time() * 1000)
+        self._open: set[int] = set()
+        # don't throw away a crashed run's records before recover() sees them
+        self._needs_recovery = bool(self.fs.exists(path) and self.fs.getsize(path))
+
+    @property
+    def current(self) -> Optional[Transaction]:
+        return getattr(self._local, "transaction", None)
+
+    def write(self, record: dict, sync: bool = False) -> None:
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self.fs.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.fs.append(self.path, line, sync)
+
+    def _truncate(self) -> None:
+        try:
+            self.fs.write_text(self.path, "")
+        except OSError:
+            pass
+
+    @contextmanager
+    def transaction(self, label: str, planned: list[str]) -> Iterator[Transaction]:
+        """
+        `planned` is the list of operations (e.g. ["rename", "move"]) that
+        make up the whole job; recovery uses it to tell a finished job from
+        one that only got part of the way through. A transaction that ends
+        early because of an ordinary error is closed out normally; only a
+        crash (or ^C) leaves it open for recovery.
+        """
+        with self._lock:
+            txn_id = self._next_id
+            self._next_id += 1
+            self._open.add(txn_id)
+
+        transaction = Transaction(self, txn_id, planned)
+        self.write({"txn": txn_id, "event": "begin", "label": label, "plan": planned})
+
+        outer = self.current
+        self._local.transaction = transaction
+        try:
+            yield transaction
+        except Exception:
+            self._end(txn_id)
+            raise
+        else:
+            self._end(txn_id)
+        finally:
+            self._local.transaction = outer
+
+    def _end(self, txn_id: int) -> None:
+        self.write({"txn": txn_id, "event": "end"})
+        with self._lock:
+            self._open.discard(txn_id)
+            if not self._open and not self._needs_recovery:
+                # everything's accounted for, so there's nothing to keep
+                self._truncate()
+
+    def _load(self) -> dict[int, dict]:
+        transactions: dict[int, dict] = {}
+        try:
+            lines = self.fs.read_text(self.path).splitlines()
+        except FileNotFoundError:
+            return transactions
+
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a torn write at the very end; whatever it was never happened
+                continue
+            txn = transactions.setdefault(
+                record["txn"], {"steps": {}, "done": set(), "ended": False}
+            )
+            event = record["event"]
+            if event == "begin":
+                txn.update(label=record["label"], plan=record["plan"])
+            elif event == "step":
+                txn["steps"][record["n"]] = (record["op"], record["paths"], None)
+            elif event == "checkpoint":
+                op, paths, _ = txn["steps"][record["n"]]
+                resume = {"file": record["file"], "offset": record["offset"]}
+                txn["steps"][record["n"]] = (op, paths, resume)
+            elif event == "done":
+                txn["done"].add(record["n"])
+            elif event == "end":
+                txn["ended"] = True
+        return transactions
+
+    def recover(self) -> None:
+        """Finish or undo anything a crash left half done. Call at startup."""
+        for txn_id, txn in self._load().items():
+            if txn["ended"] or "plan" not in txn:
+                continue
+            label = txn["label"]
+            settings.debug_message(f"Journal - recovering interrupted {label}")
+
+            steps = txn["steps"]
+            done = txn["done"]
+            interrupted = [n for n in sorted(steps) if n not in done]
+            for n in interrupted:
+                if _replay_step(*steps[n]):
+                    done.add(n)
+                elif steps[n][0] == "move":
+                    _remove_partial(steps[n][1][1])
+
+            if len(done) == len(txn["plan"]):
+                settings.debug_message(f"Journal - finished {label}.")
+                continue
+
+            # didn't make it to the end; put back what we did do
+            for n in sorted(done, reverse=True):
+                _undo_step(*steps[n])
+            settings.debug_message(f"Journal - rolled back {label}.")
+
+        with self._lock:
+            self._needs_recovery = False
+            if not self._open:
+                self._truncate()
+
+
+def _tree_contains(container: str, contents: str) -> bool:
+    """Does container have every file in contents, at the same size?"""
+    fs = get_filesystem()
+    if fs.isfile(contents):
+        return fs.isfile(container) and fs.getsize(container) == fs.getsize(contents)
+    for dirpath, _, filenames in fs.walk(contents):
+        for filename in filenames:
+            source_file = os.path.join(dirpath, filename)
+            target_file = os.path.join(
+                container, os.path.relpath(source_file, contents)
+            )
+            if not fs.isfile(target_file):
+                return False
+            if fs.getsize(target_file) != fs.getsize(source_file):
+                return False
+    return True
+
+
+def _remove(path: str) -> None:
+    fs = get_filesystem()
+    if fs.isdir(path) and not fs.islink(path):
+        fs.rmtree(path)
+    else:
+        fs.remove(path)
+
+
+def _remove_partial(destination: str) -> None:
+    partial = destination + PARTIAL_SUFFIX
+    try:
+        if get_filesystem().lexists(partial):
+            _remove(partial)
+    except OSError:
+        settings.debug_message(f"Journal - unable to clean up {partial}!")
+
+
+def _replay_step(op: str, paths: list[str], resume: Optional[dict]) -> bool:
+    """Try to complete an interrupted step. Returns whether it's now done."""
+    fs = get_filesystem()
+    if op == "mkdir":
+        return fs.isdir(paths[0])
+
+    source, destination = paths
+    if op == "rename":
+        return source == destination or (
+            fs.lexists(destination) and not fs.lexists(source)
+        )
+
+    # op == "move"
+    if fs.lexists(destination):
+        # the copy made it into place; all that might be left is getting
+        # rid of the source
+        if fs.lexists(source):
+            if not _tree_contains(destination, source):
+                settings.debug_message(
+                    f"Journal - {destination} doesn't match {source}; leaving both!"
+                )
+                return False
+            _remove(source)
+        return True
+
+    if fs.lexists(source) and fs.lexists(destination + PARTIAL_SUFFIX):
+        settings.debug_message(f"Journal - resuming copy of {source}")
+        try:
+            fs.move(
+                source,
+                destination,
+                resume=resume or {},
+                verify=settings.verify_imports,
+            )
+        except OSError:
+            return False
+        return True
+
+    return False
+
+
+def _undo_step(op: str, paths: list[str], resume: Optional[dict]) -> None:
+    fs = get_filesystem()
+    try:
+        if op == "mkdir":
+            fs.rmdir(paths[0])
+            return
+        source, destination = paths
+        if source == destination:
+            return
+        if fs.lexists(destination) and not fs.lexists(source):
+            fs.move(destination, source)
+    except OSError:
+        settings.debug_message(f"Journal - unable to undo {op} {paths}!")
+
+
+def get_journal() -> Journal:
+    if settings.journal is None:
+        settings.journal = Journal(os.path.join(settings.state_dir, JOURNAL_FILENAME))
+    return settings.journal
+
+
+@contextmanager
+def transaction(label: str, planned: list[str]) -> Iterator[Transaction]:
+    with get_journal().transaction(label, planned) as txn:
+        yield txn
+
+
+def _current() -> Optional[Transaction]:
+    return get_journal().current
+
+
+def rename(source: str, destination: str) -> None:
+    """rename(), journaled if we're inside a transaction."""
+    txn = _current()
+    if txn is None:
+        get_filesystem().rename(source, destination)
+    else:
+        txn.rename(source, destination)
+
+
+def mkdir(path: str) -> None:
+    """mkdir(), journaled if we're inside a transaction."""
+    txn = _current()
+    if txn is None:
+        get_filesystem().mkdir(path)
+    else:
+        txn.mkdir(path)
+
+
+def move(source: str, destination: str, verify: bool = False) -> TransferStats:
+    """
+    transfer.move, journaled as part of the current transaction, or as a
+    transaction of its own so a big copy can always be resumed.
+    """
+    txn = _current()
+    if txn is None:
+        with transaction(f"move of {source}", ["move"]) as txn:
+            return txn.move(source, destination, verify)
+    return txn.move(source, destination, verify)
@@ -0,0 +1,248 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: linking.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   The "link" import mode. Instead of moving a download into the library
+   (which breaks seeding, and means a full copy if the library is on another
+   disk), we hardlink it in when it's on the same filesystem, reflink it
+   (FICLONE) on filesystems that share blocks like btrfs and XFS, and only
+   copy it if neither works. The original is left where it is and recorded
+   so it can be cleaned up once it's been seeding long enough.
+*********************************************
+"""
+
+import errno
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Iterable, Optional
+
+from filewatcher.core import settings
+from filewatcher.core.fs import get_filesystem
+from filewatcher.core.transfer import PARTIAL_SUFFIX
+
+# from <linux/fs.h>: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+REGISTRY_FILENAME = "imports.json"
+# what the registry says about a download that's been linked into the
+# library; anything else is one of the StatusTags
+IMPORTED = "imported"
+
+
+def reflink(source: str, destination: str) -> None:
+    """Share source's blocks with a new file at destination. Raises OSError."""
+    import fcntl  # not available on Windows, where this can't work anyway
+
+    src_fd = os.open(source, os.O_RDONLY)
+    try:
+        dst_fd = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        except OSError:
+            os.close(dst_fd)
+            os.remove(destination)
+            raise
+        os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    shutil.copystat(source, destination)
+
+
+def link_file(source: str, destination: str) -> str:
+    """
+    Get source into destination as cheaply as possible. Returns how it was
+    done: "hardlink", "reflink", or "copy".
+    """
+    fs = get_filesystem()
+    try:
+        fs.link(source, destination)
+        return "hardlink"
+    except OSError as e:
+        # EXDEV: different filesystem. EPERM/EMLINK/ENOTSUP: filesystem
+        # doesn't want to (FAT, too many links, etc.)
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+
+    if fs.on_disk:
+        try:
+            reflink(source, destination)
+            return "reflink"
+        except (OSError, ImportError):
+            pass
+
+    fs.copy_file(source, destination)
+    return "copy"
+
+
+def link_tree(
+    source: str, destination: str, exclude: Iterable[str] = ()
+) -> dict[str, int]:
+    """
+    Recreate source at destination out of links. `exclude` holds paths
+    relative to source that should be left out (samples, .nfo files...).
+    The new folder is built under a temporary name and renamed into place
+    once it's complete. Returns how many files went each way.
+    """
+    fs = get_filesystem()
+    if fs.lexists(destination):
+        raise FileExistsError(errno.EEXIST, "Destination already exists", destination)
+
+    exclude = set(exclude)
+    methods = {"hardlink": 0, "reflink": 0, "copy": 0}
+    partial = destination + PARTIAL_SUFFIX
+    if fs.lexists(partial):
+        fs.rmtree(partial)
+
+    try:
+        if fs.isdir(source):
+            fs.mkdir(partial)
+            for dirpath, dirnames, filenames in fs.walk(source):
+                relative_dir = os.path.relpath(dirpath, source)
+                target_dir = os.path.normpath(os.path.join(partial, relative_dir))
+                for dirname in dirnames:
+                    fs.mkdir(os.path.join(target_dir, dirname))
+                for filename in filenames:
+                    if (
+                        os.path.normpath(os.path.join(relative_dir, filename))
+                        in exclude
+                    ):
+                        continue
+                    method = link_file(
+                        os.path.join(dirpath, filename),
+                        os.path.join(target_dir, filename),
+                    )
+                    methods[method] += 1
+        else:
+            methods[link_file(source, partial)] += 1
+        fs.rename(partial, destination)
+    except BaseException:
+        if fs.isdir(partial):
+            fs.rmtree(partial, ignore_errors=True)
+        elif fs.lexists(partial):
+            fs.remove(partial)
+        raise
+
+    settings.debug_message(f"Linked {source} to {destination}: {methods}")
+    return methods
+
+
+class ImportRegistry:
+    """
+    Downloads that have been linked into the library but are still sitting
+    in the incoming directory, keyed by their name there, along with the
+    ones we've decided to leave alone (duplicates, TV shows, things we
+    couldn't make sense of) that would otherwise have been renamed with a
+    StatusTag. Anything in here is skipped by the main loop. Imported
+    downloads get removed from the incoming directory once they're older
+    than the retention period; the rest stay until somebody deals with them.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._imports: dict[str, dict] = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as registry_file:
+                self._imports = json.load(registry_file)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            settings.debug_message(f"Import registry at {self.path} is unreadable!")
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._imports
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with self._lock, open(temp_path, "w", encoding="utf-8") as registry_file:
+            json.dump(self._imports, registry_file, indent=2)
+        os.replace(temp_path, self.path)
+
+    def status(self, name: str) -> Optional[str]:
+        details = self._imports.get(name)
+        if details is None:
+            return None
+        # registries from before decisions were kept only held imports
+        return details.get("status", IMPORTED)
+
+    def record(self, name: str, library_path: str) -> None:
+        with self._lock:
+            self._imports[name] = {
+                "status": IMPORTED,
+                "library_path": library_path,
+                "at": time.time(),
+            }
+        self.save()
+
+    def decide(self, name: str, status: str) -> None:
+        """Remember that name is being left alone, and why (a StatusTag)."""
+        with self._lock:
+            self._imports[name] = {"status": status, "at": time.time()}
+        self.save()
+
+    def forget(self, name: str) -> None:
+        with self._lock:
+            self._imports.pop(name, None)
+        self.save()
+
+    def prune(self, present: Iterable[str]) -> None:
+        """Forget about anything that's been removed from incoming by hand."""
+        present = set(present)
+        with self._lock:
+            gone = [name for name in self._imports if name not in present]
+            for name in gone:
+                del self._imports[name]
+        if gone:
+            self.save()
+
+    def expire(self, retention_days: float, now: Optional[float] = None) -> None:
+        """Delete incoming copies that have been seeding long enough."""
+        if retention_days <= 0:
+            return
+        now = now or time.time()
+        cutoff = now - retention_days * 24 * 60 * 60
+
+        fs = get_filesystem()
+        for name, details in list(self._imports.items()):
+            if details.get("status", IMPORTED) != IMPORTED:
+                # the library doesn't have this one; it's not ours to delete
+                continue
+            if details["at"] > cutoff:
+                continue
+            incoming_path = os.path.join(settings.incoming_dir, name)
+            if not fs.exists(details["library_path"]):
+                # somebody removed it from the library; don't take the last
+                # copy away too
+                settings.debug_message(
+                    f"{details['library_path']} is gone; keeping {incoming_path}."
+                )
+                self.forget(name)
+                continue
+            settings.debug_message(f"Retention is up for {name}; cleaning up.")
+            try:
+                if fs.isdir(incoming_path):
+                    fs.rmtree(incoming_path)
+                elif fs.lexists(incoming_path):
+                    fs.remove(incoming_path)
+            except OSError:
+                settings.debug_message(f"Unable to remove {incoming_path}!")
+                continue
+            self.forget(name)
+
+
+def get_import_registry() -> ImportRegistry:
+    if settings.import_registry is None:
+        settings.import_registry = ImportRegistry(
+            os.path.join(
+                settings.incoming_state_dir or settings.state_dir, REGISTRY_FILENAME
+            )
+        )
+    return settings.import_registry
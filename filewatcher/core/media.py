@@ -0,0 +1,214 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: media.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Works out what kind of file something is from its name. The extension
+   lists in the config are turned into sets once, casefolded so `.MKV`
+   counts as much as `.mkv`, and a folder's whole listing gets sorted into
+   video, audio, junk, and ignored files in one go instead of every caller
+   checking every file for itself. A FolderManifest goes one step further
+   and keeps each file's size and kind (plus some totals) for a folder, so
+   the decisions about it are all made from one stat per file.
+*********************************************
+"""
+
+from typing import Iterable, NamedTuple, Optional
+
+from filewatcher.core import settings
+
+
+class Classified(NamedTuple):
+    """A folder listing sorted by MediaClassifier.classify()."""
+
+    video: list[str]
+    audio: list[str]
+    # files worth deleting on sight (.nfo and friends)
+    delete: list[str]
+    # Thumbs.db and the like, which are never worth looking at
+    ignore: list[str]
+    # everything else
+    other: list[str]
+
+
+def _suffixes(formats: str | Iterable[str]) -> frozenset[str]:
+    # the defaults are ".avi, .mkv, .mp4"-style strings; a loaded config is
+    # already split into a list
+    if isinstance(formats, str):
+        formats = formats.split(",")
+    suffixes = set()
+    for suffix in formats:
+        suffix = suffix.strip().casefold()
+        if suffix:
+            suffixes.add(suffix if suffix.startswith(".") else f".{suffix}")
+    return frozenset(suffixes)
+
+
+class MediaClassifier:
+    VIDEO = "video"
+    AUDIO = "audio"
+    DELETE = "delete"
+    IGNORE = "ignore"
+
+    def __init__(
+        self,
+        video_formats: str | Iterable[str],
+        audio_formats: str | Iterable[str],
+        exts_to_delete: str | Iterable[str],
+        filenames_to_ignore: Iterable[str] = (),
+    ):
+        self.video_formats = _suffixes(video_formats)
+        self.audio_formats = _suffixes(audio_formats)
+        self.exts_to_delete = _suffixes(exts_to_delete)
+        self.filenames_to_ignore = frozenset(
+            name.casefold() for name in filenames_to_ignore
+        )
+
+        # suffix -> kind. Video wins over everything else, then audio; a
+        # sample.mkv is only junk because of its size, never its extension
+        self._kinds: dict[str, str] = {}
+        for kind, suffixes in (
+            (self.DELETE, self.exts_to_delete),
+            (self.AUDIO, self.audio_formats),
+            (self.VIDEO, self.video_formats),
+        ):
+            self._kinds.update(dict.fromkeys(suffixes, kind))
+        # how many dots the longest suffix we know about has; `.part.rar`
+        # is two
+        self._max_parts = max((s.count(".") for s in self._kinds), default=1)
+
+    def extension(self, filename: str) -> Optional[str]:
+        """
+        The extension of filename, as written. That's the longest suffix we
+        know about (`.en.srt` if it's in one of the lists, rather than
+        `.srt`), or else whatever follows the last dot. Names that start
+        with their only dot don't have one.
+        """
+        last_dot = filename.rfind(".")
+        if last_dot <= 0:
+            return None
+        if self._max_parts > 1:
+            starts = [last_dot]
+            while len(starts) < self._max_parts:
+                start = filename.rfind(".", 0, starts[-1])
+                if start <= 0:
+                    break
+                starts.append(start)
+            for start in reversed(starts):
+                if filename[start:].casefold() in self._kinds:
+                    return filename[start:]
+        return filename[last_dot:]
+
+    def kind(self, filename: str) -> Optional[str]:
+        """VIDEO, AUDIO, DELETE, IGNORE, or None if it's none of those."""
+        if filename.casefold() in self.filenames_to_ignore:
+            return self.IGNORE
+        return self._extension_kind(filename)
+
+    def _extension_kind(self, filename: str) -> Optional[str]:
+        # kind() without the ignore list, which has no videos or audio in it
+        extension = self.extension(filename)
+        if extension is None:
+            return None
+        return self._kinds.get(extension.casefold())
+
+    def is_video(self, filename: str) -> bool:
+        return self._extension_kind(filename) == self.VIDEO
+
+    def video_extension(self, filename: str) -> Optional[str]:
+        """The extension of filename if it's a video, otherwise None."""
+        if self._max_parts > 1:
+            extension = self.extension(filename)
+        else:
+            # every folder name gets asked about, so skip the general case
+            # when there's no `.part.rar` to worry about
+            last_dot = filename.rfind(".")
+            extension = filename[last_dot:] if last_dot > 0 else None
+        if extension is None or self._kinds.get(extension.casefold()) != self.VIDEO:
+            return None
+        return extension
+
+    def is_audio(self, filename: str) -> bool:
+        return self._extension_kind(filename) == self.AUDIO
+
+    def classify(self, filenames: Iterable[str]) -> Classified:
+        """Sort a folder listing into buckets, keeping the original order."""
+        buckets = Classified([], [], [], [], [])
+        targets = {
+            self.VIDEO: buckets.video,
+            self.AUDIO: buckets.audio,
+            self.DELETE: buckets.delete,
+            self.IGNORE: buckets.ignore,
+            None: buckets.other,
+        }
+        for filename in filenames:
+            targets[self.kind(filename)].append(filename)
+        return buckets
+
+
+class FileInfo:
+    __slots__ = ("name", "size", "kind", "inode")
+
+    def __init__(self, name: str, size: int, kind: Optional[str], inode: int):
+        self.name = name
+        self.size = size
+        self.kind = kind
+        self.inode = inode
+
+    def __repr__(self) -> str:
+        return f"FileInfo({self.name!r}, {self.size}, {self.kind!r})"
+
+
+class FolderManifest:
+    """
+    Everything process_movie needs to know about the files in one folder,
+    built from a DirectorySnapshot with a single stat of each file.
+    """
+
+    __slots__ = ("path", "files", "videos", "largest_video", "video_bytes")
+
+    def __init__(self, folder, classifier: Optional[MediaClassifier] = None):
+        classifier = classifier or get_media_classifier()
+        self.path: str = folder.path
+        self.files: dict[str, FileInfo] = {}
+        self.videos: list[FileInfo] = []
+        self.largest_video: Optional[FileInfo] = None
+        self.video_bytes = 0
+
+        for name, entry in folder.files.items():
+            try:
+                size = entry.stat().st_size
+            except OSError:
+                # gone since the snapshot was taken
+                continue
+            info = FileInfo(name, size, classifier.kind(name), entry.inode())
+            self.files[name] = info
+            if info.kind == MediaClassifier.VIDEO:
+                self.videos.append(info)
+                self.video_bytes += size
+                if self.largest_video is None or size > self.largest_video.size:
+                    self.largest_video = info
+
+    @property
+    def video_count(self) -> int:
+        return len(self.videos)
+
+    def size(self, filename: str) -> int:
+        return self.files[filename].size
+
+    def of_kind(self, kind: Optional[str]) -> list[str]:
+        return [info.name for info in self.files.values() if info.kind == kind]
+
+
+def get_media_classifier() -> MediaClassifier:
+    if settings.media_classifier is None:
+        settings.media_classifier = MediaClassifier(
+            settings.video_formats,
+            settings.audio_formats,
+            settings.exts_to_delete,
+            settings.filenames_to_ignore,
+        )
+    return settings.media_classifier
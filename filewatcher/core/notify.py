@@ -0,0 +1,253 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: notify.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Lets a download client tell us when something is finished instead of
+   waiting for us to notice. With notify_socket set we listen on a Unix
+   socket for paths, one per line; each one wakes the watcher straight
+   away, and the next cycle looks at just those entries without scanning
+   the incoming directory or waiting for them to settle. The client's
+   word is good enough for that. Every line gets an answer back: `ok`, or
+   `error: <why>`.
+
+   With more than one incoming directory, the one socket serves them all.
+   Point the client's "run when finished" hook at:
+
+   python -m filewatcher.core.notify --socket <notify_socket> <path>
+*********************************************
+"""
+
+import argparse
+import os
+import select
+import socket
+import socketserver
+import stat
+import sys
+import threading
+import time
+from typing import Iterable, Optional
+
+from filewatcher.core import settings
+
+# an unreasonably long line is somebody talking to the wrong socket
+MAX_LINE = 64 * 1024
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        while True:
+            # never read more than that, however much is coming
+            line = self.rfile.readline(MAX_LINE + 1)
+            if not line:
+                return
+            if len(line) > MAX_LINE:
+                self.wfile.write(b"error: line too long\n")
+                return
+            path = os.fsdecode(line.rstrip(b"\r\n"))
+            if not path:
+                continue
+            try:
+                name = self.server.notifier.complete(path)
+            except ValueError as e:
+                self.wfile.write(f"error: {e}\n".encode())
+            else:
+                settings.debug_message(f"Notify - {name} is finished")
+                self.wfile.write(b"ok\n")
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _Root:
+    """What we've been told about one incoming root."""
+
+    def __init__(self):
+        # said to be finished and still sitting in incoming
+        self.completed: set[str] = set()
+        # ...and not handed over to a cycle yet
+        self.fresh: set[str] = set()
+        # anything written to the pipe wakes up whoever's waiting on it
+        self.wake_read, self.wake_write = os.pipe()
+        os.set_blocking(self.wake_read, False)
+        os.set_blocking(self.wake_write, False)
+
+    def wake(self) -> None:
+        try:
+            os.write(self.wake_write, b"!")
+        except BlockingIOError:
+            # the pipe is full, so whoever's waiting is already awake
+            pass
+
+    def close(self) -> None:
+        for fd in (self.wake_read, self.wake_write):
+            os.close(fd)
+
+
+class CompletionNotifier:
+    """
+    Listens on socket_path and keeps track of the root level names in the
+    incoming directories that a download client has said are finished. One
+    socket serves every incoming root; everything else goes by whichever
+    root settings.incoming_dir is at the time.
+    """
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self._lock = threading.Lock()
+        self._roots = {path: _Root() for path in settings.incoming_dirs}
+
+        self._remove_stale_socket()
+        # only whoever we're running as gets to tell us things; setting the
+        # umask first means there's no moment where anybody else could
+        umask = os.umask(0o177)
+        try:
+            self._server = _Server(socket_path, _Handler)
+        finally:
+            os.umask(umask)
+        self._server.notifier = self
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="filewatcher-notify", daemon=True
+        )
+        self._thread.start()
+
+    def _remove_stale_socket(self) -> None:
+        # left behind by a previous run that didn't get to clean up
+        try:
+            if stat.S_ISSOCK(os.lstat(self.socket_path).st_mode):
+                os.remove(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+    def _root(self) -> _Root:
+        return self._roots[settings.incoming_dir]
+
+    @property
+    def completed(self) -> set[str]:
+        return self._root().completed
+
+    def complete(self, path: str) -> str:
+        """Record that path is finished; returns its root level name."""
+        for root_path, root in self._roots.items():
+            incoming = os.path.realpath(root_path)
+            relative = os.path.relpath(
+                os.path.realpath(os.path.join(incoming, path)), incoming
+            )
+            if relative != os.curdir and relative.split(os.sep)[0] != os.pardir:
+                break
+        else:
+            raise ValueError(f"{path} isn't in {', '.join(self._roots)}")
+        name = relative.split(os.sep)[0]
+        with self._lock:
+            root.completed.add(name)
+            root.fresh.add(name)
+        root.wake()
+        return name
+
+    def is_complete(self, name: str) -> bool:
+        return name in self._root().completed
+
+    def take(self) -> set[str]:
+        """The names we've been told about since the last time we asked."""
+        root = self._root()
+        with self._lock:
+            fresh, root.fresh = root.fresh, set()
+        return fresh
+
+    def prune(self, present: Iterable[str]) -> None:
+        present = set(present)
+        root = self._root()
+        with self._lock:
+            root.completed &= present
+
+    def wake_fd(self) -> int:
+        return self._root().wake_read
+
+    def drain(self) -> None:
+        try:
+            while os.read(self._root().wake_read, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def sleep(self, timeout: float) -> bool:
+        """time.sleep(), but over early if something's finished."""
+        woken = bool(select.select([self.wake_fd()], [], [], max(timeout, 0))[0])
+        if woken:
+            self.drain()
+        return woken
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        for root in self._roots.values():
+            root.close()
+        try:
+            os.remove(self.socket_path)
+        except OSError:
+            pass
+
+
+def get_notifier() -> Optional[CompletionNotifier]:
+    if settings.notifier is None and settings.notify_socket:
+        if not hasattr(socket, "AF_UNIX"):
+            settings.debug_message("Unix sockets aren't available; not listening.")
+            settings.notify_socket = ""
+            return None
+        settings.notifier = CompletionNotifier(settings.notify_socket)
+    return settings.notifier
+
+
+def sleep(timeout: float) -> bool:
+    """
+    Sleep for timeout seconds, or until a download client tells us about
+    something. Returns whether it was the latter.
+    """
+    notifier = get_notifier()
+    if notifier is None:
+        time.sleep(timeout)
+        return False
+    return notifier.sleep(timeout)
+
+
+def notify_complete(paths: Iterable[str], socket_path: str) -> list[str]:
+    """Tell a running FileWatcher that paths are finished; its answers."""
+    answers = []
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        with client.makefile("rwb") as stream:
+            for path in paths:
+                stream.write(os.fsencode(os.path.abspath(path)) + b"\n")
+                stream.flush()
+                answers.append(stream.readline().decode().strip())
+    return answers
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Tell FileWatcher that a download is finished."
+    )
+    parser.add_argument("paths", nargs="+", help="what's finished downloading")
+    parser.add_argument("--socket", required=True, help="notify_socket from config")
+    args = parser.parse_args()
+
+    try:
+        answers = notify_complete(args.paths, args.socket)
+    except OSError as e:
+        print(f"Couldn't reach FileWatcher on {args.socket}: {e}", file=sys.stderr)
+        sys.exit(1)
+    failed = False
+    for path, answer in zip(args.paths, answers):
+        if answer != "ok":
+            print(f"{path}: {answer}", file=sys.stderr)
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
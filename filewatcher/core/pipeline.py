@@ -0,0 +1,300 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: pipeline.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   The asyncio version of main_loop, for runtime = async. A cycle is split
+   into stages (discover, settle, classify, resolve, import) that each run
+   as their own tasks, connected by bounded queues. While one folder is
+   waiting on the OMDb the next one is being checked and another is being
+   copied, instead of each one going through every step before the next
+   gets started. A full queue holds up the stage feeding it, so a slow
+   disk never has the whole incoming directory piled up in front of it.
+
+   The decisions are exactly the ones process_folders makes; the stages
+   just call the same functions, and the WorkScheduler decides the order
+   and what gets backed off the same way too. Anything that touches the disk or the
+   network runs in a thread pool so it never blocks the event loop.
+*********************************************
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from filewatcher.core import settings
+from filewatcher.core.filewatcher import (
+    classify_folder,
+    finish_cycle,
+    fresh_entries,
+    import_or_queue,
+    rename_and_move,
+    root_file_wanted,
+    settle_folder,
+    start_cycle,
+)
+from filewatcher.core.linking import get_import_registry
+from filewatcher.core.media import get_media_classifier
+from filewatcher.core.scheduler import get_work_scheduler
+from filewatcher.core.settle import get_settle_detector
+from filewatcher.core.state import ScanState
+from filewatcher.core.watcher import get_watcher
+from filewatcher.core.workers import get_copy_queue, get_device_slots
+from filewatcher.movies.movies import folder_translator, process_root_level_movie
+
+# how many items can be waiting in front of each stage
+QUEUE_SIZE = 32
+# how often (in seconds) the queue depths are sampled for the averages
+SAMPLE_INTERVAL = 0.05
+
+# what's going through the pipeline; a root level folder or a root level file
+FOLDER = "folder"
+FILE = "file"
+
+STAGES = ("settle", "classify", "resolve", "import")
+
+
+def _in_pool(pool: ThreadPoolExecutor, function: Callable, *args) -> asyncio.Future:
+    # run_in_executor(), but the thread gets to see the same incoming root
+    # and library we do
+    return asyncio.get_running_loop().run_in_executor(
+        pool, functools.partial(contextvars.copy_context().run, function, *args)
+    )
+
+
+class PipelineStats:
+    """How much work each stage did and how far behind it got."""
+
+    def __init__(self):
+        self.processed = dict.fromkeys(STAGES, 0)
+        # seconds spent in the stage's work, summed over its workers
+        self.busy = dict.fromkeys(STAGES, 0.0)
+        self.max_depth = dict.fromkeys(STAGES, 0)
+        self._depth_total = dict.fromkeys(STAGES, 0)
+        self._samples = 0
+        self.seconds = 0.0
+
+    def queued(self, stage: str, depth: int) -> None:
+        self.max_depth[stage] = max(self.max_depth[stage], depth)
+
+    def sample(self, queues: dict[str, asyncio.Queue]) -> None:
+        self._samples += 1
+        for stage, queue in queues.items():
+            self._depth_total[stage] += queue.qsize()
+
+    def mean_depth(self, stage: str) -> float:
+        if not self._samples:
+            return 0.0
+        return self._depth_total[stage] / self._samples
+
+    def __str__(self) -> str:
+        return f"Pipeline - cycle took {self.seconds:.2f}s; " + ", ".join(
+            f"{stage}: {self.processed[stage]} in {self.busy[stage]:.2f}s"
+            f" (queue max {self.max_depth[stage]},"
+            f" mean {self.mean_depth(stage):.1f})"
+            for stage in STAGES
+        )
+
+
+class Pipeline:
+    """One cycle of main_loop, run as a set of stages."""
+
+    def __init__(self, watcher, queue_size: int = QUEUE_SIZE):
+        self.watcher = watcher
+        self.queue_size = queue_size
+        self.stats = PipelineStats()
+        self.error: Optional[BaseException] = None
+
+    def _collector(self) -> tuple[list[str], Callable[[str], None]]:
+        # stands in for rename_and_move so the movie can be handed on to
+        # the next stage instead of being imported on the spot
+        collected = []
+        return collected, collected.append
+
+    def settle(self, item: tuple) -> list[tuple]:
+        kind, name, _ = item
+        if not get_work_scheduler().start(name):
+            return []
+        if kind == FILE:
+            if not root_file_wanted(name, self.snapshot, self.state):
+                return []
+            if settings.in_use(os.path.join(settings.incoming_dir, name)):
+                return []
+            return [item]
+
+        collected, importer = self._collector()
+        folder = settle_folder(name, self.snapshot, self.state, importer)
+        # a DVD rip goes straight on to be imported
+        return [(FOLDER, found, None) for found in collected] + (
+            [] if folder is None else [(FOLDER, name, folder)]
+        )
+
+    def classify(self, item: tuple) -> list[tuple]:
+        kind, name, folder = item
+        if folder is None:
+            # nothing to work out; it's already known to be a movie
+            return [item]
+        collected, importer = self._collector()
+        classify_folder(name, folder, self.snapshot, self.state, importer)
+        return [(kind, found, None) for found in collected]
+
+    def resolve(self, item: tuple) -> list[tuple]:
+        # the answer lands in the parser and OMDb caches, which is where
+        # the import stage will go looking for it
+        folder_translator(item[1])
+        return [item]
+
+    def import_(self, item: tuple) -> list[tuple]:
+        kind, name, _ = item
+        # a copy goes on the copy queue so the import workers can keep
+        # going with the renames
+        if kind == FILE:
+            import_or_queue(process_root_level_movie, self.copies, name)
+        else:
+            import_or_queue(rename_and_move, self.copies, name)
+        return []
+
+    async def _put(self, stage: str, item: Optional[tuple]) -> None:
+        queue = self.queues[stage]
+        await queue.put(item)
+        self.stats.queued(stage, queue.qsize())
+
+    async def _stage(
+        self,
+        stage: str,
+        work: Callable[[tuple], list[tuple]],
+        pool: ThreadPoolExecutor,
+        workers: int,
+        downstream: Optional[str],
+    ) -> None:
+        inbox = self.queues[stage]
+        scheduler = get_work_scheduler()
+
+        async def worker() -> None:
+            while True:
+                item = await inbox.get()
+                if item is None:
+                    # leave it there for the other workers
+                    await inbox.put(None)
+                    return
+                started = time.perf_counter()
+                try:
+                    results = await _in_pool(pool, work, item)
+                except OSError as e:
+                    # backed off, same as in process_folders
+                    scheduler.error(item[1], e)
+                    results = []
+                except Exception as e:
+                    # keep going like run_in_pool does; the first one gets
+                    # raised once the cycle is over
+                    settings.debug_message(f"Pipeline - {stage} of {item[1]}: {e!r}")
+                    if self.error is None:
+                        self.error = e
+                    results = []
+                self.stats.busy[stage] += time.perf_counter() - started
+                self.stats.processed[stage] += 1
+                if not results:
+                    # this is as far as it goes this cycle
+                    scheduler.finish(item[1])
+                if downstream is not None:
+                    for result in results:
+                        await self._put(downstream, result)
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        if downstream is not None:
+            await self._put(downstream, None)
+
+    async def _discover(self, pool: ThreadPoolExecutor) -> bool:
+        try:
+            return await self._feed(pool)
+        finally:
+            # whatever happens, the stages after us need to hear we're done
+            await self._put("settle", None)
+
+    async def _feed(self, pool: ThreadPoolExecutor) -> bool:
+        cycle = await _in_pool(pool, start_cycle, self.watcher)
+        if cycle is None:
+            return False
+        self.snapshot, dirs, files, self.state = cycle
+
+        # make sure the shared helpers exist before any worker threads go
+        # looking for them
+        get_settle_detector()
+        get_device_slots()
+        get_import_registry()
+
+        classifier = get_media_classifier()
+        if files:
+            settings.debug_message(f"Found root level files: {files}")
+        files = [f for f in files if classifier.kind(f) != classifier.IGNORE]
+        dirs = fresh_entries(ScanState.FOLDERS, dirs, self.snapshot.folders, self.state)
+        files = fresh_entries(ScanState.FILES, files, self.snapshot.files, self.state)
+        scheduler = get_work_scheduler()
+        dirs = scheduler.plan(dirs, self.snapshot.folders)
+        files = scheduler.plan(files, self.snapshot.files)
+
+        for name in dirs:
+            await self._put("settle", (FOLDER, name, None))
+        for name in files:
+            await self._put("settle", (FILE, name, None))
+        return True
+
+    async def _sample(self) -> None:
+        while True:
+            self.stats.sample(self.queues)
+            await asyncio.sleep(SAMPLE_INTERVAL)
+
+    async def run(self) -> None:
+        started = time.perf_counter()
+        self.queues = {stage: asyncio.Queue(self.queue_size) for stage in STAGES}
+        self.copies = get_copy_queue()
+        workers = int(settings.workers)
+        lookups = max(int(settings.omdb_concurrency), 1)
+
+        with ThreadPoolExecutor(
+            max_workers=workers * 2, thread_name_prefix="filewatcher-fs"
+        ) as fs_pool, ThreadPoolExecutor(
+            max_workers=lookups, thread_name_prefix="filewatcher-lookup"
+        ) as lookup_pool, ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="filewatcher-import"
+        ) as import_pool:
+            sampler = asyncio.ensure_future(self._sample())
+            try:
+                results = await asyncio.gather(
+                    self._discover(fs_pool),
+                    self._stage("settle", self.settle, fs_pool, workers, "classify"),
+                    self._stage("classify", self.classify, fs_pool, workers, "resolve"),
+                    self._stage(
+                        "resolve", self.resolve, lookup_pool, lookups, "import"
+                    ),
+                    self._stage("import", self.import_, import_pool, workers, None),
+                )
+            finally:
+                sampler.cancel()
+                try:
+                    await _in_pool(fs_pool, self.copies.join)
+                except Exception as e:
+                    if self.error is None:
+                        self.error = e
+
+            if not results[0]:
+                # nothing changed, and start_cycle has already waited
+                return
+            self.stats.seconds = time.perf_counter() - started
+            settings.debug_message(str(self.stats))
+
+            await _in_pool(fs_pool, finish_cycle, self.watcher, self.state)
+
+        if self.error is not None:
+            raise self.error
+
+
+def main_loop() -> None:
+    asyncio.run(Pipeline(get_watcher()).run())
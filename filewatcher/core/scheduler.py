@@ -0,0 +1,206 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: scheduler.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Decides what gets looked at each cycle, and in what order. Something
+   that's still downloading or keeps failing to move gets looked at less
+   and less often (settle_time, then twice that, and so on up to
+   retry_backoff_max) instead of every single cycle. Everything else goes
+   in order of how likely it is to be quick: renames onto a library on the
+   same disk first, then copies from smallest to largest, oldest first in
+   each, and anything that's failed before goes last. With a cycle_budget, whatever
+   doesn't get started in time waits for the next cycle, so one bad folder
+   can't hold up a new download for long.
+*********************************************
+"""
+
+import math
+import os
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from filewatcher.core import settings
+from filewatcher.core.console import say
+from filewatcher.core.settle import get_settle_detector
+from filewatcher.core.volumes import library_devices
+
+
+class Retry:
+    __slots__ = ("attempts", "due")
+
+    def __init__(self, attempts: int, due: float):
+        self.attempts = attempts
+        # clock() after which it's worth another look
+        self.due = due
+
+
+class WorkScheduler:
+    def __init__(
+        self,
+        base_delay: float = 15,
+        max_delay: float = 900,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.clock = clock
+        self.base_delay = max(base_delay, 1)
+        self.max_delay = max(max_delay, self.base_delay)
+        self._lock = threading.Lock()
+        self._retries: dict[str, Retry] = {}
+        # names that failed this cycle; they don't get to clear their
+        # backoff on the way out
+        self._failed: set[str] = set()
+        # names we ran out of time for this cycle
+        self.skipped: set[str] = set()
+        self.deadline: Optional[float] = None
+
+    def begin_cycle(self, present: Optional[Iterable[str]], budget: float = 0) -> None:
+        """
+        Forget about anything that's gone and start the clock. `present` is
+        None if we only looked at some of the incoming directory.
+        """
+        with self._lock:
+            if present is not None:
+                present = set(present)
+                for name in list(self._retries):
+                    if name not in present:
+                        del self._retries[name]
+            self._failed = set()
+            self.skipped = set()
+        self.deadline = self.clock() + budget if budget > 0 else None
+
+    def forgive(self, names: Iterable[str]) -> None:
+        """Let names be looked at right away, however they did before."""
+        with self._lock:
+            for name in names:
+                self._retries.pop(name, None)
+
+    def out_of_time(self) -> bool:
+        return self.deadline is not None and self.clock() >= self.deadline
+
+    def is_due(self, name: str, now: Optional[float] = None) -> bool:
+        retry = self._retries.get(name)
+        return retry is None or retry.due <= (self.clock() if now is None else now)
+
+    def plan(self, names: list[str], entries: dict) -> list[str]:
+        """
+        The names that are due for a look, best first. `entries` are the
+        DirEntries for them from the incoming snapshot.
+        """
+        now = self.clock()
+        due = [name for name in names if self.is_due(name, now)]
+        if len(due) < len(names):
+            settings.debug_message(
+                f"Scheduler - {len(names) - len(due)} item(s) backing off"
+            )
+
+        devices = library_devices()
+
+        def priority(name: str) -> tuple:
+            retrying = name in self._retries
+            entry = entries.get(name)
+            try:
+                stat = entry.stat()
+                is_file = entry.is_file()
+            except (AttributeError, OSError):
+                return (retrying, True, 0, 0.0)
+            renamed = stat.st_dev in devices
+            # a folder's own size says nothing about what's in it
+            size = stat.st_size if is_file and not renamed else 0
+            return (retrying, not renamed, size, stat.st_mtime)
+
+        return sorted(due, key=priority)
+
+    def failed(self, name: str, reason: str = "") -> None:
+        """Push the next look at name further out than the last one."""
+        with self._lock:
+            self._failed.add(name)
+            retry = self._retries.get(name)
+            attempts = retry.attempts + 1 if retry else 1
+            delay = min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+            self._retries[name] = Retry(attempts, self.clock() + delay)
+        settings.debug_message(
+            f"Scheduler - {name} {reason or 'failed'}; trying again in {delay:.0f}s"
+        )
+
+    def error(self, name: str, error: OSError) -> None:
+        say(f"Encountered an issue with {name}! Will try again later. ({error})")
+        self.failed(name, repr(error))
+
+    def _deferred(self, name: str) -> bool:
+        # did the settle detector tell us to wait on anything in here?
+        path = os.path.join(settings.incoming_dir, name)
+        return any(
+            deferred == path or deferred.startswith(path + os.sep)
+            for deferred in list(get_settle_detector().deferred)
+        )
+
+    def finish(self, name: str) -> None:
+        """We're done with name for this cycle; work out how it went."""
+        if name in self.skipped or name in self._failed:
+            return
+        if self._deferred(name):
+            self.failed(name, "is still in use")
+            return
+        with self._lock:
+            self._retries.pop(name, None)
+
+    def start(self, name: str) -> bool:
+        """Is there time to start on name? If not, it's first up next cycle."""
+        if self.out_of_time():
+            with self._lock:
+                self.skipped.add(name)
+            return False
+        return True
+
+    def run(self, name: str, function: Callable[[], None]) -> None:
+        """
+        Call function() for name, unless we're out of time. An OSError backs
+        name off instead of taking the rest of the cycle down with it.
+        """
+        if not self.start(name):
+            return
+        try:
+            function()
+        except OSError as e:
+            self.error(name, e)
+        finally:
+            self.finish(name)
+
+    def next_retry(self) -> Optional[float]:
+        """Seconds until the next backed off item is due, if there are any."""
+        with self._lock:
+            if not self._retries:
+                return None
+            soonest = min(retry.due for retry in self._retries.values())
+        return max(soonest - self.clock(), 0)
+
+    def pending(self) -> set[str]:
+        """Names that need a look next cycle whether or not they've changed."""
+        now = self.clock()
+        with self._lock:
+            return self.skipped | {
+                name for name, retry in self._retries.items() if retry.due <= now
+            }
+
+    def wait_time(self, timeout: float) -> int:
+        """How long the watcher should wait, given how long it wants to."""
+        if self.skipped:
+            # there's still work to do from this cycle
+            return 0
+        retry_in = self.next_retry()
+        if retry_in is not None:
+            timeout = min(timeout, max(math.ceil(retry_in), 1))
+        return int(timeout)
+
+
+def get_work_scheduler() -> WorkScheduler:
+    if settings.work_scheduler is None:
+        settings.work_scheduler = WorkScheduler(
+            float(settings.settle_time), float(settings.retry_backoff_max)
+        )
+    return settings.work_scheduler
@@ -0,0 +1,241 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: settle.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Figures out whether a download is finished ("settled") before we start
+   renaming and moving it. The old trick of renaming a file twice only
+   tells us anything on Windows, where open files are locked; everywhere
+   else we look for processes holding the file open for writing and make
+   sure its size and mtime have stopped moving.
+*********************************************
+"""
+
+import os
+import stat
+import threading
+import time
+from typing import Optional
+
+from filewatcher.core import DirectorySnapshot, settings
+from filewatcher.core.fs import get_filesystem
+
+# observations that never settle (deleted files, mostly) get dropped after this
+OBSERVATION_MAX_AGE = 60 * 60
+
+
+class OpenFileIndex:
+    """
+    Maps (st_dev, st_ino) to the pids that have that file open for writing,
+    built by walking /proc/<pid>/fd. Only files under `prefix` are indexed,
+    which keeps the number of stat calls down to the ones we care about.
+
+    Note that unless we're running as root we can only see our own user's
+    processes; if the download client runs as somebody else the index is
+    simply empty and the size/mtime check has to carry the load.
+    """
+
+    def __init__(self, proc_root: str = "/proc", prefix: str = "/"):
+        self.proc_root = proc_root
+        self.prefix = os.path.join(prefix, "")
+        self.writers: dict[tuple[int, int], set[int]] = {}
+
+    @property
+    def available(self) -> bool:
+        # nobody has an in-memory file open
+        return get_filesystem().on_disk and os.path.isdir(self.proc_root)
+
+    def _open_for_writing(self, pid: str, fd: str) -> bool:
+        try:
+            with open(os.path.join(self.proc_root, pid, "fdinfo", fd)) as fdinfo:
+                for line in fdinfo:
+                    if line.startswith("flags:"):
+                        flags = int(line.split()[1], 8)
+                        return flags & os.O_ACCMODE in (os.O_WRONLY, os.O_RDWR)
+        except (OSError, ValueError, IndexError):
+            pass
+        # can't tell; better to wait a cycle than to move a half-written file
+        return True
+
+    def rebuild(self) -> None:
+        self.writers = {}
+        try:
+            pids = [p for p in os.listdir(self.proc_root) if p.isdigit()]
+        except OSError:
+            return
+
+        for pid in pids:
+            fd_dir = os.path.join(self.proc_root, pid, "fd")
+            try:
+                fds = os.listdir(fd_dir)
+            except OSError:
+                # process exited or isn't ours to look at
+                continue
+
+            for fd in fds:
+                fd_path = os.path.join(fd_dir, fd)
+                try:
+                    target = os.readlink(fd_path)
+                    if not target.startswith(self.prefix):
+                        continue
+                    fd_stat = os.stat(fd_path)
+                except OSError:
+                    continue
+                if not stat.S_ISREG(fd_stat.st_mode):
+                    continue
+                if self._open_for_writing(pid, fd):
+                    key = (fd_stat.st_dev, fd_stat.st_ino)
+                    self.writers.setdefault(key, set()).add(int(pid))
+
+    def is_being_written(self, file_stat: os.stat_result) -> bool:
+        return (file_stat.st_dev, file_stat.st_ino) in self.writers
+
+
+class RenameProbeDetector:
+    """
+    The original in_use() check: rename the file and rename it back. Only
+    meaningful on Windows, where a file that's open elsewhere can't be
+    renamed.
+    """
+
+    name = "rename"
+
+    def __init__(self):
+        self.deferred: set[str] = set()
+
+    def begin_cycle(self) -> None:
+        self.deferred = set()
+
+    def is_settled(self, path: str, file_stat: Optional[os.stat_result] = None) -> bool:
+        # yes, possible race condition, but due to the system we're putting
+        # this into race conditions will not be an issue.
+        fs = get_filesystem()
+        try:
+            fs.rename(path, path + "_")
+            fs.rename(path + "_", path)
+            return True
+        except OSError:
+            self.deferred.add(path)
+            return False
+
+    def folder_is_settled(self, folder: DirectorySnapshot) -> bool:
+        # two renames per file adds up; the first file has always been a
+        # good enough canary for this one
+        for entry in folder.files.values():
+            return self.is_settled(entry.path)
+        return True
+
+
+class QuiescenceDetector:
+    """
+    A file is settled once nobody has it open for writing and either its
+    size and mtime haven't moved for `quiet_period` seconds of us looking,
+    or it hasn't been touched in `quiet_period` seconds. Nothing on disk is
+    modified to find out.
+    """
+
+    name = "quiescence"
+
+    def __init__(
+        self,
+        quiet_period: float = 15,
+        proc_root: str = "/proc",
+        prefix: Optional[str] = None,
+        clock=time.time,
+    ):
+        self.quiet_period = quiet_period
+        self.clock = clock
+        self.open_files = OpenFileIndex(
+            proc_root, prefix or os.path.realpath(settings.incoming_dir)
+        )
+        # path -> (size, mtime_ns, when we first saw it like that)
+        self.observations: dict[str, tuple[int, int, float]] = {}
+        self.deferred: set[str] = set()
+        self._index_is_fresh = False
+        # process_folders may be calling us from several threads at once
+        self._lock = threading.RLock()
+
+    def begin_cycle(self) -> None:
+        # the /proc walk is the expensive bit, so it happens at most once
+        # per cycle and only if somebody actually asks
+        self._index_is_fresh = False
+        self.deferred = set()
+
+        now = self.clock()
+        for path, (_, _, seen) in list(self.observations.items()):
+            if now - seen > OBSERVATION_MAX_AGE:
+                del self.observations[path]
+
+    def _writers_index(self) -> OpenFileIndex:
+        with self._lock:
+            if not self._index_is_fresh:
+                if self.open_files.available:
+                    self.open_files.rebuild()
+                self._index_is_fresh = True
+        return self.open_files
+
+    def is_settled(self, path: str, file_stat: Optional[os.stat_result] = None) -> bool:
+        try:
+            file_stat = file_stat or get_filesystem().stat(path)
+        except OSError:
+            return False
+
+        writers = self._writers_index()
+        now = self.clock()
+        current = (file_stat.st_size, file_stat.st_mtime_ns)
+
+        with self._lock:
+            previous = self.observations.get(path)
+            if previous is None or previous[:2] != current:
+                previous = (*current, now)
+            self.observations[path] = previous
+
+            if writers.is_being_written(file_stat):
+                settings.debug_message(f"{path} is open for writing.")
+                # the quiet period starts once it's closed
+                self.observations[path] = (*current, now)
+                self.deferred.add(path)
+                return False
+
+            # looking twice in quick succession doesn't prove anything
+            if now - previous[2] >= self.quiet_period:
+                del self.observations[path]
+                return True
+
+            if now - file_stat.st_mtime_ns / 1e9 >= self.quiet_period:
+                del self.observations[path]
+                return True
+
+            settings.debug_message(f"{path} changed recently; checking again later.")
+            self.deferred.add(path)
+            return False
+
+    def folder_is_settled(self, folder: DirectorySnapshot) -> bool:
+        # every file has to be done, not just the first one we come across
+        settled = True
+        for entry in folder.files.values():
+            try:
+                entry_stat = entry.stat()
+            except OSError:
+                continue
+            if not self.is_settled(entry.path, entry_stat):
+                settled = False
+        return settled
+
+
+def create_settle_detector() -> RenameProbeDetector | QuiescenceDetector:
+    mode = settings.settle_mode
+    if mode == "auto":
+        mode = "rename" if os.name == "nt" else "quiescence"
+    if mode == "rename":
+        return RenameProbeDetector()
+    return QuiescenceDetector(quiet_period=int(settings.settle_time))
+
+
+def get_settle_detector() -> RenameProbeDetector | QuiescenceDetector:
+    if settings.settle_detector is None:
+        settings.settle_detector = create_settle_detector()
+    return settings.settle_detector
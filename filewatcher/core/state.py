@@ -0,0 +1,147 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: state.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Remembers which entries in the incoming directory we've already looked
+   at and decided to leave alone, along with their inode, size, and mtime.
+   If none of those have changed by the next cycle, there's no reason to go
+   through the whole song and dance again. Saved to disk so a restart
+   doesn't start from scratch either, unless one of the settings those
+   decisions were made with has changed since.
+*********************************************
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Iterable, Optional
+
+from filewatcher.core import settings
+from filewatcher.core.fs import get_filesystem
+
+STATE_FILENAME = "scan_state.json"
+# what goes into deciding to leave something alone; if any of these change,
+# so might the decision
+RELEVANT_SETTINGS = (
+    "video_formats",
+    "audio_formats",
+    "exts_to_delete",
+    "min_movie_size",
+    "min_episode_size",
+)
+
+
+def settings_hash() -> str:
+    relevant = {}
+    for name in RELEVANT_SETTINGS:
+        value = getattr(settings, name)
+        if isinstance(value, str) and "," in value:
+            # straight out of the config file
+            value = [part.strip() for part in value.split(",")]
+        if isinstance(value, (list, tuple, set)):
+            # the order they're listed in doesn't change anything
+            value = sorted(value)
+        relevant[name] = value
+    encoded = json.dumps(relevant, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()
+
+
+class ScanState:
+    FOLDERS = "folders"
+    FILES = "files"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dirty = False
+        self._lock = threading.Lock()
+        self.settings_hash = settings_hash()
+        self._entries: dict[str, dict[str, list[int]]] = {
+            self.FOLDERS: {},
+            self.FILES: {},
+        }
+        self.load()
+
+    @staticmethod
+    def fingerprint(entry: os.DirEntry, fresh: bool = False) -> list[int]:
+        # DirEntry caches its stat result from the start of the cycle; when
+        # we're recording an entry we've just poked at, go back to the disk
+        stat = get_filesystem().stat(entry.path) if fresh else entry.stat()
+        return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as state_file:
+                loaded = json.load(state_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            settings.debug_message(
+                f"Scan state at {self.path} is unreadable; ignoring."
+            )
+            return
+
+        if loaded.get("settings") != self.settings_hash:
+            settings.debug_message(
+                "Settings have changed since the scan state was saved; ignoring it."
+            )
+            # don't leave the old one lying around to be ignored every time
+            self.dirty = True
+            return
+
+        for kind in self._entries:
+            self._entries[kind] = loaded.get(kind, {})
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with self._lock, open(temp_path, "w", encoding="utf-8") as state_file:
+            json.dump({"settings": self.settings_hash, **self._entries}, state_file)
+            self.dirty = False
+        os.replace(temp_path, self.path)
+
+    def unchanged(self, kind: str, entry: Optional[os.DirEntry]) -> bool:
+        if entry is None:
+            return False
+        try:
+            return self._entries[kind].get(entry.name) == self.fingerprint(entry)
+        except OSError:
+            return False
+
+    def remember(self, kind: str, entry: Optional[os.DirEntry]) -> None:
+        if entry is None:
+            return
+        try:
+            fingerprint = self.fingerprint(entry, fresh=True)
+        except OSError:
+            return
+        with self._lock:
+            self._entries[kind][entry.name] = fingerprint
+            self.dirty = True
+
+    def forget(self, kind: str, name: str) -> None:
+        with self._lock:
+            if self._entries[kind].pop(name, None) is not None:
+                self.dirty = True
+
+    def prune(self, kind: str, present: Iterable[str]) -> None:
+        present = set(present)
+        for name in list(self._entries[kind]):
+            if name not in present:
+                self.forget(kind, name)
+
+
+def get_scan_state() -> ScanState:
+    if settings.scan_state is None:
+        settings.scan_state = ScanState(
+            os.path.join(
+                settings.incoming_state_dir or settings.state_dir, STATE_FILENAME
+            )
+        )
+    return settings.scan_state
@@ -0,0 +1,391 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: transfer.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Moves files and folders into the library. If the destination is on the
+   same filesystem it's a plain rename; otherwise the bytes get copied in
+   big chunks by the kernel (copy_file_range, then sendfile, then plain
+   reads if we have to), the destination is preallocated and fsynced, and
+   it's only renamed into place once it's all there. The source is removed
+   last, so a failure part way through never costs us the original.
+*********************************************
+"""
+
+import errno
+import os
+import shutil
+import time
+from typing import Callable, Optional
+
+from filewatcher.core import settings
+from filewatcher.core.verify import verify_copy
+
+CHUNK_SIZE = 64 * 1024 * 1024
+# how much gets copied between checkpoints when somebody's keeping track
+CHECKPOINT_SIZE = 4 * CHUNK_SIZE
+PARTIAL_SUFFIX = ".fwpart"
+# how often (in seconds) a copy says how it's getting on, in debug mode
+PROGRESS_INTERVAL = 10
+
+# errors that mean "this syscall can't do this particular copy", as opposed
+# to "the disk is on fire"
+_UNSUPPORTED = {
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.EBADF,
+}
+
+# (strategy name, source device, destination device) combinations that have
+# already told us no, so we don't ask again for every file in a folder
+_known_unsupported: set[tuple[str, int, int]] = set()
+
+
+class TransferStats:
+    def __init__(self):
+        self.bytes_copied = 0
+        self.files = 0
+        self.seconds = 0.0
+        self.renamed = False
+        # full path -> checksum of everything that was copied and verified
+        self.hashes: dict[str, str] = {}
+
+    @property
+    def throughput(self) -> float:
+        """Megabytes per second."""
+        if not self.seconds:
+            return 0.0
+        return self.bytes_copied / 1000000 / self.seconds
+
+    def __str__(self) -> str:
+        if self.renamed:
+            return "renamed in place"
+        return (
+            f"{self.files} file(s), {self.bytes_copied / 1000000:.1f} MB in"
+            f" {self.seconds:.1f}s ({self.throughput:.1f} MB/s)"
+        )
+
+
+def _preallocate(fd: int, size: int) -> None:
+    # helps the filesystem lay the file out contiguously; purely an
+    # optimization, so if the filesystem doesn't support it we carry on
+    if size and hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            pass
+
+
+# every strategy takes (src_fd, dst_fd, offset, size, progress), copies from
+# offset to size in CHUNK_SIZE pieces calling progress(offset, size) after
+# each one, and returns where it ended up
+Progress = Optional[Callable[[int, int], None]]
+
+
+def _copy_range(
+    src_fd: int, dst_fd: int, offset: int, size: int, progress: Progress
+) -> int:
+    while offset < size:
+        copied = os.copy_file_range(
+            src_fd, dst_fd, min(CHUNK_SIZE, size - offset), offset, offset
+        )
+        if copied == 0:
+            break
+        offset += copied
+        if progress:
+            progress(offset, size)
+    return offset
+
+
+def _sendfile(
+    src_fd: int, dst_fd: int, offset: int, size: int, progress: Progress
+) -> int:
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    while offset < size:
+        sent = os.sendfile(dst_fd, src_fd, offset, min(CHUNK_SIZE, size - offset))
+        if sent == 0:
+            break
+        offset += sent
+        if progress:
+            progress(offset, size)
+    return offset
+
+
+def _read_write(
+    src_fd: int, dst_fd: int, offset: int, size: int, progress: Progress
+) -> int:
+    os.lseek(src_fd, offset, os.SEEK_SET)
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    buffer = bytearray(min(CHUNK_SIZE, 8 * 1024 * 1024))
+    view = memoryview(buffer)
+    with open(src_fd, "rb", buffering=0, closefd=False) as src:
+        while offset < size:
+            read = src.readinto(view)
+            if not read:
+                break
+            written = 0
+            while written < read:
+                written += os.write(dst_fd, view[written:read])
+            offset += read
+            if progress:
+                progress(offset, size)
+    return offset
+
+
+def _debug_progress(path: str, offset: int = 0) -> Progress:
+    """
+    A progress callback for copying path that tells the debug log how far
+    along it is every PROGRESS_INTERVAL seconds, or None if we're not
+    debugging. Anything quicker than that never says a word.
+    """
+    if not settings.debug:
+        return None
+    started = reported = time.monotonic()
+
+    def progress(position: int, size: int) -> None:
+        nonlocal reported
+        now = time.monotonic()
+        if now - reported < PROGRESS_INTERVAL:
+            return
+        reported = now
+        rate = (position - offset) / 1000000 / max(now - started, 1e-9)
+        settings.debug_message(
+            f"Copying {path}: {position / 1000000:.0f} of {size / 1000000:.0f} MB"
+            f" ({position / max(size, 1):.0%}, {rate:.1f} MB/s)"
+        )
+
+    return progress
+
+
+def _copy_strategies() -> list[Callable[[int, int, int, int, Progress], int]]:
+    strategies = []
+    if hasattr(os, "copy_file_range"):
+        strategies.append(_copy_range)
+    if hasattr(os, "sendfile"):
+        strategies.append(_sendfile)
+    strategies.append(_read_write)
+    return strategies
+
+
+def copy_file(
+    source: str,
+    destination: str,
+    offset: int = 0,
+    progress: Progress = None,
+    checkpoint: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    Copy source to destination through a temporary file next to the
+    destination, renaming it into place once it's complete and synced.
+    `offset` lets a caller pick up a partial copy where it left off.
+    `checkpoint(offset)` is called every CHECKPOINT_SIZE bytes, after
+    everything up to offset has been synced to disk. Returns the number of
+    bytes copied.
+    """
+    size = os.stat(source).st_size
+    partial = destination + PARTIAL_SUFFIX
+    last_checkpoint = offset
+
+    src_fd = os.open(source, os.O_RDONLY)
+    try:
+        flags = os.O_WRONLY | os.O_CREAT
+        if not offset:
+            flags |= os.O_TRUNC
+        dst_fd = os.open(partial, flags, 0o644)
+
+        def on_chunk(position: int, size: int) -> None:
+            nonlocal last_checkpoint
+            if progress:
+                progress(position, size)
+            if checkpoint and position - last_checkpoint >= CHECKPOINT_SIZE:
+                os.fsync(dst_fd)
+                checkpoint(position)
+                last_checkpoint = position
+
+        try:
+            _preallocate(dst_fd, size)
+            devices = (os.fstat(src_fd).st_dev, os.fstat(dst_fd).st_dev)
+            position = offset
+            for strategy in _copy_strategies():
+                if (strategy.__name__, *devices) in _known_unsupported:
+                    continue
+                try:
+                    position = strategy(src_fd, dst_fd, position, size, on_chunk)
+                    break
+                except OSError as e:
+                    if e.errno not in _UNSUPPORTED:
+                        raise
+                    _known_unsupported.add((strategy.__name__, *devices))
+                    settings.debug_message(
+                        f"{strategy.__name__} can't copy {source}; falling back."
+                    )
+            if position != size:
+                raise OSError(errno.EIO, f"Short copy of {source}", source)
+            os.ftruncate(dst_fd, size)
+            os.fsync(dst_fd)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+    shutil.copystat(source, partial)
+    os.rename(partial, destination)
+    return size - offset
+
+
+def _fsync_directory(path: str) -> None:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _copy_tree(
+    source: str,
+    destination: str,
+    stats: TransferStats,
+    checkpoint: Optional[Callable[[str, int], None]] = None,
+    resume: Optional[dict] = None,
+) -> None:
+    os.makedirs(destination, exist_ok=resume is not None)
+    for dirpath, dirnames, filenames in os.walk(source):
+        relative_dir = os.path.relpath(dirpath, source)
+        target_dir = os.path.normpath(os.path.join(destination, relative_dir))
+        for dirname in dirnames:
+            os.makedirs(os.path.join(target_dir, dirname), exist_ok=resume is not None)
+        for filename in filenames:
+            relative_path = os.path.normpath(os.path.join(relative_dir, filename))
+            source_file = os.path.join(dirpath, filename)
+            target_file = os.path.join(target_dir, filename)
+            stats.files += 1
+
+            offset = 0
+            if resume is not None:
+                if _already_copied(source_file, target_file):
+                    continue
+                offset = _resume_offset(target_file, relative_path, resume)
+
+            stats.bytes_copied += copy_file(
+                source_file,
+                target_file,
+                offset=offset,
+                progress=_debug_progress(source_file, offset),
+                checkpoint=checkpoint
+                and (lambda position, path=relative_path: checkpoint(path, position)),
+            )
+        shutil.copystat(dirpath, target_dir)
+
+
+def _already_copied(source_file: str, target_file: str) -> bool:
+    # copy_file only gives a file its real name once it's complete
+    try:
+        return os.stat(target_file).st_size == os.stat(source_file).st_size
+    except OSError:
+        return False
+
+
+def _resume_offset(target_file: str, relative_path: str, resume: dict) -> int:
+    if resume.get("file") != relative_path:
+        return 0
+    offset = resume.get("offset", 0)
+    try:
+        if os.stat(target_file + PARTIAL_SUFFIX).st_size >= offset:
+            return offset
+    except OSError:
+        pass
+    return 0
+
+
+def move(
+    source: str,
+    destination: str,
+    checkpoint: Optional[Callable[[str, int], None]] = None,
+    resume: Optional[dict] = None,
+    verify: bool = False,
+) -> TransferStats:
+    """
+    Move a file or folder to `destination` (the full new path, not the
+    folder to put it in). Raises FileExistsError if something is already
+    there rather than merging into it.
+
+    `checkpoint(relative_path, offset)` is called as a cross-device copy
+    makes synced progress. Passing the last checkpoint back as `resume`
+    ({"file": relative_path, "offset": offset}) picks an interrupted copy
+    back up instead of starting over.
+
+    With `verify`, a cross-device copy is checked against the original
+    before the original is removed; if they don't match, the copy is
+    thrown away and VerificationError is raised.
+    """
+    stats = TransferStats()
+    started = time.monotonic()
+
+    if os.path.lexists(destination):
+        raise FileExistsError(errno.EEXIST, "Destination already exists", destination)
+
+    if resume is None:
+        try:
+            os.rename(source, destination)
+            stats.renamed = True
+            return stats
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+
+    # anything that isn't an ordinary error (like ^C) leaves the partial copy
+    # where it is so it can be resumed
+    partial = destination + PARTIAL_SUFFIX
+    if os.path.isdir(source):
+        if os.path.lexists(partial) and resume is None:
+            shutil.rmtree(partial)
+        try:
+            _copy_tree(source, partial, stats, checkpoint, resume)
+            if verify:
+                stats.hashes = {
+                    os.path.join(destination, relative): digest
+                    for relative, digest in verify_copy(source, partial).items()
+                }
+            os.rename(partial, destination)
+        except Exception:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        _fsync_directory(os.path.dirname(destination))
+        shutil.rmtree(source)
+    else:
+        offset = 0 if resume is None else _resume_offset(destination, "", resume)
+        try:
+            stats.bytes_copied = copy_file(
+                source,
+                destination,
+                offset=offset,
+                progress=_debug_progress(source, offset),
+                checkpoint=checkpoint and (lambda position: checkpoint("", position)),
+            )
+            if verify:
+                stats.hashes = {destination: verify_copy(source, destination)[""]}
+        except Exception:
+            if os.path.lexists(partial):
+                os.remove(partial)
+            if verify and os.path.lexists(destination):
+                # we checked that nothing was here before we started
+                os.remove(destination)
+            raise
+        stats.files = 1
+        _fsync_directory(os.path.dirname(destination))
+        os.remove(source)
+
+    stats.seconds = time.monotonic() - started
+    settings.debug_message(f"Moved {source} to {destination}: {stats}")
+    return stats
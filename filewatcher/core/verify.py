@@ -0,0 +1,317 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: verify.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Makes sure a copy onto another disk really has the same bytes as the
+   original before the original gets deleted, and leaves a manifest of
+   what went into each movie folder. Source and copy are hashed side by
+   side in separate processes with a fast checksum (xxHash if it's
+   installed, CRC32 otherwise). With the manifest in place, checking up on
+   the library later is a matter of comparing sizes and mtimes; the bytes
+   only need reading again if you ask for a deep audit. Anything that went
+   into the library as a rename or a link was never copied, so it's never
+   read at import time either; it gets its checksum the first time a deep
+   audit comes across it.
+
+   python -m filewatcher.core.verify <movie directory> [--deep]
+*********************************************
+"""
+
+import argparse
+import errno
+import json
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Optional
+
+from filewatcher.core import settings
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+MANIFEST_FILENAME = ".filewatcher-manifest.json"
+BUFFER_SIZE = 8 * 1024 * 1024
+DEFAULT_ALGORITHM = "xxh3_64" if xxhash is not None else "crc32"
+
+# each worker process reads into the same buffer over and over instead of
+# allocating a new one for every 8MB of every file
+_buffer: Optional[bytearray] = None
+
+
+class VerificationError(OSError):
+    """The copy doesn't match the original."""
+
+    def __init__(self, source: str, mismatched: list[str]):
+        super().__init__(
+            errno.EIO,
+            f"Copy of {source} doesn't match: {', '.join(mismatched)}",
+            source,
+        )
+        self.mismatched = mismatched
+
+
+class _CRC32:
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data) -> None:
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self) -> str:
+        return f"{self.value:08x}"
+
+
+def _hasher(algorithm: str):
+    if algorithm == "crc32":
+        return _CRC32()
+    if algorithm == "xxh3_64" and xxhash is not None:
+        return xxhash.xxh3_64()
+    raise ValueError(f"Unable to hash with {algorithm}!")
+
+
+def hash_file(path: str, algorithm: str = DEFAULT_ALGORITHM) -> str:
+    """Checksum of everything in path, read straight from the disk."""
+    global _buffer
+    if _buffer is None:
+        _buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(_buffer)
+    hasher = _hasher(algorithm)
+
+    with open(path, "rb", buffering=0) as hashed_file:
+        if hasattr(os, "posix_fadvise"):
+            # whatever we just wrote is probably still sitting in the page
+            # cache; we want what actually made it onto the disk
+            fd = hashed_file.fileno()
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            read = hashed_file.readinto(view)
+            if not read:
+                break
+            hasher.update(view[:read])
+    return hasher.hexdigest()
+
+
+def _hash_job(job: tuple[str, str]) -> str:
+    return hash_file(*job)
+
+
+def hash_files(
+    paths: Iterable[str], algorithm: str = DEFAULT_ALGORITHM
+) -> dict[str, str]:
+    """hash_file() for every path, spread across a pool of processes."""
+    paths = list(dict.fromkeys(paths))
+    if len(paths) <= 1:
+        return {path: hash_file(path, algorithm) for path in paths}
+    workers = min(len(paths), os.cpu_count() or 1, 8)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        digests = pool.map(_hash_job, [(path, algorithm) for path in paths])
+        return dict(zip(paths, digests))
+
+
+def _relative_files(path: str) -> list[str]:
+    found = []
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            found.append(os.path.relpath(os.path.join(dirpath, filename), path))
+    return found
+
+
+def verify_copy(source: str, copy: str) -> dict[str, str]:
+    """
+    Compare every file under copy to the one it came from under source (or
+    the two files, if they're files), hashing both sides at once. Raises
+    VerificationError if anything differs; otherwise returns the copy's
+    {relative path: checksum}, with "" standing in for a lone file.
+    """
+    if os.path.isdir(source):
+        relative_paths = _relative_files(source)
+        pairs = [
+            (os.path.join(source, relative), os.path.join(copy, relative))
+            for relative in relative_paths
+        ]
+    else:
+        # joining "" onto a file's path would leave a trailing slash on it
+        relative_paths = [""]
+        pairs = [(source, copy)]
+
+    mismatched = []
+    for relative, (original, copied) in zip(relative_paths, pairs):
+        try:
+            if os.path.getsize(original) != os.path.getsize(copied):
+                mismatched.append(relative or os.path.basename(source))
+        except OSError:
+            mismatched.append(relative or os.path.basename(source))
+    if mismatched:
+        raise VerificationError(source, mismatched)
+
+    digests = hash_files([path for pair in pairs for path in pair])
+    for relative, (original, copied) in zip(relative_paths, pairs):
+        if digests[original] != digests[copied]:
+            mismatched.append(relative or os.path.basename(source))
+    if mismatched:
+        raise VerificationError(source, mismatched)
+
+    settings.debug_message(f"Verified {len(pairs)} file(s) copied from {source}")
+    return {
+        relative: digests[copied]
+        for relative, (_, copied) in zip(relative_paths, pairs)
+    }
+
+
+def load_manifest(folder: str) -> Optional[dict]:
+    try:
+        with open(
+            os.path.join(folder, MANIFEST_FILENAME), "r", encoding="utf-8"
+        ) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        settings.debug_message(f"Manifest in {folder} is unreadable!")
+        return None
+
+
+def _save_manifest(folder: str, manifest: dict) -> None:
+    manifest_path = os.path.join(folder, MANIFEST_FILENAME)
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+
+def write_manifest(folder: str, known: Optional[dict[str, str]] = None) -> dict:
+    """
+    Record the size and mtime of every file in folder, and its checksum if
+    we've got one. `known` maps full paths to checksums we already have
+    (from verify_copy()); files that are already in the manifest unchanged
+    keep the checksum they had. Nothing gets read here; anything else is
+    left for audit_manifest() to hash when it's asked to go deep.
+    """
+    known = known or {}
+    previous = load_manifest(folder) or {}
+    if previous.get("algorithm") != DEFAULT_ALGORITHM:
+        previous = {}
+    previous_files = previous.get("files", {})
+
+    files = {}
+    for relative in _relative_files(folder):
+        if relative.startswith(MANIFEST_FILENAME):
+            continue
+        path = os.path.join(folder, relative)
+        stat = os.stat(path)
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        old = previous_files.get(relative, {})
+        if path in known:
+            entry["hash"] = known[path]
+        elif (
+            "hash" in old
+            and old.get("size") == entry["size"]
+            and old.get("mtime_ns") == entry["mtime_ns"]
+        ):
+            entry["hash"] = old["hash"]
+        files[relative] = entry
+
+    manifest = {"algorithm": DEFAULT_ALGORITHM, "files": files}
+    _save_manifest(folder, manifest)
+    return manifest
+
+
+def record_import(folder: str, known: Optional[dict[str, str]] = None) -> None:
+    """write_manifest() for something we just put in the library, if enabled."""
+    if not settings.verify_imports:
+        return
+    try:
+        write_manifest(folder, known)
+    except OSError as e:
+        settings.debug_message(f"Unable to write a manifest for {folder}: {e}")
+
+
+def audit_manifest(folder: str, deep: bool = False) -> list[str]:
+    """
+    What's changed in folder since its manifest was written. Without `deep`
+    that's a stat of every file; with it, every file gets hashed again too,
+    and anything the manifest doesn't have a checksum for yet gets one.
+    """
+    manifest = load_manifest(folder)
+    if manifest is None:
+        return ["no manifest"]
+
+    problems = []
+    files = manifest.get("files", {})
+    to_hash = {}
+    for relative, entry in files.items():
+        path = os.path.join(folder, relative)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            problems.append(f"{relative} is missing")
+            continue
+        if stat.st_size != entry["size"]:
+            problems.append(f"{relative} changed size")
+        elif stat.st_mtime_ns != entry["mtime_ns"]:
+            problems.append(f"{relative} was modified")
+        elif deep:
+            to_hash[path] = relative
+
+    for relative in _relative_files(folder):
+        if not relative.startswith(MANIFEST_FILENAME) and relative not in files:
+            problems.append(f"{relative} isn't in the manifest")
+
+    if to_hash:
+        digests = hash_files(to_hash, manifest["algorithm"])
+        filled_in = False
+        for path, relative in to_hash.items():
+            if "hash" not in files[relative]:
+                # linked or renamed in; this is the first time it's been read
+                files[relative]["hash"] = digests[path]
+                filled_in = True
+            elif digests[path] != files[relative]["hash"]:
+                problems.append(f"{relative} doesn't match its checksum")
+        if filled_in:
+            try:
+                _save_manifest(folder, manifest)
+            except OSError as e:
+                settings.debug_message(
+                    f"Unable to update the manifest for {folder}: {e}"
+                )
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Check the movie library against its import manifests."
+    )
+    parser.add_argument("movie_dir", help="the movie directory")
+    parser.add_argument(
+        "--deep", action="store_true", help="read every file again, too"
+    )
+    args = parser.parse_args()
+
+    checked = unlisted = damaged = 0
+    for entry in sorted(os.scandir(args.movie_dir), key=lambda e: e.name):
+        if not entry.is_dir():
+            continue
+        if not os.path.exists(os.path.join(entry.path, MANIFEST_FILENAME)):
+            unlisted += 1
+            continue
+        checked += 1
+        problems = audit_manifest(entry.path, args.deep)
+        if problems:
+            damaged += 1
+            print(f"{entry.name}: {'; '.join(problems)}")
+    print(
+        f"Checked {checked} folder(s): {damaged} with problems,"
+        f" {unlisted} without a manifest."
+    )
+
+
+if __name__ == "__main__":
+    main()
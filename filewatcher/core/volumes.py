@@ -0,0 +1,295 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: volumes.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Lets one FileWatcher look after several incoming directories and
+   several movie libraries at once (incoming_directory and movie_directory
+   can each be a comma separated list). Every incoming root is watched by
+   its own thread with its own watcher, scan state, scheduler and workers,
+   so a slow copy out of one never holds up the others; copies are still
+   limited per destination disk across all of them.
+
+   Every import goes to one library, picked in this order:
+
+   1. whichever library already has that movie, so it's caught as a
+      duplicate the same way it would be with just the one library
+   2. a library on the same disk as the download, so it's a rename
+      instead of a copy
+   3. the library with the most free space
+
+   Each root and library after the first keeps its state in a folder of
+   its own under state_dir; the first ones keep it right where it's always
+   been.
+*********************************************
+"""
+
+import functools
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+from typing import Any, Callable, ContextManager, NoReturn, Optional
+
+from filewatcher.core import settings
+from filewatcher.core.fs import get_filesystem
+from filewatcher.movies.library import find_in_library
+
+# what each incoming root and each library has its own copy of
+ROOT_SETTINGS = (
+    "watcher",
+    "scan_state",
+    "settle_detector",
+    "work_scheduler",
+    "import_registry",
+)
+LIBRARY_SETTINGS = ("library_index", "fingerprint_store")
+
+# how long (in seconds) to believe what the disk said about its free space
+SPACE_TTL = 60
+
+
+def _state_dir(kind: str, path: str) -> str:
+    # the folder name is for people; the hash keeps /a/movies and
+    # /b/movies apart
+    name = re.sub(r"[^\w.-]+", "_", os.path.basename(os.path.normpath(path)))
+    digest = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:8]
+    return os.path.join(settings.state_dir, kind, f"{name}-{digest}")
+
+
+class Volume:
+    """An incoming root or a library, and the settings that go with it."""
+
+    def __init__(self, path: str, scope: Any):
+        self.path = path
+        # the first one's is settings as they are (see settings.unscoped())
+        self.scope = scope
+
+    def active(self) -> ContextManager[None]:
+        """Point settings at this one for the length of a with block."""
+        return settings.scoped(self.scope)
+
+    def device(self) -> Optional[int]:
+        try:
+            return get_filesystem().stat(self.path).st_dev
+        except OSError:
+            return None
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.path!r})"
+
+
+class IncomingRoot(Volume):
+    def __init__(self, path: str, first: bool = False):
+        if first:
+            scope = settings.unscoped(
+                ROOT_SETTINGS + ("incoming_dir", "incoming_state_dir")
+            )
+        else:
+            scope = dict.fromkeys(ROOT_SETTINGS)
+            scope["incoming_dir"] = path
+            scope["incoming_state_dir"] = _state_dir("roots", path)
+        super().__init__(path, scope)
+
+
+class Library(Volume):
+    def __init__(self, path: str, first: bool = False):
+        if first:
+            scope = settings.unscoped(
+                LIBRARY_SETTINGS + ("movie_dir", "library_state_dir")
+            )
+        else:
+            scope = dict.fromkeys(LIBRARY_SETTINGS)
+            scope["movie_dir"] = path
+            scope["library_state_dir"] = _state_dir("libraries", path)
+        super().__init__(path, scope)
+
+
+def get_roots() -> list[IncomingRoot]:
+    if settings.roots is None:
+        settings.roots = [
+            IncomingRoot(path, first=n == 0)
+            for n, path in enumerate(settings.incoming_dirs)
+        ]
+    return settings.roots
+
+
+def get_libraries() -> list[Library]:
+    if settings.libraries is None:
+        settings.libraries = [
+            Library(path, first=n == 0) for n, path in enumerate(settings.movie_dirs)
+        ]
+    return settings.libraries
+
+
+class FreeSpace:
+    """
+    How much room each library has left. Asking the disk is cheap but not
+    free, so the answer is kept for SPACE_TTL seconds, and whatever we send
+    a library's way in the meantime comes off it; two big copies in a row
+    don't both land on a disk that only has room for one of them.
+    """
+
+    def __init__(
+        self, ttl: float = SPACE_TTL, clock: Callable[[], float] = time.monotonic
+    ):
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        # path -> (clock() when we asked, bytes free)
+        self._free: dict[str, tuple[float, int]] = {}
+
+    def free(self, path: str) -> int:
+        now = self.clock()
+        with self._lock:
+            checked = self._free.get(path)
+            if checked is not None and now - checked[0] < self.ttl:
+                return checked[1]
+        try:
+            free = get_filesystem().free_space(path)
+        except OSError:
+            # nothing's going anywhere we can't even look at
+            free = 0
+        with self._lock:
+            self._free[path] = (now, free)
+        return free
+
+    def reserve(self, path: str, size: int) -> None:
+        with self._lock:
+            if path in self._free:
+                checked, free = self._free[path]
+                self._free[path] = (checked, free - size)
+
+
+def get_free_space() -> FreeSpace:
+    if settings.free_space is None:
+        settings.free_space = FreeSpace()
+    return settings.free_space
+
+
+def _size(path: str) -> int:
+    fs = get_filesystem()
+    if not fs.isdir(path):
+        return fs.getsize(path)
+    return sum(
+        fs.getsize(os.path.join(folder, f))
+        for folder, _, files in fs.walk(path)
+        for f in files
+    )
+
+
+def _already_has(name: str) -> Optional[Library]:
+    # movies.movies imports this module, so it can't be imported up top
+    from filewatcher.movies.movies import folder_translator
+
+    translated = folder_translator(name)
+    if translated is None:
+        return None
+    title = "{} ({})".format(*translated)
+    for library in get_libraries():
+        with library.active():
+            if find_in_library(title) is not None:
+                return library
+    return None
+
+
+def choose_library(name: str) -> Library:
+    """The library that name, in the current incoming root, should go to."""
+    libraries = get_libraries()
+    if len(libraries) == 1:
+        return libraries[0]
+
+    existing = _already_has(name)
+    if existing is not None:
+        return existing
+
+    source = os.path.join(settings.incoming_dir, name)
+    try:
+        device = get_filesystem().stat(source).st_dev
+        size = _size(source)
+    except OSError:
+        # let the import itself run into whatever the problem is
+        return libraries[0]
+
+    for library in libraries:
+        if library.device() == device:
+            settings.debug_message(f"Placement - {name} stays on its disk: {library}")
+            return library
+
+    space = get_free_space()
+    free = {library.path: space.free(library.path) for library in libraries}
+    # if anything has room for it, this one does
+    library = max(libraries, key=lambda library: free[library.path])
+    if free[library.path] < size:
+        settings.debug_message(f"Placement - no library has room for {name}!")
+    space.reserve(library.path, size)
+    settings.debug_message(
+        f"Placement - {name} ({size / 1e6:.0f} MB) goes to {library},"
+        f" {free[library.path] / 1e9:.1f} GB free"
+    )
+    return library
+
+
+def placed(function: Callable[..., Any]) -> Callable[..., Any]:
+    """function(name, ...), with settings pointed at the library for name."""
+
+    @functools.wraps(function)
+    def in_library(name: str, *args, **kwargs):
+        with choose_library(name).active():
+            return function(name, *args, **kwargs)
+
+    return in_library
+
+
+def find_anywhere(
+    function: Callable[..., Optional[Any]], *args
+) -> tuple[Optional[Library], Optional[Any]]:
+    """
+    function(*args) for each library in turn. The first library it finds
+    something in and what it found, or (None, None).
+    """
+    for library in get_libraries():
+        with library.active():
+            found = function(*args)
+        if found is not None:
+            return library, found
+    return None, None
+
+
+def library_devices() -> set[int]:
+    return {library.device() for library in get_libraries()} - {None}
+
+
+def watch_roots(main_loop: Callable[[], None]) -> NoReturn:
+    """
+    Run main_loop over and over for every incoming root at once, each in a
+    thread of its own. The first one to go wrong takes the rest down with
+    it, the same as it would if there were only the one.
+    """
+    failures: queue.Queue = queue.Queue()
+
+    def watch(root: IncomingRoot) -> None:
+        try:
+            with root.active():
+                while True:
+                    main_loop()
+        except BaseException as e:
+            failures.put(e)
+
+    for n, root in enumerate(get_roots()):
+        threading.Thread(
+            target=watch, args=(root,), name=f"filewatcher-root-{n}", daemon=True
+        ).start()
+
+    while True:
+        try:
+            failure = failures.get(timeout=1)
+        except queue.Empty:
+            # waking up every so often lets Ctrl+C through
+            continue
+        raise failure
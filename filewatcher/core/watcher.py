@@ -0,0 +1,347 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: watcher.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Decides when main_loop should run again. On Linux we ask inotify to tell
+   us when something lands in the incoming directory; everywhere else (or
+   if inotify isn't available, like on a lot of network mounts) we poll.
+   The adaptive poller only stats the incoming directory itself, which is
+   one round trip on an NFS or SMB mount: it checks every couple of
+   seconds right after something shows up and less and less often while
+   nothing does, and only asks for a full rescan when the directory has
+   changed (or it's been full_scan_interval seconds since the last one).
+   watch_mode = poll keeps the old "sleep for delay_time and rescan
+   everything" approach.
+*********************************************
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from typing import Callable, Optional
+
+from filewatcher.core import settings
+from filewatcher.core.console import console
+from filewatcher.core.fs import get_filesystem
+from filewatcher.core.notify import get_notifier
+from filewatcher.core.notify import sleep as notified_sleep
+
+# constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+
+# struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+_event_header = struct.Struct("iIII")
+
+# how long the incoming directory has to be quiet before we hand a batch of
+# events over to main_loop. Keeps a torrent that closes fifty files in a row
+# from turning into fifty cycles.
+SETTLE_WINDOW = 0.25
+# ...but don't let a chatty directory starve the loop forever.
+MAX_BATCH_TIME = 2.0
+
+
+class PollingWatcher:
+    """The classic behavior: sleep, then ask for a full rescan."""
+
+    name = "poll"
+
+    def __init__(self):
+        # None means "look at everything"; a set narrows the next cycle down
+        # to those root level names.
+        self.changed: Optional[set[str]] = None
+
+    def wait(self, timeout: float) -> Optional[set[str]]:
+        console.print(f"Sleeping for {timeout} seconds!\r")
+        woken = notified_sleep(timeout)
+        console.print("Working...                  \r")
+        # a download client told us exactly what to look at
+        self.changed = set() if woken else None
+        return self.changed
+
+    def close(self) -> None:
+        pass
+
+
+class AdaptivePollingWatcher:
+    """
+    Polls the incoming directory's mtime, which changes whenever something
+    is added, removed, or renamed at the top level. The gap between polls
+    starts at min_interval, doubles every time nothing has happened, and
+    tops out at max_interval.
+    """
+
+    name = "adaptive poll"
+
+    def __init__(
+        self,
+        root: str,
+        min_interval: float = 2,
+        max_interval: float = 180,
+        full_scan_interval: float = 900,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], bool] = notified_sleep,
+    ):
+        self.root = root
+        self.clock = clock
+        self.sleep = sleep
+        self.min_interval = max(min_interval, 0.1)
+        self.max_interval = max(max_interval, self.min_interval)
+        self.full_scan_interval = full_scan_interval
+        self.interval = self.min_interval
+        # the first cycle always looks at everything
+        self.changed: Optional[set[str]] = None
+        self._mtime = self._root_mtime()
+        self._last_full_scan = self.clock()
+
+    def _root_mtime(self) -> Optional[int]:
+        try:
+            return get_filesystem().stat(self.root).st_mtime_ns
+        except OSError:
+            return None
+
+    def wait(self, timeout: float) -> Optional[set[str]]:
+        console.print(f"Sleeping for up to {timeout} seconds!\r")
+        deadline = self.clock() + timeout
+        activity = False
+        while True:
+            if self.sleep(max(min(self.interval, deadline - self.clock()), 0)):
+                # a download client told us exactly what to look at
+                self.interval = self.min_interval
+                self.changed = set()
+                return self.changed
+            mtime = self._root_mtime()
+            # an unreadable directory counts as a change; the rescan will
+            # find out what's wrong
+            if mtime is None or mtime != self._mtime:
+                self._mtime = mtime
+                activity = True
+                break
+            self.interval = min(self.interval * 2, self.max_interval)
+            if self.clock() >= deadline:
+                break
+
+        now = self.clock()
+        if activity or now - self._last_full_scan >= self.full_scan_interval:
+            console.print("Working...                  \r")
+            if activity:
+                # more is probably on the way
+                self.interval = self.min_interval
+            self._last_full_scan = now
+            self.changed = None
+        else:
+            settings.debug_message(
+                f"Incoming directory unchanged; next check in {self.interval:.0f}s"
+            )
+            self.changed = set()
+        return self.changed
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """
+    Watches the incoming directory (and everything under it) through the
+    inotify syscalls in libc. wait() blocks until something finishes
+    landing, then returns the root level names that need another look.
+    """
+
+    name = "inotify"
+
+    def __init__(self, root: str):
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._libc.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        self.root = root
+        self.changed: Optional[set[str]] = None
+        # watch descriptor -> path relative to root ("" is root itself)
+        self._watches: dict[int, str] = {}
+        self._add_tree("")
+
+    def _add_watch(self, relative_path: str) -> None:
+        path = os.path.join(self.root, relative_path)
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            # probably vanished between the event and now; nothing to watch
+            settings.debug_message(f"inotify - unable to watch {path}")
+            return
+        self._watches[wd] = relative_path
+
+    def _add_tree(self, relative_path: str) -> None:
+        self._add_watch(relative_path)
+        for dirpath, dirnames, _ in os.walk(os.path.join(self.root, relative_path)):
+            for dirname in dirnames:
+                self._add_watch(
+                    os.path.relpath(os.path.join(dirpath, dirname), self.root)
+                )
+
+    def _drop_tree(self, relative_path: str) -> None:
+        prefix = relative_path + os.sep
+        for wd, watched in list(self._watches.items()):
+            if watched == relative_path or watched.startswith(prefix):
+                self._libc.inotify_rm_watch(self.fd, wd)
+                del self._watches[wd]
+
+    def _read_events(self) -> list[tuple[int, int, str]]:
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = _event_header.unpack_from(data, offset)
+            offset += _event_header.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def _collect_batch(self) -> list[tuple[int, int, str]]:
+        batch = self._read_events()
+        started = time.monotonic()
+        while time.monotonic() - started < MAX_BATCH_TIME:
+            if not select.select([self.fd], [], [], SETTLE_WINDOW)[0]:
+                break
+            batch.extend(self._read_events())
+        return batch
+
+    def _top_level_name(self, wd: int, name: str) -> Optional[str]:
+        relative_path = self._watches.get(wd)
+        if relative_path is None:
+            return None
+        if relative_path == "":
+            return name
+        return relative_path.split(os.sep)[0]
+
+    def wait(self, timeout: float) -> Optional[set[str]]:
+        settings.debug_message("Waiting for filesystem events...")
+        notifier = get_notifier()
+        watching = [self.fd] if notifier is None else [self.fd, notifier.wake_fd()]
+        ready = select.select(watching, [], [], timeout)[0]
+        if notifier is not None and notifier.wake_fd() in ready:
+            # wait_for_work picks up whatever the download client told us
+            notifier.drain()
+        if self.fd not in ready:
+            # nothing happened (that inotify saw), so there's nothing to do
+            self.changed = set()
+            return self.changed
+
+        arrivals: set[str] = set()
+        # rename bookkeeping per (wd, name): moved_to is +1, moved_from is -1.
+        # the rename settle check moves a file away and right back again,
+        # and that shouldn't look like something new showed up.
+        moves: dict[tuple[int, str], int] = {}
+        moved_to_owner: dict[tuple[int, str], str] = {}
+        overflowed = False
+
+        for wd, mask, name in self._collect_batch():
+            if mask & IN_Q_OVERFLOW:
+                overflowed = True
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+
+            top_level = self._top_level_name(wd, name)
+            if top_level is None:
+                continue
+            relative_path = os.path.join(self._watches[wd], name)
+
+            if mask & IN_ISDIR:
+                if mask & IN_MOVED_FROM:
+                    self._drop_tree(relative_path)
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_tree(relative_path)
+
+            if mask & IN_MOVED_TO:
+                moves[(wd, name)] = moves.get((wd, name), 0) + 1
+                moved_to_owner[(wd, name)] = top_level
+            elif mask & IN_MOVED_FROM:
+                moves[(wd, name)] = moves.get((wd, name), 0) - 1
+            elif mask & IN_CLOSE_WRITE:
+                arrivals.add(top_level)
+            elif mask & IN_CREATE and mask & IN_ISDIR:
+                # a new file isn't interesting until it's closed, but a new
+                # folder is worth a look (it might be a fully formed move)
+                arrivals.add(top_level)
+
+        for key, net in moves.items():
+            if net > 0:
+                arrivals.add(moved_to_owner[key])
+
+        if overflowed:
+            settings.debug_message("inotify - event queue overflowed, rescanning!")
+            self.changed = None
+        else:
+            settings.debug_message(f"inotify - changes under: {arrivals}")
+            self.changed = arrivals
+        return self.changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def create_adaptive_watcher() -> AdaptivePollingWatcher:
+    return AdaptivePollingWatcher(
+        settings.incoming_dir,
+        float(settings.poll_interval_min),
+        float(settings.delay_time),
+        float(settings.full_scan_interval),
+    )
+
+
+def create_watcher() -> PollingWatcher | AdaptivePollingWatcher | InotifyWatcher:
+    mode = settings.watch_mode
+    if mode == "poll":
+        return PollingWatcher()
+    if mode == "adaptive" or not get_filesystem().on_disk:
+        # inotify can't see what isn't on a disk
+        return create_adaptive_watcher()
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(settings.incoming_dir)
+        except (OSError, AttributeError) as e:
+            # AttributeError: libc without inotify_init1 (looking at you, musl
+            # builds from the stone age)
+            if mode == "inotify":
+                console.print(f"[red]Unable to start inotify watcher: {e}")
+            settings.debug_message("inotify unavailable, falling back to polling.")
+    elif mode == "inotify":
+        console.print("[red]inotify is only available on Linux!")
+    return create_adaptive_watcher()
+
+
+def get_watcher() -> PollingWatcher | AdaptivePollingWatcher | InotifyWatcher:
+    if settings.watcher is None:
+        settings.watcher = create_watcher()
+    return settings.watcher
@@ -0,0 +1,152 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: workers.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Lets process_folders chew on several downloads at once. A move onto the
+   same filesystem is just a rename and finishes instantly; a move onto a
+   different disk is a full copy and can take the better part of an hour.
+   Anything that's going to be a copy is handed to a CopyQueue with
+   threads of its own, and copies are limited per destination device so
+   they don't thrash the drive. The workers never wait on a copy, so
+   renames and everything else keep going while one runs.
+*********************************************
+"""
+
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, Optional
+
+from filewatcher.core import settings
+from filewatcher.core.fs import get_filesystem
+from filewatcher.core.volumes import library_devices
+
+
+class DeviceSlots:
+    """Per-destination-device limit on how many copies can run at once."""
+
+    def __init__(self, copies_per_device: int = 1):
+        self.copies_per_device = copies_per_device
+        self._lock = threading.Lock()
+        self._slots: dict[int, threading.BoundedSemaphore] = {}
+
+    def _slot_for(self, device: int) -> threading.BoundedSemaphore:
+        with self._lock:
+            if device not in self._slots:
+                self._slots[device] = threading.BoundedSemaphore(self.copies_per_device)
+            return self._slots[device]
+
+    @staticmethod
+    def is_same_device(source: str, destination_dir: str) -> bool:
+        fs = get_filesystem()
+        try:
+            return fs.stat(source).st_dev == fs.stat(destination_dir).st_dev
+        except OSError:
+            # let the move itself run into whatever the problem is
+            return True
+
+    @contextmanager
+    def transfer(self, source: str, destination_dir: str) -> Iterator[bool]:
+        """
+        Wrap a move with this. Same-device moves go straight through;
+        cross-device moves wait for a free slot on the destination device.
+        Yields whether or not the move is a same-device rename.
+        """
+        if self.is_same_device(source, destination_dir):
+            yield True
+            return
+
+        slot = self._slot_for(get_filesystem().stat(destination_dir).st_dev)
+        settings.debug_message(f"Waiting for a copy slot for {source}...")
+        with slot:
+            yield False
+
+
+def get_device_slots() -> DeviceSlots:
+    if settings.device_slots is None:
+        settings.device_slots = DeviceSlots(int(settings.copies_per_device))
+    return settings.device_slots
+
+
+def will_copy(source: str) -> bool:
+    """Is importing source (a path) going to be a copy onto another disk?"""
+    try:
+        device = get_filesystem().stat(source).st_dev
+    except OSError:
+        # let the import itself run into whatever the problem is
+        return False
+    return device not in library_devices()
+
+
+class CopyQueue:
+    """
+    Imports that are going to be copies, run on threads of their own so
+    they can wait for their device slot without tying up a worker.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max(max_workers, 1)
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._futures: list = []
+
+    def submit(self, function: Callable, *args) -> None:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="filewatcher-copy"
+                )
+            # the copy gets to see the same incoming root and library we do
+            self._futures.append(
+                self._pool.submit(contextvars.copy_context().run, function, *args)
+            )
+
+    def join(self) -> None:
+        """
+        Wait for every copy to finish, then raise the first exception (if
+        any), the same as run_in_pool.
+        """
+        with self._lock:
+            pool, futures = self._pool, self._futures
+            self._pool, self._futures = None, []
+        if pool is None:
+            return
+        pool.shutdown(wait=True)
+        for future in futures:
+            future.result()
+
+
+def get_copy_queue() -> CopyQueue:
+    """A fresh CopyQueue with enough threads to keep every library busy."""
+    devices = max(len(library_devices()), 1)
+    return CopyQueue(int(settings.copies_per_device) * devices)
+
+
+def run_in_pool(function: Callable, items: Iterable, max_workers: int) -> None:
+    """
+    Run function(item) for every item, max_workers at a time. Waits for
+    everything to finish, then raises the first exception (if any) so a
+    failure doesn't go quieter than it would have in the serial loop.
+    """
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        for item in items:
+            function(item)
+        return
+
+    with ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="filewatcher"
+    ) as pool:
+        # each worker gets to see the same incoming root and library we do
+        futures = [
+            pool.submit(contextvars.copy_context().run, function, item)
+            for item in items
+        ]
+
+    for future in futures:
+        future.result()
@@ -3,17 +3,42 @@
 
 # http://www.omdbapi.com/?t=aladdin&y=&plot=full&r=json
 
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
+
 import requests
 from addict import Dict
 
+from filewatcher.core import settings
+from filewatcher.movies.cache import OMDbCache, cache_key, get_omdb_cache
+from filewatcher.movies.client import DEFAULT_TIMEOUT, TokenBucket, create_session
+
 
 class OMDbAPI:
     """
     Class that handles basic retrieval of information from the Open Movie
     Database API via Requests.
+
+    Every instance talks through one pooled keep-alive session, never has
+    more than max_concurrency requests out at once, and waits its turn on
+    rate_limiter (if there is one) before each request.
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        cache: Optional[OMDbCache] = None,
+        session: Optional[requests.Session] = None,
+        rate_limiter: Optional[TokenBucket] = None,
+        max_concurrency: int = 4,
+        timeout: float | tuple[float, float] = DEFAULT_TIMEOUT,
+    ):
+        self.cache = cache
+        self.session = session or create_session(max_concurrency)
+        self.rate_limiter = rate_limiter
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_concurrency)
         # shorthand identifiers for the OMDb
         self.url = "http://www.omdbapi.com/"
         self.title = "t"
@@ -21,6 +46,27 @@ class OMDbAPI:
         self.plot = "plot"
         self.request_type = "r"
 
+    def _fetch(self, payload: dict) -> dict:
+        with self._slots:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            r = self.session.get(self.url, params=payload, timeout=self.timeout)
+        if r.status_code < 500:
+            # a missing or bad API key comes back as a 401 with the reason in
+            # the body, same as a "Movie not found!"; either way it's a miss
+            try:
+                body = r.json()
+            except ValueError:
+                body = None
+            if isinstance(body, dict) and body.get("Response") == "False":
+                if not r.ok:
+                    settings.debug_message(
+                        f"OMDb - {r.status_code} {body.get('Error', '')}"
+                    )
+                return body
+        r.raise_for_status()
+        return r.json()
+
     def get_movie(
         self, movie_title: str, movie_year: int = None, full_plot: bool = False
     ) -> dict[str, str | int]:
@@ -32,7 +78,13 @@ class OMDbAPI:
             self.request_type: "json",
         }
 
-        r = requests.get(self.url, params=payload).json()
+        key = cache_key(movie_title, movie_year, full_plot)
+        r = self.cache.get(key) if self.cache is not None else None
+        if r is None:
+            r = self._fetch(payload)
+            if self.cache is not None:
+                self.cache.put(key, r)
+
         response_dict = Dict()
         response_dict.update(r)
 
@@ -40,6 +92,35 @@ class OMDbAPI:
 
         return response_dict
 
+    def get_movies(
+        self, movie_titles: Iterable[str], full_plot: bool = False
+    ) -> dict[str, Optional[dict[str, str | int]]]:
+        """
+        Look up a batch of titles at once, max_concurrency at a time.
+        Titles that only differ in case or punctuation are only asked about
+        once. A title whose lookup failed maps to None.
+        """
+        batch: dict[str, str] = {}
+        for movie_title in movie_titles:
+            batch.setdefault(cache_key(movie_title, None, full_plot), movie_title)
+
+        def lookup(movie_title: str) -> Optional[dict[str, str | int]]:
+            try:
+                return self.get_movie(movie_title, full_plot=full_plot)
+            except (requests.RequestException, ValueError) as e:
+                settings.debug_message(f"OMDb - lookup of {movie_title} failed: {e}")
+                return None
+
+        with ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="omdb"
+        ) as pool:
+            results = dict(zip(batch.values(), pool.map(lookup, batch.values())))
+
+        return {
+            movie_title: results[batch[cache_key(movie_title, None, full_plot)]]
+            for movie_title in movie_titles
+        }
+
     def _convert_keys(self, incoming_dict: dict) -> dict:
         correction_dict = {
             "Plot": "plot",
@@ -69,3 +150,16 @@ class OMDbAPI:
             fixed_dict[value] = incoming_dict[key]
 
         return fixed_dict
+
+
+def get_omdb() -> OMDbAPI:
+    if settings.omdb is None:
+        concurrency = int(settings.omdb_concurrency)
+        settings.omdb = OMDbAPI(
+            cache=get_omdb_cache(),
+            rate_limiter=TokenBucket(
+                float(settings.omdb_requests_per_second), burst=concurrency
+            ),
+            max_concurrency=concurrency,
+        )
+    return settings.omdb
@@ -0,0 +1,170 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: cache.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Remembers what the OMDb told us. Anything without a year in its name
+   gets looked up every cycle until it's dealt with, and a name the OMDb
+   has never heard of would otherwise cost a round trip every delay_time
+   seconds forever. Answers (including "no idea") are kept in a small
+   sqlite database in the state directory, with a handful of recent ones
+   in memory in front of it.
+*********************************************
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from filewatcher.core import settings
+
+CACHE_FILENAME = "omdb_cache.sqlite3"
+# how many answers to keep in memory
+MEMORY_SIZE = 256
+
+_not_word = re.compile(r"[\W_]+")
+
+
+def normalize_title(title: str) -> str:
+    """'The.Matrix ' and 'the matrix' are the same lookup, and so is 'Amélie'."""
+    decomposed = unicodedata.normalize("NFKD", title.casefold())
+    title = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _not_word.sub(" ", title).strip()
+
+
+def cache_key(title: str, year: Optional[int] = None, full_plot: bool = False) -> str:
+    return "|".join(
+        (normalize_title(title), str(year or ""), "full" if full_plot else "short")
+    )
+
+
+class OMDbCache:
+    """
+    Raw OMDb responses keyed by cache_key(). A response with "Response":
+    "True" is a hit and is kept for hit_ttl seconds; anything else is a miss
+    and is kept for miss_ttl, since the OMDb does occasionally learn about
+    new things.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        hit_ttl: float,
+        miss_ttl: float,
+        memory_size: int = MEMORY_SIZE,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.hit_ttl = hit_ttl
+        self.miss_ttl = miss_ttl
+        self.memory_size = memory_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (response, fetched_at), most recently used last
+        self._memory: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # folders get processed on worker threads; the lock keeps them from
+        # stepping on each other
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS lookups ("
+                " key TEXT PRIMARY KEY,"
+                " response TEXT NOT NULL,"
+                " found INTEGER NOT NULL,"
+                " fetched_at REAL NOT NULL)"
+            )
+
+    @staticmethod
+    def _found(response: dict) -> bool:
+        return response.get("Response") == "True"
+
+    def _fresh(self, found: bool, fetched_at: float) -> bool:
+        ttl = self.hit_ttl if found else self.miss_ttl
+        return self._clock() - fetched_at < ttl
+
+    def _remember(self, key: str, response: dict, fetched_at: float) -> None:
+        self._memory[key] = (response, fetched_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[dict]:
+        """The cached response for key, or None if we need to ask again."""
+        with self._lock:
+            if key in self._memory:
+                response, fetched_at = self._memory[key]
+                if self._fresh(self._found(response), fetched_at):
+                    self._memory.move_to_end(key)
+                    return response
+                del self._memory[key]
+
+            row = self._db.execute(
+                "SELECT response, found, fetched_at FROM lookups WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            response, found, fetched_at = row
+            if not self._fresh(bool(found), fetched_at):
+                return None
+            response = json.loads(response)
+            self._remember(key, response, fetched_at)
+            return response
+
+    def put(self, key: str, response: dict) -> None:
+        fetched_at = self._clock()
+        with self._lock:
+            self._remember(key, response, fetched_at)
+            with self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO lookups VALUES (?, ?, ?, ?)",
+                    (
+                        key,
+                        json.dumps(response),
+                        int(self._found(response)),
+                        fetched_at,
+                    ),
+                )
+
+    def purge(self) -> int:
+        """Throw out everything that's expired. Returns how many went."""
+        now = self._clock()
+        with self._lock, self._db:
+            removed = self._db.execute(
+                "DELETE FROM lookups WHERE"
+                " (found = 1 AND fetched_at <= ?) OR (found = 0 AND fetched_at <= ?)",
+                (now - self.hit_ttl, now - self.miss_ttl),
+            ).rowcount
+            self._memory = OrderedDict(
+                (key, value)
+                for key, value in self._memory.items()
+                if self._fresh(self._found(value[0]), value[1])
+            )
+        return removed
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def get_omdb_cache() -> OMDbCache:
+    if settings.omdb_cache is None:
+        settings.omdb_cache = OMDbCache(
+            os.path.join(settings.state_dir, CACHE_FILENAME),
+            hit_ttl=float(settings.omdb_hit_ttl_days) * 24 * 60 * 60,
+            miss_ttl=float(settings.omdb_miss_ttl_hours) * 60 * 60,
+        )
+        settings.omdb_cache.purge()
+    return settings.omdb_cache
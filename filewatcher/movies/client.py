@@ -0,0 +1,83 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: client.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   The plumbing under OMDbAPI: one keep-alive session shared by every
+   lookup (so a pile of year-less files doesn't mean a pile of TLS
+   handshakes), retries for the OMDb's occasional bad moments, and a
+   token bucket so a burst of lookups doesn't get us rate limited.
+*********************************************
+"""
+
+import threading
+import time
+from typing import Callable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# seconds to wait for the OMDb to connect / answer
+DEFAULT_TIMEOUT = (5, 10)
+
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average, with up to `burst`
+    of them back to back. acquire() blocks until a token is available.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Optional[Callable[[float], None]] = None,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            # no limit
+            return
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            (self._sleep or time.sleep)(wait)
+
+
+def create_session(pool_size: int, retries: int = 3) -> requests.Session:
+    """A keep-alive session with room for pool_size simultaneous requests."""
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1, pool_maxsize=max(pool_size, 1), max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
@@ -0,0 +1,328 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: library.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Keeps track of what's already in the movie directory, keyed by
+   normalized title and year, so "is this a duplicate?" is a dictionary
+   lookup that knows `Aladdin (1992)` and `Aladdin.1992` are the same
+   movie. The index is saved in the state directory; on startup only the
+   folders whose inode or mtime have changed get looked at again, and
+   anything FileWatcher moves in itself is added as it goes.
+*********************************************
+"""
+
+import json
+import os
+import re
+import threading
+from typing import Optional
+
+from filewatcher.core import settings
+from filewatcher.core.console import say
+from filewatcher.core.fingerprint import get_fingerprint_store
+from filewatcher.core.fs import get_filesystem
+from filewatcher.core.media import get_media_classifier
+from filewatcher.movies.cache import normalize_title
+from filewatcher.movies.trigrams import TrigramIndex
+
+LIBRARY_FILENAME = "library.json"
+
+_year = re.compile(r"[\(\[]?\b((?:19|20)\d{2})\b[\)\]]?")
+
+
+def split_title_year(name: str) -> tuple[str, str]:
+    """
+    'Blade Runner 2049 (2017)' -> ('Blade Runner 2049', '2017'). The year
+    is the last one in the name that has a title in front of it; names
+    without one come back with a year of "".
+    """
+    for match in reversed(list(_year.finditer(name))):
+        title = name[: match.start()].strip(" ._-")
+        if title:
+            return title, match.group(1)
+    return name, ""
+
+
+def library_key(title: str, year: str | int = "") -> str:
+    return f"{normalize_title(title)}|{year}"
+
+
+def _folder_size(path: str) -> int:
+    fs = get_filesystem()
+    total = 0
+    for dirpath, _, filenames in fs.walk(path):
+        for filename in filenames:
+            try:
+                total += fs.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class LibraryIndex:
+    """
+    One entry per folder in the movie directory:
+    {"title", "year", "size", "ino", "mtime_ns"}, keyed by folder name, plus
+    a map from library_key() to folder name for lookups.
+    """
+
+    def __init__(self, path: str, movie_dir: str):
+        self.path = path
+        self.movie_dir = movie_dir
+        self.dirty = False
+        self._lock = threading.RLock()
+        self._entries: dict[str, dict] = {}
+        # library_key() -> every folder with that key (somebody might have
+        # two copies already), the one find() hands out last
+        self._keys: dict[str, dict[str, None]] = {}
+        # built the first time somebody wants a fuzzy match
+        self._trigrams: Optional[TrigramIndex] = None
+        # the movie directory's own mtime as of our last look; if it hasn't
+        # moved, nothing has been added, removed, or renamed at the top level
+        self._seen_mtime_ns: Optional[int] = None
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as library_file:
+                loaded = json.load(library_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            settings.debug_message(f"Library index at {self.path} is unreadable!")
+            return
+
+        if loaded.get("movie_dir") != self.movie_dir:
+            # pointed at a different library since last time
+            return
+        self._seen_mtime_ns = loaded.get("mtime_ns")
+        for name, entry in loaded.get("entries", {}).items():
+            self._store(name, entry)
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with self._lock:
+            with open(temp_path, "w", encoding="utf-8") as library_file:
+                json.dump(
+                    {
+                        "movie_dir": self.movie_dir,
+                        "mtime_ns": self._seen_mtime_ns,
+                        "entries": self._entries,
+                    },
+                    library_file,
+                )
+                self.dirty = False
+            # every incoming root saves the libraries when it's done with a
+            # cycle, so two of them can end up in here at once
+            os.replace(temp_path, self.path)
+
+    def _store(self, name: str, entry: dict) -> None:
+        self._entries[name] = entry
+        self._keys.setdefault(library_key(entry["title"], entry["year"]), {})[
+            name
+        ] = None
+        if self._trigrams is not None:
+            self._trigrams.add(name, entry["title"], entry["year"])
+
+    def _drop(self, name: str) -> None:
+        entry = self._entries.pop(name, None)
+        if entry is None:
+            return
+        if self._trigrams is not None:
+            self._trigrams.remove(name)
+        key = library_key(entry["title"], entry["year"])
+        names = self._keys.get(key, {})
+        names.pop(name, None)
+        if not names:
+            self._keys.pop(key, None)
+
+    @staticmethod
+    def _describe(name: str, stat: os.stat_result, path: str) -> dict:
+        title, year = split_title_year(name)
+        return {
+            "title": title,
+            "year": year,
+            "size": (
+                _folder_size(path) if get_filesystem().isdir(path) else stat.st_size
+            ),
+            "ino": stat.st_ino,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+
+    def refresh(self) -> None:
+        """Bring the index up to date with the movie directory."""
+        fs = get_filesystem()
+        try:
+            library_mtime_ns = fs.stat(self.movie_dir).st_mtime_ns
+        except OSError:
+            settings.debug_message(f"Unable to read library at {self.movie_dir}!")
+            return
+        if library_mtime_ns == self._seen_mtime_ns:
+            return
+
+        settings.debug_message("Library changed; updating the library index.")
+        with self._lock:
+            present = set()
+            with fs.scandir(self.movie_dir) as entries:
+                for entry in entries:
+                    present.add(entry.name)
+                    try:
+                        stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    known = self._entries.get(entry.name)
+                    if (
+                        known is not None
+                        and known["ino"] == stat.st_ino
+                        and known["mtime_ns"] == stat.st_mtime_ns
+                    ):
+                        continue
+                    self._drop(entry.name)
+                    self._store(
+                        entry.name, self._describe(entry.name, stat, entry.path)
+                    )
+
+            for name in list(self._entries):
+                if name not in present:
+                    self._drop(name)
+
+            self._seen_mtime_ns = library_mtime_ns
+            self.dirty = True
+        self.save()
+
+    def add(self, name: str) -> None:
+        """
+        Record something we just put into the library ourselves. It's saved
+        at the end of the cycle; if we don't make it that far, the saved
+        mtime is stale and refresh() picks it up again.
+        """
+        path = os.path.join(self.movie_dir, name)
+        fs = get_filesystem()
+        try:
+            stat = fs.stat(path)
+            library_mtime_ns = fs.stat(self.movie_dir).st_mtime_ns
+        except OSError:
+            return
+        with self._lock:
+            self._drop(name)
+            self._store(name, self._describe(name, stat, path))
+            self._seen_mtime_ns = library_mtime_ns
+            self.dirty = True
+
+    def find(self, title: str, year: str | int = "") -> Optional[str]:
+        """The name of the library folder holding title (year), if any."""
+        names = self._keys.get(library_key(title, year))
+        return next(reversed(names)) if names else None
+
+    def find_name(self, name: str) -> Optional[str]:
+        """Like find(), for a name in the usual `Title (Year)` form."""
+        if name in self._entries:
+            return name
+        return self.find(*split_title_year(name))
+
+    def find_similar(
+        self,
+        name: str,
+        threshold: float = 0.85,
+        year_tolerance: int = 1,
+        limit: int = 5,
+    ) -> list[tuple[float, str]]:
+        """
+        Library folders whose title is at least `threshold` similar to the
+        title in name (and within year_tolerance years of it), best first,
+        as (similarity, folder name).
+        """
+        with self._lock:
+            if self._trigrams is None:
+                self._trigrams = TrigramIndex.build(
+                    (entry_name, entry["title"], entry["year"])
+                    for entry_name, entry in self._entries.items()
+                )
+            title, year = split_title_year(name)
+            return self._trigrams.search(title, year, threshold, year_tolerance, limit)
+
+    def mtimes(self) -> dict[str, int]:
+        """Every library entry's name and mtime."""
+        with self._lock:
+            return {name: entry["mtime_ns"] for name, entry in self._entries.items()}
+
+    def entry(self, name: str) -> Optional[dict]:
+        return self._entries.get(name)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def get_library_index() -> LibraryIndex:
+    if settings.library_index is None:
+        settings.library_index = LibraryIndex(
+            os.path.join(
+                settings.library_state_dir or settings.state_dir, LIBRARY_FILENAME
+            ),
+            settings.movie_dir,
+        )
+        settings.library_index.refresh()
+    return settings.library_index
+
+
+def find_in_library(name: str) -> Optional[str]:
+    """
+    The folder already in the library that `name` would be a duplicate of,
+    if there is one: the exact name (even if the index hasn't heard about it
+    yet), then the same normalized title and year. Fuzzy matches don't
+    count; see report_similar().
+    """
+    if get_filesystem().isdir(os.path.join(settings.movie_dir, name)):
+        return name
+    return get_library_index().find_name(name)
+
+
+def report_similar(name: str) -> Optional[str]:
+    """
+    Point out the library folder that `name` looks a lot like, if there is
+    one: release variants like `Blade Runner Final Cut 1982` next to
+    `Blade Runner (1983)`. It's only ever mentioned, never treated as a
+    duplicate; a close enough title is far too often the sequel.
+    """
+    similar = get_library_index().find_similar(
+        name,
+        float(settings.duplicate_similarity),
+        int(settings.duplicate_year_tolerance),
+    )
+    if not similar:
+        return None
+    score, existing = similar[0]
+    say(
+        f"{name} looks a lot like {existing} ({score:.2f}), which is already in"
+        " the library. Bringing it in anyway; check which one you want to keep!"
+    )
+    return existing
+
+
+def find_content_in_library(paths: list[str]) -> Optional[str]:
+    """
+    The library file with the same content as any of paths, going by
+    sampled fingerprints, if content_duplicates is on and there is one.
+    """
+    if not settings.content_duplicates:
+        return None
+
+    store = get_fingerprint_store()
+    store.index_library(
+        settings.movie_dir,
+        get_library_index().mtimes(),
+        get_media_classifier().is_video,
+    )
+    for path, fingerprint in store.fingerprints(paths).items():
+        existing = store.in_library(fingerprint)
+        if existing is not None:
+            settings.debug_message(f"{path} has the same content as {existing}")
+            return existing
+    return None
@@ -16,72 +16,101 @@
 
 from __future__ import print_function
 
-import re
 import os
-import shutil
 from typing import Optional, Callable
 
-from filewatcher.core import StatusTag, settings
-from filewatcher.movies import OMDbAPI
+import requests
+
+from filewatcher.core import DirectorySnapshot, StatusTag, journal, settings
+from filewatcher.core.console import say
+from filewatcher.core.fs import get_filesystem
+from filewatcher.core.linking import get_import_registry, link_tree
+from filewatcher.core.media import MediaClassifier, get_media_classifier
+from filewatcher.core.verify import VerificationError, record_import
+from filewatcher.core.volumes import find_anywhere, placed
+from filewatcher.core.workers import get_device_slots
+from filewatcher.movies import get_omdb
+from filewatcher.movies.library import (
+    find_content_in_library,
+    find_in_library,
+    get_library_index,
+    report_similar,
+)
+from filewatcher.movies.parser import parse_name, parse_names
+from filewatcher.movies.titles import get_title_index
 
 
-title_parser = re.compile(
+def tag_download(directory: str, tag: str) -> None:
     """
-    (?P<title>[\w,.\-!'\s]+)
-    \s(?:[\(\[]?
-    (?P<year>(?:(?:20)|(?:19))
-    \d{2})[\)\]]?)
-    """,
-    re.MULTILINE | re.VERBOSE,
-)
+    Mark directory (a name in the incoming directory) with one of the
+    StatusTags so it's left alone from now on. In link mode the download
+    has to keep its name to keep seeding, so the import registry remembers
+    it instead.
+    """
+    if settings.import_mode == "link":
+        get_import_registry().decide(directory, tag)
+        return
+    get_filesystem().rename(
+        os.path.join(settings.incoming_dir, directory),
+        os.path.join(settings.incoming_dir, f"{tag} {directory}"),
+    )
 
 
 def rename_skipped(directory: str) -> None:
-    os.rename(
-        os.path.join(settings.incoming_dir, directory),
-        os.path.join(settings.incoming_dir, (f"{StatusTag.SKIP} " + directory)),
-    )
+    tag_download(directory, StatusTag.SKIP)
 
 
-def folder_translator(
-    foldername: str, title_parser: re.Pattern = title_parser
-) -> Optional[tuple[str, str]]:
-    """Uses regex to yoink the name and year out of movie titles."""
-    settings.debug_message("Running folder/name translation on {}".format(foldername))
-    # check to see if we're operating on a file or a folder
-    if settings.get_extension(foldername) in settings.video_formats:
-        extension = settings.get_extension(foldername)
-        foldername = foldername[: -len(extension)].replace(".", " ")
-        foldername_less_extension = foldername.replace("_", " ")
-        foldername = foldername_less_extension + extension
-    else:
-        foldername = foldername.replace(".", " ")
-        foldername = foldername.replace("_", " ")
+def lookup_title(foldername: str) -> Optional[str]:
+    """What folder_translator will ask the OMDb about, if anything."""
+    parsed = parse_name(foldername)
+    if parsed.year is None and _resolve_offline(parsed.query) is None:
+        return parsed.query
+    return None
 
-    foldername = foldername.title()
 
-    title_data = title_parser.match(foldername)
+def _resolve_offline(title: str) -> Optional[tuple[str, str]]:
+    index = get_title_index()
+    if index is None:
+        return None
+    return index.resolve(title)
 
-    try:
-        # try and force an attribute error before it happens
-        x = title_data.group("title")  # noqa: F841
-        x = title_data.group("year")  # noqa: F841
-    except AttributeError:
-        settings.debug_message("folder_translator - AttributeError!")
-
-        # if it's a folder, foldername_less_extension will not have been
-        # created; we catch the unbound error and just use the normal folder
-        # name here for that reason
-        try:
-            title = foldername_less_extension
-        except UnboundLocalError:
-            title = foldername
+
+def prefetch_lookups(foldernames: list[str]) -> None:
+    """
+    Ask the OMDb about everything in foldernames that will need it, all in
+    one go; folder_translator then finds the answers waiting in the cache.
+    """
+    titles = [
+        parsed.query
+        for parsed in parse_names(foldernames).values()
+        if parsed.year is None and _resolve_offline(parsed.query) is None
+    ]
+    if len(titles) > 1:
+        settings.debug_message(f"OMDb - looking up {len(titles)} titles at once")
+        get_omdb().get_movies(titles)
+
+
+def folder_translator(foldername: str) -> Optional[tuple[str, str]]:
+    """Yoinks the name and year out of movie titles."""
+    settings.debug_message("Running folder/name translation on {}".format(foldername))
+    parsed = parse_name(foldername)
+    title = parsed.query
+
+    if parsed.year is None:
+        settings.debug_message("folder_translator - no year in the name!")
+
+        offline = _resolve_offline(title)
+        if offline is not None:
+            settings.debug_message(
+                "Title index - found it! It's {} ({})!".format(*offline)
+            )
+            return offline
 
         settings.debug_message("Attempting lookup through OMDb!")
         settings.debug_message("OMDb - Searching for year of {}".format(title))
 
         try:
-            omdb = OMDbAPI()
+            omdb = get_omdb()
             unknown_movie = omdb.get_movie("{}".format(title))
             if unknown_movie.response != "True":
                 settings.debug_message(
@@ -98,18 +127,42 @@ def folder_translator(
         except (AttributeError, IndexError):
             # it can't find a title or year! Oh no! Give up for now.
             return None
+        except requests.RequestException as e:
+            # the OMDb is down or won't talk to us; same deal
+            say(f"Couldn't ask the OMDb about {title}! ({e})")
+            return None
 
-    return (title_data.group("title"), title_data.group("year"))
+    return (parsed.title, parsed.year)
 
 
 def rename_duplicate(directory: str) -> None:
+    tag_download(directory, StatusTag.DUPLICATE)
 
-    os.rename(
-        os.path.join(settings.incoming_dir, directory),
-        os.path.join(settings.incoming_dir, (f"{StatusTag.DUPLICATE} " + directory)),
-    )
 
+def link_root_level_movie(movie: str, renamed_movie: str) -> None:
+    source = os.path.join(settings.incoming_dir, movie)
+    library_folder = os.path.join(settings.movie_dir, renamed_movie)
+
+    fs = get_filesystem()
+    created_folder = False
+    if not fs.isdir(library_folder):
+        fs.mkdir(library_folder)
+        created_folder = True
 
+    try:
+        with get_device_slots().transfer(source, settings.movie_dir):
+            link_tree(source, os.path.join(library_folder, movie))
+    except OSError:
+        if created_folder:
+            fs.rmdir(library_folder)
+        raise
+
+    get_import_registry().record(movie, os.path.join(library_folder, movie))
+    record_import(library_folder)
+    settings.debug_message(f"Linked root level file {movie} into {library_folder}!")
+
+
+@placed
 def process_root_level_movie(movie: str) -> None:
 
     translated_folder = folder_translator(movie)
@@ -121,7 +174,11 @@ def process_root_level_movie(movie: str) -> None:
 
     settings.debug_message("Moving root level file {} into new folder!".format(movie))
 
-    if not os.path.isdir(os.path.join(settings.movie_dir, renamed_movie)):
+    # the library might already have it under a slightly different name
+    library_folder = find_in_library(renamed_movie)
+
+    if library_folder is None:
+        report_similar(renamed_movie)
 
         try:
 
@@ -129,24 +186,40 @@ def process_root_level_movie(movie: str) -> None:
                 if banned_ch in renamed_movie:
                     renamed_movie = renamed_movie.replace(banned_ch, "")
 
-            settings.debug_message(
-                "Creating folder for root level file {}".format(movie)
-            )
-            os.mkdir(os.path.join(settings.incoming_dir, renamed_movie))
-            shutil.move(
-                os.path.join(settings.incoming_dir, movie),
-                os.path.join(settings.incoming_dir, renamed_movie, movie),
-            )
+            if settings.import_mode == "link":
+                try:
+                    link_root_level_movie(movie, renamed_movie)
+                except OSError:
+                    say(f"Something went wrong with linking {movie}! Skipping!")
+                    return
+                get_library_index().add(renamed_movie)
+                return
 
-            settings.debug_message("Moving folder to movies folder!")
-            shutil.move(
-                os.path.join(settings.incoming_dir, renamed_movie),
-                os.path.join(settings.movie_dir, renamed_movie),
-            )
-            settings.debug_message("Move successful!")
-        except (OSError, shutil.Error):
+            with journal.transaction(f"import of {movie}", ["mkdir", "move", "move"]):
+                settings.debug_message(
+                    "Creating folder for root level file {}".format(movie)
+                )
+                journal.mkdir(os.path.join(settings.incoming_dir, renamed_movie))
+                journal.move(
+                    os.path.join(settings.incoming_dir, movie),
+                    os.path.join(settings.incoming_dir, renamed_movie, movie),
+                )
+
+                settings.debug_message("Moving folder to movies folder!")
+                source = os.path.join(settings.incoming_dir, renamed_movie)
+                destination = os.path.join(settings.movie_dir, renamed_movie)
+                with get_device_slots().transfer(source, settings.movie_dir):
+                    stats = journal.move(
+                        source, destination, verify=settings.verify_imports
+                    )
+            settings.debug_message(f"Move successful! ({stats})")
+            record_import(destination, stats.hashes)
+            get_library_index().add(renamed_movie)
+        except VerificationError as e:
+            say(f"{movie} didn't copy over intact! Leaving it be. ({e})")
+        except OSError:
 
-            print(
+            say(
                 "{} is already in the destination directory! Renaming!".format(
                     renamed_movie
                 )
@@ -154,37 +227,50 @@ def process_root_level_movie(movie: str) -> None:
             rename_duplicate(renamed_movie)
     else:
 
-        if not os.path.isfile(os.path.join(settings.movie_dir, renamed_movie, movie)):
+        fs = get_filesystem()
+        if not fs.isfile(os.path.join(settings.movie_dir, library_folder, movie)):
             try:
-                shutil.move(
-                    os.path.join(settings.incoming_dir, movie),
-                    os.path.join(settings.movie_dir, renamed_movie, movie),
-                )
-            except shutil.Error:
-                print("Something went wrong with moving {}! Skipping!".format(movie))
+                if settings.import_mode == "link":
+                    link_root_level_movie(movie, library_folder)
+                else:
+                    source = os.path.join(settings.incoming_dir, movie)
+                    with get_device_slots().transfer(source, settings.movie_dir):
+                        stats = journal.move(
+                            source,
+                            os.path.join(settings.movie_dir, library_folder, movie),
+                            verify=settings.verify_imports,
+                        )
+                    record_import(
+                        os.path.join(settings.movie_dir, library_folder), stats.hashes
+                    )
+            except OSError:
+                say("Something went wrong with moving {}! Skipping!".format(movie))
+                return
+            get_library_index().add(library_folder)
         else:
-            print(
+            say(
                 "{} is already in the destination directory! Renaming!".format(
                     renamed_movie
                 )
             )
-            if not os.path.isdir(os.path.join(settings.incoming_dir, renamed_movie)):
-                os.mkdir(os.path.join(settings.incoming_dir, renamed_movie))
-                shutil.move(
-                    os.path.join(settings.incoming_dir, movie),
-                    os.path.join(settings.incoming_dir, renamed_movie, movie),
-                )
+            if settings.import_mode == "link":
+                # it stays right where it is, under its own name
+                rename_duplicate(movie)
+            elif not fs.isdir(os.path.join(settings.incoming_dir, renamed_movie)):
+                with journal.transaction(f"import of {movie}", ["mkdir", "move"]):
+                    journal.mkdir(os.path.join(settings.incoming_dir, renamed_movie))
+                    journal.move(
+                        os.path.join(settings.incoming_dir, movie),
+                        os.path.join(settings.incoming_dir, renamed_movie, movie),
+                    )
                 rename_duplicate(renamed_movie)
 
 
 def is_video_folder(directory: str, dir_files: list[Optional[str]]) -> bool:
-    for directory_file in dir_files:
-        settings.debug_message(
-            "Testing file {} for video format!".format(directory_file)
-        )
-        if settings.get_extension(directory_file) in settings.video_formats:
-            settings.debug_message("Found video folder: {}".format(directory))
-            return True
+    settings.debug_message("Testing files in {} for video format!".format(directory))
+    if get_media_classifier().classify(dir_files).video:
+        settings.debug_message("Found video folder: {}".format(directory))
+        return True
 
     settings.debug_message(
        "Folder does not contain first level video files. Skipping."
@@ -192,19 +278,14 @@ def is_video_folder(directory: str, dir_files: list[Optional[str]]) -> bool:
     return False
 
 
-def is_tv_show(directory: str, directory_file: str) -> bool:
+def is_tv_show(directory: str, directory_file: str, folder: DirectorySnapshot) -> bool:
     # we don't have to check the extension here because is_movie() did that
     # for us
-    if (
-        int(
-            os.path.getsize(
-                os.path.join(settings.incoming_dir, directory, directory_file)
-            )
-        )
-        / 1000000
-    ) < int(settings.min_movie_size):
+    if (folder.manifest().size(directory_file) / 1000000) < int(
+        settings.min_movie_size
+    ):
         # check to see if it's a "sample" video. I hate those.
-        if is_sample(directory, directory_file):
+        if is_sample(directory, directory_file, folder):
 
             # this only works because I've never seen a TV directory with a
             # sample video file. If I ever find one, I'll rework this.
@@ -213,66 +294,97 @@ def is_tv_show(directory: str, directory_file: str) -> bool:
             return True
 
 
-def is_sample(directory: str, directory_file: str) -> bool:
-    if (
-        int(
-            os.path.getsize(
-                os.path.join(settings.incoming_dir, directory, directory_file)
-            )
-        )
-        / 1000000
-    ) < int(settings.min_episode_size):
+def is_sample(directory: str, directory_file: str, folder: DirectorySnapshot) -> bool:
+    if (folder.manifest().size(directory_file) / 1000000) < int(
+        settings.min_episode_size
+    ):
         return True
     else:
         return False
 
 
-def delete_samples(directory: str, dir_files: list[Optional[str]]) -> None:
-    # nuke any sample files and anything in the extensions to delete string
-    # like txt files, nfo files, and jpg files
-    for thing_to_delete in dir_files:
-        if settings.get_extension(thing_to_delete) in settings.video_formats:
-            if is_sample(directory, thing_to_delete):
-                settings.debug_message(
-                    "Found sample movie {}! ENGAGING LASERS".format(thing_to_delete)
-                )
-                os.remove(
-                    os.path.join(settings.incoming_dir, directory, thing_to_delete)
-                )
-        if settings.get_extension(thing_to_delete) in settings.exts_to_delete:
-            settings.debug_message("NUKING {}".format(thing_to_delete))
-            os.remove(os.path.join(settings.incoming_dir, directory, thing_to_delete))
+def files_to_delete(
+    directory: str, dir_files: list[Optional[str]], folder: DirectorySnapshot
+) -> list[str]:
+    # any sample files and anything in the extensions to delete string like
+    # txt files, nfo files, and jpg files
+    manifest = folder.manifest()
+    listed = set(dir_files)
+    unwanted = [
+        video.name
+        for video in manifest.videos
+        if video.name in listed and is_sample(directory, video.name, folder)
+    ]
+    return unwanted + [
+        f for f in manifest.of_kind(MediaClassifier.DELETE) if f in listed
+    ]
+
+
+def delete_samples(
+    directory: str, dir_files: list[Optional[str]], folder: DirectorySnapshot
+) -> None:
+    for thing_to_delete in files_to_delete(directory, dir_files, folder):
+        settings.debug_message("NUKING {}".format(thing_to_delete))
+        get_filesystem().remove(os.path.join(folder.path, thing_to_delete))
 
 
 def process_tv_show(directory: str) -> None:
     # for now, we're just renaming the folder, so we can come back and get it
     # manually. TV shows are hard, so we'll take a look at that later.
-    os.rename(
-        os.path.join(settings.incoming_dir, directory),
-        os.path.join(settings.incoming_dir, (f"{StatusTag.TV} " + directory)),
-    )
+    tag_download(directory, StatusTag.TV)
 
 
 def is_movie(directory_file: str) -> bool:
     # return true if file is a file type we're looking for
-    return settings.get_extension(directory_file) in settings.video_formats
+    return get_media_classifier().is_video(directory_file)
 
 
 def process_movie(
-    directory: str, dir_files: list[Optional[str]], rename_and_move: Callable
+    directory: str,
+    dir_files: list[Optional[str]],
+    rename_and_move: Callable,
+    folder: DirectorySnapshot,
 ) -> None:
+    manifest = folder.manifest()
+    if manifest.largest_video is not None:
+        settings.debug_message(
+            f"{directory}: {manifest.video_count} video(s),"
+            f" {manifest.video_bytes / 1000000:.0f} MB, largest is"
+            f" {manifest.largest_video.name}"
+        )
+    listed = set(dir_files)
+    videos = [video.name for video in manifest.videos if video.name in listed]
     marked_tv_dir = False
-    for directory_file in dir_files:
-        if is_movie(directory_file):
-            if is_tv_show(directory, directory_file):
-                marked_tv_dir = True
+    for directory_file in videos:
+        if is_tv_show(directory, directory_file, folder):
+            marked_tv_dir = True
 
     if marked_tv_dir:
         try:
             process_tv_show(directory)
         except OSError:
-            print(f"Encountered an issue with {directory}! Skipping!")
+            say(f"Encountered an issue with {directory}! Skipping!")
     else:
+        # same movie, different name? no need to look any further
+        library, existing = find_anywhere(
+            find_content_in_library,
+            [
+                os.path.join(folder.path, f)
+                for f in videos
+                if not is_sample(directory, f, folder)
+            ],
+        )
+        if existing is not None:
+            say(
+                f"{directory} is already in the library as"
+                f" {os.path.relpath(existing, library.path)}! Renaming!"
+            )
+            rename_duplicate(directory)
+            return
+
         # we know we've got a movie, so it's time to rename and move the folder
-        delete_samples(directory, dir_files)
+        if settings.import_mode != "link":
+            # in link mode the download has to stay intact to keep seeding;
+            # the junk just doesn't get linked into the library
+            delete_samples(directory, dir_files, folder)
         rename_and_move(directory)
@@ -0,0 +1,91 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: parser.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Pulls the title and year out of a release name. `Daddy.Long.Legs.1955.
+   720p.BluRay.x264` becomes `Daddy Long Legs` and `1955`. Answers are
+   kept in an LRU, since the same names turn up every cycle until they're
+   dealt with, and a whole batch of names can be parsed at once.
+
+   The names in filewatcher/bench/release_names.tsv are what it's expected
+   to get right; `python -m filewatcher.bench.parser` checks them and
+   times it.
+*********************************************
+"""
+
+import re
+from functools import lru_cache
+from typing import Iterable, NamedTuple, Optional
+
+from filewatcher.core.media import MediaClassifier, get_media_classifier
+
+PARSE_CACHE_SIZE = 4096
+
+# anchored at the start: title, whitespace, maybe an opening bracket, year
+_title_year = re.compile(r"([\w,.\-!'&\s]+)\s[\(\[]?((?:19|20)\d{2})")
+
+# what the cached answers were worked out with
+_classifier: Optional[MediaClassifier] = None
+
+
+class ParsedName(NamedTuple):
+    # both None if there's no year to be found
+    title: Optional[str]
+    year: Optional[str]
+    # the cleaned up name without its extension; what to ask the OMDb about
+    # if there's no year
+    query: str
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse(name: str) -> ParsedName:
+    extension = _classifier.video_extension(name)
+    if extension is not None:
+        name = name[: -len(extension)]
+    # two str.replace calls are a good deal quicker than one str.translate
+    name = name.replace(".", " ").replace("_", " ").title()
+    if "19" not in name and "20" not in name:
+        # no year in there to find, and this is much quicker than finding out
+        # the hard way
+        return ParsedName(None, None, name)
+
+    # greedy, so it's the last year that counts: titles can have numbers
+    # in them (`Blade Runner 2049 (2017)`). The title stops at the first
+    # character that can't be in one, and from there it's a single pass
+    # back looking for the year, however long the name is
+    match = _title_year.match(name)
+    if match is not None:
+        title = match.group(1).strip()
+        if title:
+            return ParsedName(title, match.group(2), name)
+    return ParsedName(None, None, name)
+
+
+def _check_classifier() -> None:
+    global _classifier
+    classifier = get_media_classifier()
+    if classifier is not _classifier:
+        # a change to video_formats gets us a new classifier, and might
+        # change what counts as an extension
+        _parse.cache_clear()
+        _classifier = classifier
+
+
+def parse_name(name: str) -> ParsedName:
+    """Title, year, and OMDb query for a folder or file name."""
+    _check_classifier()
+    return _parse(name)
+
+
+def parse_names(names: Iterable[str]) -> dict[str, ParsedName]:
+    """parse_name() for a whole batch; a name that's in there twice is a cache hit."""
+    _check_classifier()
+    return {name: _parse(name) for name in names}
+
+
+def clear_cache() -> None:
+    _parse.cache_clear()
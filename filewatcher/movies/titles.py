@@ -0,0 +1,304 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: titles.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   An offline stand-in for the OMDb. Point the importer at an IMDb-style
+   title.basics.tsv dump and it writes out a compact index of normalized
+   titles, years, and kinds (movie, tvSeries, ...), sorted so it can be
+   binary searched straight out of a memory map. Opening it costs next to
+   nothing no matter how many millions of titles are in it, and
+   folder_translator asks it before it bothers the OMDb.
+
+   python -m filewatcher.movies.titles title.basics.tsv.gz titles.idx
+*********************************************
+"""
+
+import argparse
+import difflib
+import gzip
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Iterator, NamedTuple, Optional
+
+from filewatcher.core import settings
+from filewatcher.movies.cache import normalize_title
+
+MAGIC = b"FWTITLE1"
+# magic, byte order, title count, kind count, normalized blob size, display
+# blob size
+_header = struct.Struct("<8s1sxxxIIQQ")
+KIND_WIDTH = 16
+
+# tvEpisode alone is most of the dump and we never want to match one
+DEFAULT_KINDS = ("movie", "tvMovie", "video", "short", "tvSeries", "tvMiniSeries")
+# the kinds a downloaded movie could actually be
+MOVIE_KINDS = ("movie", "tvMovie", "video")
+# how far either side of where a title would sort fuzzy() looks for matches
+FUZZY_WINDOW = 1000
+
+
+class Title(NamedTuple):
+    title: str
+    year: int
+    kind: str
+
+
+def _read_dump(
+    tsv_path: str, kinds: tuple[str, ...]
+) -> Iterator[tuple[str, str, int, str]]:
+    opener = gzip.open if tsv_path.endswith(".gz") else open
+    with opener(tsv_path, "rt", encoding="utf-8", newline="\n") as dump:
+        columns = dump.readline().rstrip("\n").split("\t")
+        kind_column = columns.index("titleType")
+        title_column = columns.index("primaryTitle")
+        year_column = columns.index("startYear")
+        for line in dump:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < len(columns) or fields[kind_column] not in kinds:
+                continue
+            year = fields[year_column]
+            if not year.isdigit():
+                # "\N"; a title without a year is no use to us
+                continue
+            title = fields[title_column]
+            normalized = normalize_title(title)
+            if normalized:
+                yield normalized, title, int(year), fields[kind_column]
+
+
+def build_index(
+    tsv_path: str, index_path: str, kinds: tuple[str, ...] = DEFAULT_KINDS
+) -> int:
+    """Turn a title.basics.tsv(.gz) dump into an index. Returns the count."""
+    records = sorted(set(_read_dump(tsv_path, kinds)))
+    kind_table = sorted({record[3] for record in records})
+    kind_numbers = {kind: number for number, kind in enumerate(kind_table)}
+
+    normalized_blob = bytearray()
+    display_blob = bytearray()
+    normalized_offsets = array("I", [0])
+    display_offsets = array("I", [0])
+    years = array("H")
+    record_kinds = array("B")
+    for normalized, title, year, kind in records:
+        normalized_blob += normalized.encode("utf-8")
+        display_blob += title.encode("utf-8")
+        normalized_offsets.append(len(normalized_blob))
+        display_offsets.append(len(display_blob))
+        years.append(year)
+        record_kinds.append(kind_numbers[kind])
+
+    temp_path = index_path + ".tmp"
+    with open(temp_path, "wb") as index_file:
+        index_file.write(
+            _header.pack(
+                MAGIC,
+                sys.byteorder[0].encode(),
+                len(records),
+                len(kind_table),
+                len(normalized_blob),
+                len(display_blob),
+            )
+        )
+        for kind in kind_table:
+            index_file.write(kind.encode("ascii").ljust(KIND_WIDTH, b"\0"))
+        normalized_offsets.tofile(index_file)
+        display_offsets.tofile(index_file)
+        years.tofile(index_file)
+        record_kinds.tofile(index_file)
+        index_file.write(b"\0" * (-len(records) * 3 % 4))
+        index_file.write(normalized_blob)
+        index_file.write(display_blob)
+    os.replace(temp_path, index_path)
+    return len(records)
+
+
+class TitleIndex:
+    """
+    A read-only view of an index written by build_index(). Nothing is read
+    into memory up front; lookups binary search the memory map directly.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as index_file:
+            self._map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = view = memoryview(self._map)
+
+        magic, byteorder, count, kind_count, normalized_size, display_size = (
+            _header.unpack_from(view)
+        )
+        if magic != MAGIC:
+            raise ValueError(f"{path} isn't a title index!")
+        if byteorder != sys.byteorder[0].encode():
+            raise ValueError(f"{path} was built on a machine with another byte order!")
+        self.count = count
+
+        position = _header.size
+        self._kinds = [
+            bytes(view[start : start + KIND_WIDTH]).rstrip(b"\0").decode("ascii")
+            for start in range(position, position + kind_count * KIND_WIDTH, KIND_WIDTH)
+        ]
+        position += kind_count * KIND_WIDTH
+
+        def section(fmt: str, length: int, item_size: int) -> memoryview:
+            nonlocal position
+            part = view[position : position + length * item_size]
+            position += length * item_size
+            return part.cast(fmt) if fmt != "B" else part
+
+        self._normalized_offsets = section("I", count + 1, 4)
+        self._display_offsets = section("I", count + 1, 4)
+        self._years = section("H", count, 2)
+        self._record_kinds = section("B", count, 1)
+        position += -count * 3 % 4
+        self._normalized = section("B", normalized_size, 1)
+        self._display = section("B", display_size, 1)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _key(self, n: int) -> bytes:
+        return bytes(
+            self._normalized[
+                self._normalized_offsets[n] : self._normalized_offsets[n + 1]
+            ]
+        )
+
+    def _title(self, n: int) -> Title:
+        display = bytes(
+            self._display[self._display_offsets[n] : self._display_offsets[n + 1]]
+        ).decode("utf-8")
+        return Title(display, self._years[n], self._kinds[self._record_kinds[n]])
+
+    def _lower_bound(self, key: bytes) -> int:
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _scan(self, key: bytes, prefix: bool) -> Iterator[tuple[str, Title]]:
+        n = self._lower_bound(key)
+        while n < self.count:
+            found = self._key(n)
+            if found != key and not (prefix and found.startswith(key)):
+                break
+            yield found.decode("utf-8"), self._title(n)
+            n += 1
+
+    def exact(self, title: str) -> list[Title]:
+        """Everything whose normalized title is exactly title's."""
+        return [
+            found for _, found in self._scan(normalize_title(title).encode(), False)
+        ]
+
+    def prefix(self, title: str, limit: int = 50) -> list[Title]:
+        """Everything whose normalized title starts with title's."""
+        results = []
+        for _, found in self._scan(normalize_title(title).encode(), True):
+            results.append(found)
+            if len(results) >= limit:
+                break
+        return results
+
+    def fuzzy(self, title: str, limit: int = 5, cutoff: float = 0.85) -> list[Title]:
+        """
+        Close matches for title, best first. Only the titles sorted within
+        FUZZY_WINDOW places of it that share its first word are considered,
+        which keeps this a binary search plus a short scan rather than a trip
+        through the whole index. Typos near the end of a title get caught;
+        typos in the first few letters generally don't.
+        """
+        normalized = normalize_title(title)
+        if not normalized:
+            return []
+        key = normalized.encode()
+        first_word = key.split(b" ")[0]
+        middle = self._lower_bound(key)
+
+        matcher = difflib.SequenceMatcher(b=normalized)
+        scored = []
+        for n in range(
+            max(middle - FUZZY_WINDOW, 0), min(middle + FUZZY_WINDOW, self.count)
+        ):
+            candidate = self._key(n)
+            if not candidate.startswith(first_word):
+                continue
+            matcher.set_seq1(candidate.decode("utf-8"))
+            if matcher.real_quick_ratio() < cutoff or matcher.quick_ratio() < cutoff:
+                continue
+            score = matcher.ratio()
+            if score >= cutoff:
+                scored.append((score, self._title(n)))
+        scored.sort(key=lambda pair: pair[0], reverse=True)
+        return [found for _, found in scored[:limit]]
+
+    def resolve(self, title: str) -> Optional[tuple[str, str]]:
+        """
+        The (title, year) folder_translator is after, but only if there's
+        exactly one movie it could be. Remakes and near misses with several
+        candidates are left for the OMDb to sort out.
+        """
+        for candidates in (self.exact(title), self.fuzzy(title)):
+            movies = {
+                (found.title, found.year)
+                for found in candidates
+                if found.kind in MOVIE_KINDS
+            }
+            if len(movies) == 1:
+                found_title, year = movies.pop()
+                return found_title, str(year)
+            if movies:
+                return None
+        return None
+
+    def close(self) -> None:
+        for part in (
+            self._normalized_offsets,
+            self._display_offsets,
+            self._years,
+            self._record_kinds,
+            self._normalized,
+            self._display,
+            self._view,
+        ):
+            part.release()
+        self._map.close()
+
+
+def get_title_index() -> Optional[TitleIndex]:
+    """The configured title index, or None if there isn't a usable one."""
+    if settings.title_index is None and settings.title_index_path:
+        try:
+            settings.title_index = TitleIndex(settings.title_index_path)
+        except (OSError, ValueError) as e:
+            settings.debug_message(f"Unable to open title index: {e}")
+            # don't try again every lookup
+            settings.title_index_path = ""
+    return settings.title_index
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Build an offline title index from an IMDb title.basics dump."
+    )
+    parser.add_argument("dump", help="title.basics.tsv or title.basics.tsv.gz")
+    parser.add_argument("index", help="where to write the index")
+    args = parser.parse_args()
+    count = build_index(args.dump, args.index)
+    print(f"Wrote {count} titles to {args.index}.")
+
+
+if __name__ == "__main__":
+    main()
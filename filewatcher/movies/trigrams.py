@@ -0,0 +1,268 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+"""
+*********************************************
+ File Name: trigrams.py
+ Author: Joe Kaufeld
+ Email: opensource@joekaufeld.com
+ Purpose:
+   Fuzzy title matching for duplicate detection. Release names come in
+   endless variations (`Blade Runner Final Cut 1982`,
+   `Blade.Runner.1982.REMASTERED`) and an exact name match misses all of
+   them. Titles are broken into trigrams with an inverted index from
+   trigram to title, so a lookup only ever looks at titles that share the
+   rarest few trigrams with the one we're asking about.
+
+   Sequels look almost exactly like the movie before them (`Kill Bill Vol
+   2` is 0.86 alike to `Kill Bill Vol 1`), so two titles whose numbers
+   differ (2 and 1, II and III, Part 2 and Part 1) never match, however
+   alike the rest of them is.
+*********************************************
+"""
+
+import math
+import re
+from collections import defaultdict
+from typing import Iterable, Optional
+
+from filewatcher.movies.cache import normalize_title
+
+# words that say which release it is, not which movie it is. Only words
+# that don't turn up in actual titles go in here; everything else needs the
+# rest of its phrase (there are movies called Final Destination and Special
+# Correspondents)
+EDITION_WORDS = frozenset(
+    (
+        "remastered",
+        "remaster",
+        "restored",
+        "extended",
+        "unrated",
+        "uncut",
+        "theatrical",
+        "imax",
+        "criterion",
+        "proper",
+        "repack",
+        "bluray",
+        "bdrip",
+        "brrip",
+        "webrip",
+        "hdtv",
+        "dvdrip",
+        "hdr",
+        "remux",
+        "x264",
+        "x265",
+        "h264",
+        "hevc",
+        "720p",
+        "1080p",
+        "2160p",
+        "4k",
+        "uhd",
+    )
+)
+EDITION_PHRASES = re.compile(
+    r"\b(?:final cut|directors? cut|director s cut|(?:extended|theatrical) "
+    r"(?:cut|edition)|(?:special|anniversary|collectors?|collector s|ultimate|"
+    r"limited) edition|web dl)\b"
+)
+
+
+# words that put a number after them: `Part I` is a sequel number, but the
+# I in `I, Robot` isn't
+INSTALLMENT_WORDS = frozenset(("part", "vol", "volume", "chapter", "episode"))
+NUMBER_WORDS = {
+    word: n
+    for n, word in enumerate(
+        (
+            "one",
+            "two",
+            "three",
+            "four",
+            "five",
+            "six",
+            "seven",
+            "eight",
+            "nine",
+            "ten",
+            "eleven",
+            "twelve",
+        ),
+        start=1,
+    )
+}
+ROMAN_VALUES = {"i": 1, "v": 5, "x": 10}
+_roman = re.compile(r"^x{0,3}(?:ix|iv|v?i{0,3})$")
+
+
+def _roman_value(numeral: str) -> int:
+    total = 0
+    for n, letter in enumerate(numeral):
+        value = ROMAN_VALUES[letter]
+        following = ROMAN_VALUES[numeral[n + 1]] if n + 1 < len(numeral) else 0
+        total += -value if value < following else value
+    return total
+
+
+def installments(title: str) -> frozenset[int]:
+    """
+    Every number in title, however it's written: `Back to the Future Part
+    III` -> {3}. Two titles with different numbers are different movies.
+    """
+    words = normalize_title(title).split()
+    numbers = set()
+    for n, word in enumerate(words):
+        if word.isdigit():
+            numbers.add(int(word))
+        elif word in NUMBER_WORDS:
+            numbers.add(NUMBER_WORDS[word])
+        elif word and _roman.match(word):
+            if word == "i" and (n == 0 or words[n - 1] not in INSTALLMENT_WORDS):
+                continue
+            numbers.add(_roman_value(word))
+    return frozenset(numbers)
+
+
+def clean_title(title: str) -> str:
+    """Normalized title with the release/edition noise taken out."""
+    normalized = normalize_title(title)
+    words = [
+        w
+        for w in EDITION_PHRASES.sub(" ", normalized).split()
+        if w not in EDITION_WORDS
+    ]
+    # a title that's nothing but "noise" (the movie `Final Cut`) is still a
+    # title
+    return " ".join(words) or normalized
+
+
+def trigrams(title: str) -> frozenset[str]:
+    """pg_trgm style: every word padded with two spaces in front, one behind."""
+    grams = set()
+    for word in clean_title(title).split(" "):
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+def similarity(first: frozenset[str], second: frozenset[str]) -> float:
+    """Dice coefficient of two trigram sets."""
+    if not first or not second:
+        return 0.0
+    return 2 * len(first & second) / (len(first) + len(second))
+
+
+class TrigramIndex:
+    """Maps keys (library folder names) to titles for fuzzy lookups."""
+
+    def __init__(self):
+        # trigram -> year -> keys. Splitting the postings up by year means a
+        # lookup with a year only ever touches the handful of titles from
+        # around then. None holds everything we don't know the year of.
+        self._postings: dict[str, dict[Optional[int], set[str]]] = defaultdict(
+            lambda: defaultdict(set)
+        )
+        self._grams: dict[str, frozenset[str]] = {}
+        self._years: dict[str, Optional[int]] = {}
+        self._installments: dict[str, frozenset[int]] = {}
+        self._known_years: dict[Optional[int], int] = defaultdict(int)
+
+    def __len__(self) -> int:
+        return len(self._grams)
+
+    def add(self, key: str, title: str, year: Optional[str | int] = None) -> None:
+        self.remove(key)
+        grams = trigrams(title)
+        year = int(year) if year else None
+        self._grams[key] = grams
+        self._years[key] = year
+        self._installments[key] = installments(clean_title(title))
+        self._known_years[year] += 1
+        for gram in grams:
+            self._postings[gram][year].add(key)
+
+    def remove(self, key: str) -> None:
+        grams = self._grams.pop(key, None)
+        if grams is None:
+            return
+        year = self._years.pop(key)
+        del self._installments[key]
+        self._known_years[year] -= 1
+        if not self._known_years[year]:
+            del self._known_years[year]
+        for gram in grams:
+            by_year = self._postings[gram]
+            by_year[year].discard(key)
+            if not by_year[year]:
+                del by_year[year]
+                if not by_year:
+                    del self._postings[gram]
+
+    def search(
+        self,
+        title: str,
+        year: Optional[str | int] = None,
+        threshold: float = 0.8,
+        year_tolerance: int = 1,
+        limit: int = 5,
+    ) -> list[tuple[float, str]]:
+        """
+        (similarity, key) for everything at least `threshold` similar to
+        title and within year_tolerance years of year, with the same
+        installments(), best first.
+        """
+        grams = trigrams(title)
+        if not grams:
+            return []
+        numbers = installments(clean_title(title))
+
+        if year:
+            year = int(year)
+            years = [None, *range(year - year_tolerance, year + year_tolerance + 1)]
+        else:
+            years = list(self._known_years)
+
+        def postings(gram: str) -> list[set[str]]:
+            by_year = self._postings.get(gram, {})
+            return [by_year[y] for y in years if y in by_year]
+
+        # anything that clears the threshold has to share at least
+        # min_overlap trigrams with us, so it has to show up in at least one
+        # of the (len - min_overlap + 1) rarest ones. Only those postings
+        # need reading; the common trigrams ("  t", " th", "the") never do.
+        min_overlap = max(1, math.ceil(threshold * len(grams) / (2 - threshold)))
+        sized = sorted((sum(map(len, postings(g))), g) for g in grams)
+        candidates: set[str] = set()
+        for _, gram in sized[: len(grams) - min_overlap + 1]:
+            candidates.update(*postings(gram))
+
+        # ...and can't be too much shorter or longer than us, either
+        size = len(grams)
+        smallest = threshold * size / (2 - threshold)
+        largest = (2 - threshold) * size / threshold
+
+        results = []
+        for key in candidates:
+            other = self._grams[key]
+            if not smallest <= len(other) <= largest:
+                continue
+            if self._installments[key] != numbers:
+                # a sequel, or the movie before it
+                continue
+            score = 2 * len(grams & other) / (size + len(other))
+            if score >= threshold:
+                results.append((score, key))
+        results.sort(key=lambda result: (-result[0], result[1]))
+        return results[:limit]
+
+    @classmethod
+    def build(
+        cls, entries: Iterable[tuple[str, str, Optional[str | int]]]
+    ) -> "TrigramIndex":
+        """From (key, title, year) triples."""
+        index = cls()
+        for key, title, year in entries:
+            index.add(key, title, year)
+        return index
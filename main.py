@@ -15,18 +15,28 @@
    review!
 *********************************************
 '''
+import functools
 import sys
 from typing import NoReturn
 
+from filewatcher.core import settings
 from filewatcher.core.initialize import initialize
-from filewatcher.core.filewatcher import main_loop
+from filewatcher.core import filewatcher, pipeline
 from filewatcher.core.console import console
+from filewatcher.core.volumes import get_roots, watch_roots
 
 console.rule("[white]FileWatcher")
 
 
 def main() -> NoReturn:
     initialize()
+    if settings.runtime == "async":
+        main_loop = pipeline.main_loop
+    else:
+        main_loop = filewatcher.main_loop
+    if len(get_roots()) > 1:
+        # every incoming directory gets a main loop of its own
+        main_loop = functools.partial(watch_roots, main_loop)
     while True:
         try:
             main_loop()
@@ -0,0 +1,80 @@
+import http.server
+import json
+import threading
+import urllib.parse
+
+import pytest
+
+from filewatcher.bench.pipeline import SINGLETONS
+from filewatcher.core import settings
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    """Empty incoming, movie, and state directories, and fresh helpers."""
+    for attr in SINGLETONS:
+        setattr(settings, attr, None)
+    for name in ("incoming", "movies", "state"):
+        (tmp_path / name).mkdir()
+    settings.incoming_dirs = [str(tmp_path / "incoming")]
+    settings.movie_dirs = [str(tmp_path / "movies")]
+    settings.state_dir = str(tmp_path / "state")
+    settings.debug = False
+    yield tmp_path
+    for attr in SINGLETONS:
+        setattr(settings, attr, None)
+
+
+class StubOMDb:
+    """Answers like the OMDb would, from `movies`; counts what it's asked."""
+
+    def __init__(self):
+        self.movies = {}
+        # status to answer with instead, body and all
+        self.status = None
+        self.body = None
+        self.requests = []
+
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+                title = query.get("t", [""])[0]
+                stub.requests.append(title)
+                if stub.status is not None:
+                    status, body = stub.status, stub.body
+                elif title in stub.movies:
+                    status, body = 200, {"Response": "True", **stub.movies[title]}
+                else:
+                    status, body = 200, {
+                        "Response": "False",
+                        "Error": "Movie not found!",
+                    }
+                data = json.dumps(body).encode() if body is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+        # a short poll interval keeps close() quick
+        threading.Thread(
+            target=self.server.serve_forever, args=(0.05,), daemon=True
+        ).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def omdb_server():
+    stub = StubOMDb()
+    yield stub
+    stub.close()
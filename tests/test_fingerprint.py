@@ -0,0 +1,104 @@
+import hashlib
+
+import pytest
+
+from filewatcher.core import fingerprint
+from filewatcher.core.fingerprint import (
+    SAMPLE_SIZE,
+    STRIDES,
+    FingerprintStore,
+    sample_fingerprint,
+    sample_offsets,
+)
+
+
+@pytest.mark.parametrize(
+    "size,offsets",
+    [
+        (0, []),
+        (1, [0]),
+        (SAMPLE_SIZE - 1, [0]),
+        (SAMPLE_SIZE, [0]),
+        (SAMPLE_SIZE + 1, [0, SAMPLE_SIZE]),
+        (SAMPLE_SIZE * (STRIDES + 2), [SAMPLE_SIZE * n for n in range(STRIDES + 2)]),
+        (
+            SAMPLE_SIZE * 100,
+            [0, SAMPLE_SIZE * 20, SAMPLE_SIZE * 40, SAMPLE_SIZE * 60]
+            + [SAMPLE_SIZE * 80, SAMPLE_SIZE * 99],
+        ),
+    ],
+)
+def test_sample_offsets(size, offsets):
+    assert sample_offsets(size) == offsets
+
+
+def test_small_files_are_hashed_whole(tmp_path):
+    empty = tmp_path / "empty.mkv"
+    empty.write_bytes(b"")
+    tiny = tmp_path / "tiny.mkv"
+    tiny.write_bytes(b"movie")
+
+    assert sample_fingerprint(str(empty)) == (
+        "0-" + hashlib.blake2b(digest_size=16).hexdigest()
+    )
+    assert sample_fingerprint(str(tiny)) == (
+        "5-" + hashlib.blake2b(b"movie", digest_size=16).hexdigest()
+    )
+
+
+def test_only_the_samples_count(tmp_path):
+    size = SAMPLE_SIZE * 100
+    original = tmp_path / "original.mkv"
+    original.write_bytes(bytes(size))
+    renamed = tmp_path / "renamed.mkv"
+    renamed.write_bytes(bytes(size))
+    assert sample_fingerprint(str(original)) == sample_fingerprint(str(renamed))
+
+    # nobody's sampling the second block...
+    with open(renamed, "r+b") as movie:
+        movie.seek(SAMPLE_SIZE)
+        movie.write(b"x")
+    assert sample_fingerprint(str(original)) == sample_fingerprint(str(renamed))
+    # ...but the last one is
+    with open(renamed, "r+b") as movie:
+        movie.seek(size - 1)
+        movie.write(b"x")
+    assert sample_fingerprint(str(original)) != sample_fingerprint(str(renamed))
+
+
+def test_store(tmp_path, monkeypatch):
+    library = tmp_path / "movies"
+    (library / "Movie (2001)").mkdir(parents=True)
+    (library / "Movie (2001)" / "Movie (2001).mkv").write_bytes(b"movie")
+    (library / "Movie (2001)" / "Movie (2001).nfo").write_text("about")
+    (library / "Other (2002).mkv").write_bytes(b"other")
+    download = tmp_path / "download.mkv"
+    download.write_bytes(b"movie")
+
+    store = FingerprintStore(str(tmp_path / "state" / "fingerprints.json"))
+    store.index_library(
+        str(library),
+        {"Movie (2001)": 1, "Other (2002).mkv": 1},
+        lambda name: name.endswith(".mkv"),
+    )
+    found = store.fingerprints([str(download), str(tmp_path / "gone.mkv")])
+    assert list(found) == [str(download)]
+    assert store.in_library(found[str(download)]) == str(
+        library / "Movie (2001)" / "Movie (2001).mkv"
+    )
+    store.save()
+
+    # picked up where it left off, without sampling anything again
+    def resampled(path):
+        raise AssertionError(f"{path} was already fingerprinted")
+
+    monkeypatch.setattr(fingerprint, "_fingerprint_or_none", resampled)
+    reloaded = FingerprintStore(store.path)
+    assert reloaded.fingerprints([str(download)]) == found
+    assert reloaded.in_library(found[str(download)]) is not None
+
+    # something that's left the library isn't in it any more
+    reloaded.index_library(
+        str(library), {"Other (2002).mkv": 1}, lambda name: name.endswith(".mkv")
+    )
+    assert reloaded.in_library(found[str(download)]) is None
@@ -0,0 +1,155 @@
+import errno
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from filewatcher.core.fs import LocalFileSystem, MemoryFileSystem
+
+
+@pytest.fixture(params=["local", "memory"])
+def fs(request, tmp_path):
+    """
+    Each backend, with `base` to work in and `other`, a folder on another
+    device. Every test here should come out the same either way.
+    """
+    if request.param == "local":
+        fs = LocalFileSystem()
+        other_root = "/dev/shm"
+        if not os.path.isdir(other_root) or (
+            os.stat(other_root).st_dev == os.stat(tmp_path).st_dev
+        ):
+            pytest.skip("no second filesystem to move across")
+        other = tempfile.mkdtemp(dir=other_root)
+        request.addfinalizer(lambda: shutil.rmtree(other, ignore_errors=True))
+    else:
+        fs = MemoryFileSystem()
+        fs.makedirs(str(tmp_path))
+        other = str(tmp_path / "other")
+        fs.mount(other)
+    fs.base = str(tmp_path / "base")
+    fs.other = other
+    fs.mkdir(fs.base)
+    return fs
+
+
+def raises(code, function, *args):
+    with pytest.raises(OSError) as raised:
+        function(*args)
+    assert raised.value.errno == code
+
+
+def test_rename_across_devices(fs):
+    source = os.path.join(fs.base, "movie.mkv")
+    fs.create_file(source, 5000)
+    raises(errno.EXDEV, fs.rename, source, os.path.join(fs.other, "movie.mkv"))
+    raises(errno.EXDEV, fs.link, source, os.path.join(fs.other, "movie.mkv"))
+    assert fs.stat(source).st_dev != fs.stat(fs.other).st_dev
+
+    # ...which move() copes with by copying
+    stats = fs.move(source, os.path.join(fs.other, "movie.mkv"))
+    assert not stats.renamed and stats.bytes_copied == 5000
+    assert not fs.exists(source)
+    assert fs.getsize(os.path.join(fs.other, "movie.mkv")) == 5000
+
+    folder = os.path.join(fs.base, "Movie (2001)")
+    fs.makedirs(os.path.join(folder, "extras"))
+    fs.create_file(os.path.join(folder, "extras", "trailer.mkv"), 100)
+    stats = fs.move(folder, os.path.join(fs.other, "Movie (2001)"))
+    assert not stats.renamed and stats.files == 1
+    assert fs.listdir(os.path.join(fs.other, "Movie (2001)")) == ["extras"]
+    assert not fs.exists(folder)
+
+
+def test_move_on_the_same_device_is_a_rename(fs):
+    source = os.path.join(fs.base, "movie.mkv")
+    fs.create_file(source, 5000)
+    inode = fs.stat(source).st_ino
+    stats = fs.move(source, os.path.join(fs.base, "renamed.mkv"))
+    assert stats.renamed
+    assert fs.stat(os.path.join(fs.base, "renamed.mkv")).st_ino == inode
+
+    fs.create_file(source, 10)
+    with pytest.raises(FileExistsError):
+        fs.move(source, os.path.join(fs.base, "renamed.mkv"))
+
+
+def test_folders_that_arent_empty(fs):
+    folder = os.path.join(fs.base, "folder")
+    fs.mkdir(folder)
+    fs.create_file(os.path.join(folder, "movie.mkv"), 10)
+    raises(errno.ENOTEMPTY, fs.rmdir, folder)
+    raises(errno.EEXIST, fs.mkdir, folder)
+    fs.makedirs(folder, exist_ok=True)
+
+    empty = os.path.join(fs.base, "empty")
+    fs.mkdir(empty)
+    raises(errno.ENOTEMPTY, fs.rename, empty, folder)
+    raises(errno.EISDIR, fs.rename, os.path.join(folder, "movie.mkv"), empty)
+    raises(errno.EISDIR, fs.remove, folder)
+    raises(errno.ENOTDIR, fs.rmdir, os.path.join(folder, "movie.mkv"))
+    raises(errno.ENOENT, fs.stat, os.path.join(fs.base, "nothing"))
+
+    # an empty folder can be renamed over, though
+    fs.rename(folder, empty)
+    assert fs.listdir(empty) == ["movie.mkv"]
+    fs.rmtree(empty)
+    assert fs.listdir(fs.base) == []
+
+
+def test_link_counts(fs):
+    original = os.path.join(fs.base, "movie.mkv")
+    linked = os.path.join(fs.base, "linked.mkv")
+    fs.create_file(original, 5000)
+    assert fs.stat(original).st_nlink == 1
+
+    fs.link(original, linked)
+    assert fs.stat(original).st_nlink == fs.stat(linked).st_nlink == 2
+    assert fs.stat(original).st_ino == fs.stat(linked).st_ino
+    raises(errno.EEXIST, fs.link, original, linked)
+
+    fs.remove(original)
+    assert fs.stat(linked).st_nlink == 1
+
+    folder = os.path.join(fs.base, "folder")
+    fs.mkdir(folder)
+    assert fs.stat(folder).st_nlink == 2
+    fs.mkdir(os.path.join(folder, "inner"))
+    assert fs.stat(folder).st_nlink == 3
+
+
+def test_text_files(fs):
+    path = os.path.join(fs.base, "journal.jsonl")
+    fs.append(path, "one\n")
+    fs.append(path, "two\n", sync=True)
+    assert fs.read_text(path) == "one\ntwo\n"
+    assert fs.getsize(path) == 8
+
+    fs.write_text(path, "")
+    assert fs.read_text(path) == ""
+    assert fs.getsize(path) == 0
+
+
+def test_listing(fs):
+    fs.makedirs(os.path.join(fs.base, "Movie (2001)", "extras"))
+    fs.create_file(os.path.join(fs.base, "Movie (2001)", "movie.mkv"), 5000, 1e9)
+    fs.create_file(os.path.join(fs.base, "stray.mkv"), 10)
+
+    with fs.scandir(fs.base) as entries:
+        kinds = {entry.name: entry.is_dir() for entry in entries}
+    assert kinds == {"Movie (2001)": True, "stray.mkv": False}
+
+    movie = fs.entry(os.path.join(fs.base, "Movie (2001)", "movie.mkv"))
+    assert movie.is_file() and movie.stat().st_size == 5000
+    assert movie.stat().st_mtime == 1e9
+
+    walked = {
+        os.path.relpath(dirpath, fs.base): (sorted(dirnames), sorted(filenames))
+        for dirpath, dirnames, filenames in fs.walk(fs.base)
+    }
+    assert walked == {
+        ".": (["Movie (2001)"], ["stray.mkv"]),
+        "Movie (2001)": (["extras"], ["movie.mkv"]),
+        os.path.join("Movie (2001)", "extras"): ([], []),
+    }
@@ -0,0 +1,170 @@
+import json
+import os
+
+import pytest
+
+from filewatcher.core import journal, settings, transfer
+from filewatcher.core.fs import MemoryFileSystem
+from filewatcher.core.transfer import PARTIAL_SUFFIX
+
+
+def write_journal(records):
+    path = os.path.join(settings.state_dir, journal.JOURNAL_FILENAME)
+    with open(path, "w", encoding="utf-8") as journal_file:
+        for record in records:
+            journal_file.write(json.dumps(record) + "\n")
+    return path
+
+
+def interrupted_move(source, destination, resume=None):
+    records = [
+        {"txn": 1, "event": "begin", "label": "import", "plan": ["move"]},
+        {
+            "txn": 1,
+            "event": "step",
+            "n": 0,
+            "op": "move",
+            "paths": [source, destination],
+        },
+    ]
+    if resume is not None:
+        records.append({"txn": 1, "event": "checkpoint", "n": 0, **resume})
+    return records
+
+
+@pytest.fixture
+def copies(monkeypatch):
+    """Where each copy_file() started from, by source."""
+    offsets = {}
+    copy_file = transfer.copy_file
+
+    def spy(source, destination, offset=0, **kwargs):
+        offsets[os.path.basename(source)] = offset
+        return copy_file(source, destination, offset=offset, **kwargs)
+
+    monkeypatch.setattr(transfer, "copy_file", spy)
+    return offsets
+
+
+def test_interrupted_copy_resumes_from_the_checkpoint(dirs, copies):
+    source = dirs / "incoming" / "movie.mkv"
+    source.write_bytes(b"movie" * 1000)
+    destination = dirs / "movies" / "movie.mkv"
+    # the copy had got 2000 bytes in when the power went out
+    (dirs / "movies" / ("movie.mkv" + PARTIAL_SUFFIX)).write_bytes(b"movie" * 400)
+    path = write_journal(
+        interrupted_move(str(source), str(destination), {"file": "", "offset": 2000})
+    )
+
+    journal.get_journal().recover()
+
+    assert copies == {"movie.mkv": 2000}
+    assert destination.read_bytes() == b"movie" * 1000
+    assert not source.exists()
+    assert open(path).read() == ""
+
+
+def test_interrupted_folder_copy_picks_up_the_file_it_was_on(dirs, copies):
+    source = dirs / "incoming" / "Movie (2001)"
+    source.mkdir()
+    (source / "a.mkv").write_bytes(b"aaaaa" * 1000)
+    (source / "b.mkv").write_bytes(b"bbbbb" * 1000)
+    destination = dirs / "movies" / "Movie (2001)"
+    partial = dirs / "movies" / ("Movie (2001)" + PARTIAL_SUFFIX)
+    partial.mkdir()
+    (partial / "a.mkv").write_bytes(b"aaaaa" * 1000)
+    (partial / ("b.mkv" + PARTIAL_SUFFIX)).write_bytes(b"bbbbb" * 200)
+    write_journal(
+        interrupted_move(
+            str(source), str(destination), {"file": "b.mkv", "offset": 1000}
+        )
+    )
+
+    journal.get_journal().recover()
+
+    # a.mkv was already there, and b.mkv carried on from its checkpoint
+    assert copies == {"b.mkv": 1000}
+    assert (destination / "a.mkv").read_bytes() == b"aaaaa" * 1000
+    assert (destination / "b.mkv").read_bytes() == b"bbbbb" * 1000
+    assert not source.exists() and not partial.exists()
+
+
+@pytest.fixture
+def memory_fs(dirs):
+    fs = MemoryFileSystem()
+    settings.filesystem = fs
+    for name in ("incoming", "movies", "state"):
+        fs.makedirs(str(dirs / name))
+    return fs
+
+
+def test_incomplete_plan_is_rolled_back(dirs, memory_fs):
+    original = str(dirs / "incoming" / "Movie.2001.1080p")
+    renamed = str(dirs / "incoming" / "Movie (2001)")
+    destination = str(dirs / "movies" / "Movie (2001)")
+    memory_fs.makedirs(renamed)
+    memory_fs.create_file(os.path.join(renamed, "movie.mkv"), 5000)
+    path = os.path.join(settings.state_dir, journal.JOURNAL_FILENAME)
+    for record in [
+        {"txn": 1, "event": "begin", "label": "import", "plan": ["rename", "move"]},
+        {
+            "txn": 1,
+            "event": "step",
+            "n": 0,
+            "op": "rename",
+            "paths": [original, renamed],
+        },
+        {"txn": 1, "event": "done", "n": 0},
+        # went down before the move got anywhere
+        {
+            "txn": 1,
+            "event": "step",
+            "n": 1,
+            "op": "move",
+            "paths": [renamed, destination],
+        },
+    ]:
+        memory_fs.append(path, json.dumps(record) + "\n")
+
+    journal.get_journal().recover()
+
+    assert memory_fs.listdir(str(dirs / "incoming")) == ["Movie.2001.1080p"]
+    assert memory_fs.isfile(os.path.join(original, "movie.mkv"))
+    assert memory_fs.listdir(str(dirs / "movies")) == []
+    assert memory_fs.read_text(path) == ""
+
+
+def test_finished_journal_is_truncated(dirs, memory_fs):
+    source = str(dirs / "incoming" / "Movie (2001)")
+    destination = str(dirs / "movies" / "Movie (2001)")
+    memory_fs.makedirs(destination)
+    path = os.path.join(settings.state_dir, journal.JOURNAL_FILENAME)
+    for record in interrupted_move(source, destination) + [
+        {"txn": 1, "event": "done", "n": 0},
+        {"txn": 1, "event": "end"},
+    ]:
+        memory_fs.append(path, json.dumps(record) + "\n")
+
+    journal.get_journal().recover()
+
+    assert memory_fs.read_text(path) == ""
+    assert memory_fs.isdir(destination)
+
+
+def test_renames_are_not_synced(dirs, monkeypatch):
+    synced = []
+    monkeypatch.setattr(os, "fsync", synced.append)
+    (dirs / "incoming" / "Movie.2001").mkdir()
+
+    with journal.transaction("import", ["rename", "move"]):
+        journal.rename(
+            str(dirs / "incoming" / "Movie.2001"),
+            str(dirs / "incoming" / "Movie (2001)"),
+        )
+        journal.move(
+            str(dirs / "incoming" / "Movie (2001)"),
+            str(dirs / "movies" / "Movie (2001)"),
+        )
+
+    assert synced == []
+    assert (dirs / "movies" / "Movie (2001)").is_dir()
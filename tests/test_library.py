@@ -0,0 +1,16 @@
+import os
+
+from filewatcher.movies.library import find_in_library, report_similar
+
+
+def test_fuzzy_matches_are_only_reported(dirs, capsys):
+    for name in ("Kill Bill Vol. 1 (2003)", "Blade Runner (1982)", "Aladdin.1992"):
+        os.mkdir(dirs / "movies" / name)
+
+    assert find_in_library("Aladdin (1992)") == "Aladdin.1992"
+    assert find_in_library("Blade Runner Final Cut (1982)") is None
+    assert report_similar("Blade Runner Final Cut (1982)") == "Blade Runner (1982)"
+    assert "looks a lot like Blade Runner (1982)" in capsys.readouterr().out
+
+    assert find_in_library("Kill Bill Vol. 2 (2004)") is None
+    assert report_similar("Kill Bill Vol. 2 (2004)") is None
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from filewatcher.core import StatusTag, filewatcher, settings
+from filewatcher.core.linking import IMPORTED, get_import_registry
+from filewatcher.movies import movies
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as written:
+        written.write(data)
+
+
+def tree(root):
+    """Everything under root: names, contents, inodes and mtimes."""
+    found = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            stat = os.stat(path)
+            data = None
+            if os.path.isfile(path):
+                with open(path, "rb") as contents:
+                    data = contents.read()
+            found[os.path.relpath(path, root)] = (
+                data,
+                stat.st_ino,
+                stat.st_mtime_ns,
+            )
+    return found
+
+
+@pytest.fixture
+def link_mode(dirs, monkeypatch):
+    monkeypatch.setattr(settings, "import_mode", "link")
+    monkeypatch.setattr(settings, "settle_time", "0")
+    monkeypatch.setattr(settings, "min_movie_size", "0")
+    monkeypatch.setattr(settings, "min_episode_size", "0")
+    return dirs
+
+
+def test_linked_download_is_left_intact(link_mode):
+    write(link_mode / "incoming" / "Aladdin.1992.1080p" / "aladdin.mkv", b"movie")
+    write(link_mode / "incoming" / "Aladdin.1992.1080p" / "aladdin.nfo", b"info")
+    before = tree(link_mode / "incoming")
+
+    filewatcher.process_folders(["Aladdin.1992.1080p"])
+
+    assert tree(link_mode / "incoming") == before
+    assert os.listdir(link_mode / "movies" / "Aladdin (1992)") == ["aladdin.mkv"]
+    assert get_import_registry().status("Aladdin.1992.1080p") == IMPORTED
+
+
+def test_duplicate_is_left_intact(link_mode):
+    os.mkdir(link_mode / "movies" / "Aladdin (1992)")
+    write(link_mode / "incoming" / "Aladdin.1992.1080p" / "aladdin.mkv", b"movie")
+    before = tree(link_mode / "incoming")
+
+    filewatcher.process_folders(["Aladdin.1992.1080p"])
+
+    assert tree(link_mode / "incoming") == before
+    assert os.listdir(link_mode / "movies" / "Aladdin (1992)") == []
+    assert get_import_registry().status("Aladdin.1992.1080p") == StatusTag.DUPLICATE
+    assert filewatcher.check_for_skips("Aladdin.1992.1080p")
+
+
+def test_unrecognizable_download_is_left_intact(link_mode, monkeypatch):
+    monkeypatch.setattr(filewatcher, "folder_translator", lambda name: None)
+    monkeypatch.setattr(movies, "folder_translator", lambda name: None)
+    write(link_mode / "incoming" / "Something Else" / "video.mkv", b"movie")
+    write(link_mode / "incoming" / "stray.mkv", b"movie")
+    before = tree(link_mode / "incoming")
+
+    filewatcher.process_folders(["Something Else"])
+    filewatcher.root_level_files(["stray.mkv"])
+
+    assert tree(link_mode / "incoming") == before
+    assert os.listdir(link_mode / "movies") == []
+    registry = get_import_registry()
+    assert registry.status("Something Else") == StatusTag.SKIP
+    assert registry.status("stray.mkv") == StatusTag.SKIP
+
+    # remembered across restarts, and never cleaned up like imports are
+    settings.import_registry = None
+    get_import_registry().expire(retention_days=1, now=2**40)
+    assert get_import_registry().status("Something Else") == StatusTag.SKIP
+    assert tree(link_mode / "incoming") == before
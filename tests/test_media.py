@@ -0,0 +1,95 @@
+from filewatcher.core import DirectorySnapshot
+from filewatcher.core.media import FolderManifest, MediaClassifier
+
+
+def make_classifier():
+    return MediaClassifier(
+        ".mkv, MP4,.avi",
+        [".mp3", "flac"],
+        ".nfo, .txt, .part.rar",
+        ["Thumbs.db"],
+    )
+
+
+def test_extensions():
+    classifier = make_classifier()
+    assert classifier.extension("Movie.2001.MKV") == ".MKV"
+    # the longest suffix it knows about, as written
+    assert classifier.extension("movie.sample.Part.RAR") == ".Part.RAR"
+    assert classifier.extension("movie.rar") == ".rar"
+    assert classifier.extension("Movie.en.srt") == ".srt"
+    assert classifier.extension(".hidden") is None
+    assert classifier.extension("README") is None
+
+    assert classifier.video_extension("Movie.mp4") == ".mp4"
+    assert classifier.video_extension("Movie (2001)") is None
+    assert classifier.video_extension("Movie.nfo") is None
+
+
+def test_kinds():
+    classifier = make_classifier()
+    assert classifier.kind("movie.Mkv") == MediaClassifier.VIDEO
+    assert classifier.kind("movie.AVI") == MediaClassifier.VIDEO
+    assert classifier.kind("song.FLAC") == MediaClassifier.AUDIO
+    assert classifier.kind("movie.NFO") == MediaClassifier.DELETE
+    assert classifier.kind("movie.part.rar") == MediaClassifier.DELETE
+    assert classifier.kind("THUMBS.DB") == MediaClassifier.IGNORE
+    assert classifier.kind("movie.rar") is None
+    assert classifier.is_video("movie.MKV")
+    assert not classifier.is_video("song.mp3")
+    assert classifier.is_audio("song.Mp3")
+
+    assert classifier.classify(
+        ["b.mkv", "notes.txt", "a.MP4", "song.mp3", "Thumbs.db", "cover.jpg"]
+    ) == (["b.mkv", "a.MP4"], ["song.mp3"], ["notes.txt"], ["Thumbs.db"], ["cover.jpg"])
+
+
+def test_video_wins():
+    # a suffix on more than one list is a video first and audio second
+    classifier = MediaClassifier(".mkv", ".mkv, .mka", ".mkv, .mka, .nfo")
+    assert classifier.kind("a.mkv") == MediaClassifier.VIDEO
+    assert classifier.kind("a.mka") == MediaClassifier.AUDIO
+    assert classifier.kind("a.nfo") == MediaClassifier.DELETE
+
+
+def test_folder_manifest(dirs):
+    folder = dirs / "incoming" / "Movie (2001)"
+    (folder / "Subs").mkdir(parents=True)
+    for name, size in (
+        ("Movie.2001.mkv", 3000),
+        ("sample.MKV", 200),
+        ("extra.mp4", 1000),
+        ("Movie.nfo", 10),
+        ("Thumbs.db", 5),
+        ("theme.mp3", 400),
+    ):
+        (folder / name).write_bytes(bytes(size))
+
+    manifest = FolderManifest(DirectorySnapshot(str(folder)), make_classifier())
+    assert manifest.path == str(folder)
+    # just the files; the folder in there isn't one
+    assert sorted(manifest.files) == [
+        "Movie.2001.mkv",
+        "Movie.nfo",
+        "Thumbs.db",
+        "extra.mp4",
+        "sample.MKV",
+        "theme.mp3",
+    ]
+    assert manifest.video_count == 3
+    assert manifest.largest_video.name == "Movie.2001.mkv"
+    assert manifest.video_bytes == 4200
+    assert manifest.size("theme.mp3") == 400
+    assert manifest.of_kind(MediaClassifier.DELETE) == ["Movie.nfo"]
+    assert manifest.of_kind(MediaClassifier.IGNORE) == ["Thumbs.db"]
+    assert manifest.of_kind(MediaClassifier.AUDIO) == ["theme.mp3"]
+
+
+def test_empty_folder_manifest(dirs):
+    (dirs / "incoming" / "Movie.nfo").write_text("about")
+    manifest = FolderManifest(
+        DirectorySnapshot(str(dirs / "incoming")), make_classifier()
+    )
+    assert manifest.video_count == 0
+    assert manifest.largest_video is None
+    assert manifest.video_bytes == 0
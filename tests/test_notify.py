@@ -0,0 +1,43 @@
+import os
+import socket
+import stat
+
+import pytest
+
+from filewatcher.core.notify import MAX_LINE, CompletionNotifier, notify_complete
+
+
+@pytest.fixture
+def notifier(dirs):
+    notifier = CompletionNotifier(str(dirs / "notify.sock"))
+    yield notifier
+    notifier.close()
+
+
+def test_finished_downloads_are_taken_once(dirs, notifier):
+    download = dirs / "incoming" / "Heat (1995)" / "heat.mkv"
+    answers = notify_complete(
+        [str(download), str(dirs / "movies" / "Ronin (1998)")], notifier.socket_path
+    )
+    assert answers[0] == "ok"
+    assert answers[1].startswith("error: ")
+
+    assert notifier.sleep(5)
+    assert notifier.take() == {"Heat (1995)"}
+    assert notifier.take() == set()
+    # still finished, just not news any more
+    assert notifier.is_complete("Heat (1995)")
+
+
+def test_only_we_can_use_the_socket(notifier):
+    assert stat.S_IMODE(os.stat(notifier.socket_path).st_mode) == 0o600
+
+
+def test_long_lines_are_refused(notifier):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(notifier.socket_path)
+        with client.makefile("rwb") as stream:
+            stream.write(b"x" * (MAX_LINE + 10) + b"\n")
+            stream.flush()
+            assert stream.readline() == b"error: line too long\n"
+    assert notifier.take() == set()
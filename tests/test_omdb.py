@@ -0,0 +1,133 @@
+import pytest
+
+from filewatcher.core import settings
+from filewatcher.movies import OMDbAPI
+from filewatcher.movies.cache import OMDbCache
+from filewatcher.movies.movies import folder_translator
+
+
+@pytest.fixture
+def clock():
+    return [1_000_000.0]
+
+
+@pytest.fixture
+def make_omdb(dirs, omdb_server, clock):
+    """OMDbAPIs pointed at the stub, with a cache, as get_omdb() hands out."""
+    caches = []
+
+    def make(path: str = ":memory:", memory_size: int = 256) -> OMDbAPI:
+        cache = OMDbCache(
+            path,
+            hit_ttl=3600,
+            miss_ttl=60,
+            memory_size=memory_size,
+            clock=lambda: clock[0],
+        )
+        caches.append(cache)
+        api = OMDbAPI(cache=cache, max_concurrency=2, timeout=5)
+        api.session.adapters["http://"].max_retries.total = 0
+        api.url = omdb_server.url
+        settings.omdb = api
+        settings.title_index_path = ""
+        return api
+
+    yield make
+    for cache in caches:
+        cache.close()
+
+
+@pytest.fixture
+def omdb(make_omdb):
+    return make_omdb()
+
+
+def test_bad_api_key_is_a_miss(omdb, omdb_server):
+    omdb_server.status = 401
+    omdb_server.body = {"Response": "False", "Error": "No API key provided."}
+
+    assert omdb.get_movie("Aladdin").response == "False"
+    assert folder_translator("Aladdin") is None
+    # cached as a miss, so it isn't asked about again
+    assert omdb_server.requests == ["Aladdin"]
+
+
+@pytest.mark.parametrize("status", [500, 503])
+def test_server_errors_give_up_on_the_title(omdb, omdb_server, status):
+    omdb_server.status = status
+    assert folder_translator("Aladdin") is None
+    # ...but aren't remembered
+    assert omdb.cache.get("aladdin||short") is None
+
+
+def test_unreachable_gives_up_on_the_title(omdb, omdb_server):
+    omdb_server.close()
+    assert folder_translator("Aladdin") is None
+
+
+def test_found(omdb, omdb_server):
+    omdb_server.movies["Aladdin"] = {"Title": "Aladdin", "Year": "1992"}
+    assert folder_translator("Aladdin") == ("Aladdin", "1992")
+
+
+def test_hits_are_kept_for_hit_ttl(omdb, omdb_server, clock):
+    omdb_server.movies["Heat"] = {"Title": "Heat", "Year": "1995"}
+    assert omdb.get_movie("Heat").year == "1995"
+    clock[0] += 3599
+    assert omdb.get_movie("heat").year == "1995"
+    assert omdb_server.requests == ["Heat"]
+
+    clock[0] += 1
+    omdb.get_movie("Heat")
+    assert omdb_server.requests == ["Heat", "Heat"]
+
+
+def test_misses_are_kept_for_miss_ttl(omdb, omdb_server, clock):
+    assert omdb.get_movie("Heat").response == "False"
+    clock[0] += 59
+    omdb.get_movie("Heat")
+    assert omdb_server.requests == ["Heat"]
+
+    # the OMDb has heard of it since
+    omdb_server.movies["Heat"] = {"Title": "Heat", "Year": "1995"}
+    clock[0] += 1
+    assert omdb.get_movie("Heat").year == "1995"
+    assert omdb_server.requests == ["Heat", "Heat"]
+
+
+def test_memory_keeps_the_most_recently_used(make_omdb, omdb_server, dirs):
+    api = make_omdb(str(dirs / "state" / "omdb.sqlite3"), memory_size=2)
+    for title in ("Heat", "Ronin", "Heat", "Alien"):
+        api.get_movie(title)
+    # Ronin was the least recently used, so it made way for Alien
+    assert list(api.cache._memory) == ["heat||short", "alien||short"]
+
+    # ...but it's still in sqlite, so it isn't asked about again
+    api.get_movie("Ronin")
+    assert omdb_server.requests == ["Heat", "Ronin", "Alien"]
+    assert list(api.cache._memory) == ["alien||short", "ronin||short"]
+
+
+def test_answers_survive_a_restart(make_omdb, omdb_server, dirs, clock):
+    path = str(dirs / "state" / "omdb.sqlite3")
+    omdb_server.movies["Heat"] = {"Title": "Heat", "Year": "1995"}
+    api = make_omdb(path)
+    api.get_movie("Heat")
+    api.get_movie("Ronin")
+    api.cache.close()
+
+    clock[0] += 120
+    api = make_omdb(path)
+    assert api.get_movie("Heat").year == "1995"
+    # the miss has expired, hit hasn't
+    assert api.cache.purge() == 1
+    api.get_movie("Ronin")
+    assert omdb_server.requests == ["Heat", "Ronin", "Ronin"]
+
+
+def test_batch_asks_once_per_title(omdb, omdb_server):
+    omdb_server.movies["The Matrix"] = {"Title": "The Matrix", "Year": "1999"}
+    results = omdb.get_movies(["The Matrix", "the.matrix", "Ronin"])
+    assert results["the.matrix"].year == "1999"
+    assert results["Ronin"].response == "False"
+    assert sorted(omdb_server.requests) == ["Ronin", "The Matrix"]
@@ -0,0 +1,31 @@
+import pytest
+
+from filewatcher.bench.parser import load_corpus
+from filewatcher.core import settings
+from filewatcher.movies.parser import parse_name, parse_names
+
+
+@pytest.mark.parametrize("name,title,year", load_corpus())
+def test_release_names(dirs, name, title, year):
+    parsed = parse_name(name)
+    assert (parsed.title, parsed.year) == (title, year)
+
+
+def test_library_naming_is_unchanged(dirs):
+    # str.title() and all; the library is already full of names like this
+    assert parse_name("Schindler's.List.1993.1080p").title == "Schindler'S List"
+
+
+def test_no_year_is_a_query(dirs):
+    assert parse_name("the.matrix.mkv") == (None, None, "The Matrix")
+    assert parse_names(["the.matrix.mkv", "Heat 1995"]) == {
+        "the.matrix.mkv": (None, None, "The Matrix"),
+        "Heat 1995": ("Heat", "1995", "Heat 1995"),
+    }
+
+
+def test_new_video_formats_clear_the_cache(dirs, monkeypatch):
+    assert parse_name("Heat 1995.m4v").query == "Heat 1995 M4V"
+    monkeypatch.setattr(settings, "video_formats", ".m4v")
+    settings.media_classifier = None
+    assert parse_name("Heat 1995.m4v").query == "Heat 1995"
@@ -0,0 +1,107 @@
+import itertools
+import os
+
+import pytest
+
+from filewatcher.bench.pipeline import SINGLETONS, BenchWatcher
+from filewatcher.bench.tree import generate_tree
+from filewatcher.core import filewatcher, settings
+from filewatcher.core import pipeline as core_pipeline
+from filewatcher.core.fs import MemoryFileSystem, get_filesystem
+from filewatcher.core.scheduler import get_work_scheduler
+
+
+@pytest.fixture
+def memory_tree(dirs, monkeypatch):
+    """Builds the same in-memory incoming tree and library every time."""
+    monkeypatch.setattr(settings, "video_formats", [".avi", ".mkv", ".mp4"])
+    monkeypatch.setattr(settings, "exts_to_delete", [".nfo", ".txt", ".jpg"])
+    monkeypatch.setattr(settings, "settle_mode", "quiescence")
+    monkeypatch.setattr(settings, "title_index_path", "")
+    monkeypatch.setattr(settings, "workers", "3")
+
+    runs = itertools.count()
+
+    def build():
+        for attr in SINGLETONS:
+            setattr(settings, attr, None)
+        settings.filesystem = MemoryFileSystem()
+        settings.watcher = BenchWatcher()
+        for name in ("incoming", "movies"):
+            get_filesystem().makedirs(str(dirs / name))
+        # a fresh state directory each time, too
+        settings.state_dir = str(dirs / f"state-{next(runs)}")
+        generate_tree(settings.incoming_dir, settings.movie_dir, entries=60, library=20)
+
+    return build
+
+
+def outcome() -> tuple[list, list]:
+    fs = get_filesystem()
+    return (
+        sorted(fs.listdir(settings.incoming_dir)),
+        sorted(
+            (os.path.relpath(folder, settings.movie_dir), sorted(files))
+            for folder, _, files in fs.walk(settings.movie_dir)
+        ),
+    )
+
+
+def test_pipeline_matches_the_serial_loop(memory_tree):
+    memory_tree()
+    filewatcher.main_loop()
+    serial = outcome()
+
+    memory_tree()
+    pipeline = core_pipeline.Pipeline(settings.watcher, queue_size=2)
+    core_pipeline.asyncio.run(pipeline.run())
+
+    assert outcome() == serial
+    # somebody got imported, and nothing's left to do
+    assert len(serial[1]) > 21
+    assert not get_work_scheduler().pending()
+    # nothing ever got ahead of the bounded queues
+    assert max(pipeline.stats.max_depth.values()) <= 2
+    assert pipeline.stats.processed["import"] > 0
+
+
+def test_errors_are_raised_once_the_cycle_is_over(memory_tree, monkeypatch):
+    memory_tree()
+    classify = core_pipeline.classify_folder
+    failures = []
+
+    def fails_once(directory, *args):
+        if not failures:
+            failures.append(directory)
+            raise ValueError("oops")
+        classify(directory, *args)
+
+    monkeypatch.setattr(core_pipeline, "classify_folder", fails_once)
+    with pytest.raises(ValueError):
+        core_pipeline.main_loop()
+
+    # everything else still went through, and the state was saved
+    incoming, _ = outcome()
+    assert failures[0] in incoming
+    assert not any(name.startswith("Show.") for name in incoming)
+    assert os.path.exists(os.path.join(settings.state_dir, "scan_state.json"))
+
+
+def test_disk_errors_back_off(memory_tree, monkeypatch):
+    memory_tree()
+
+    def no_room(name):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(core_pipeline, "process_root_level_movie", no_room)
+    core_pipeline.main_loop()
+
+    incoming, _ = outcome()
+    root_files = [
+        name
+        for name in incoming
+        if not get_filesystem().isdir(os.path.join(settings.incoming_dir, name))
+    ]
+    assert root_files
+    scheduler = get_work_scheduler()
+    assert not any(scheduler.is_due(name) for name in root_files)
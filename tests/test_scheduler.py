@@ -0,0 +1,129 @@
+import os
+
+import pytest
+
+from filewatcher.core.fs import StatEntry
+from filewatcher.core.scheduler import WorkScheduler
+
+
+@pytest.fixture
+def clock():
+    return [1000.0]
+
+
+@pytest.fixture
+def scheduler(dirs, clock):
+    return WorkScheduler(base_delay=15, max_delay=100, clock=lambda: clock[0])
+
+
+def entry(name, device, size=0, mtime=0.0, is_file=True):
+    mode = 0o100644 if is_file else 0o040755
+    return StatEntry(
+        name,
+        name,
+        os.stat_result((mode, 1, device, 1, 0, 0, size, mtime, mtime, mtime)),
+    )
+
+
+def test_backoff_doubles_up_to_the_max(scheduler, clock):
+    delays = []
+    for _ in range(5):
+        scheduler.failed("Movie (2001)")
+        delays.append(scheduler.next_retry())
+    assert delays == [15, 30, 60, 100, 100]
+
+    assert not scheduler.is_due("Movie (2001)")
+    clock[0] += 99
+    assert not scheduler.is_due("Movie (2001)")
+    assert scheduler.wait_time(180) == 1
+    clock[0] += 1
+    assert scheduler.is_due("Movie (2001)")
+    assert scheduler.pending() == {"Movie (2001)"}
+
+
+def test_success_clears_the_backoff(scheduler, clock):
+    scheduler.failed("Movie (2001)")
+    scheduler.failed("Movie (2001)")
+    clock[0] += 30
+    scheduler.begin_cycle(None)
+    scheduler.run("Movie (2001)", lambda: None)
+    assert scheduler.next_retry() is None
+
+    # and the next failure starts over
+    scheduler.failed("Movie (2001)")
+    assert scheduler.next_retry() == 15
+
+
+def test_errors_back_off_instead_of_raising(scheduler):
+    def fails():
+        raise OSError("disk full")
+
+    scheduler.run("Movie (2001)", fails)
+    assert not scheduler.is_due("Movie (2001)")
+    assert scheduler.wait_time(180) == 15
+
+
+def test_cycle_budget(scheduler, clock):
+    scheduler.begin_cycle(None, budget=10)
+    ran = []
+    scheduler.run("First (2001)", lambda: ran.append("First (2001)"))
+    clock[0] += 10
+    scheduler.run("Second (2002)", lambda: ran.append("Second (2002)"))
+
+    assert ran == ["First (2001)"]
+    assert scheduler.skipped == {"Second (2002)"}
+    # skipped isn't failed; it's up right away next cycle
+    assert scheduler.is_due("Second (2002)")
+    assert scheduler.pending() == {"Second (2002)"}
+    assert scheduler.wait_time(180) == 0
+
+    scheduler.begin_cycle(None, budget=0)
+    assert not scheduler.out_of_time()
+    assert scheduler.wait_time(180) == 180
+
+
+def test_begin_cycle_forgets_whats_gone(scheduler):
+    scheduler.failed("Gone (2001)")
+    scheduler.failed("Still Here (2002)")
+    scheduler.begin_cycle(["Still Here (2002)"])
+    assert scheduler.is_due("Gone (2001)")
+    assert not scheduler.is_due("Still Here (2002)")
+
+    scheduler.forgive(["Still Here (2002)"])
+    assert scheduler.is_due("Still Here (2002)")
+
+
+def test_plan_order(dirs, scheduler, clock):
+    library = os.stat(dirs / "movies").st_dev
+    elsewhere = library + 1
+    entries = {
+        "big copy.mkv": entry("big copy.mkv", elsewhere, size=9000, mtime=1),
+        "small copy.mkv": entry("small copy.mkv", elsewhere, size=10, mtime=3),
+        "new copy folder": entry("new copy folder", elsewhere, 4096, 5, False),
+        "old copy folder": entry("old copy folder", elsewhere, 4096, 2, False),
+        "new rename.mkv": entry("new rename.mkv", library, size=9000, mtime=4),
+        "old rename.mkv": entry("old rename.mkv", library, size=10, mtime=6),
+        "retrying.mkv": entry("retrying.mkv", library, size=10, mtime=0),
+        "backing off.mkv": entry("backing off.mkv", library, size=10, mtime=0),
+        "vanished.mkv": None,
+    }
+    scheduler.failed("retrying.mkv")
+    scheduler.failed("backing off.mkv")
+    clock[0] += 15
+    scheduler.failed("backing off.mkv")
+
+    assert scheduler.plan(list(entries), entries) == [
+        # renames, oldest first; size doesn't matter
+        "new rename.mkv",
+        "old rename.mkv",
+        # then copies, smallest first; something that's gone is as
+        # small as it gets, and a folder's size says nothing, so they go
+        # by age
+        "vanished.mkv",
+        "old copy folder",
+        "new copy folder",
+        "small copy.mkv",
+        "big copy.mkv",
+        # and whatever's failed before goes last
+        "retrying.mkv",
+    ]
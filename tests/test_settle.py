@@ -0,0 +1,141 @@
+import os
+import time
+
+import pytest
+
+from filewatcher.core import DirectorySnapshot
+from filewatcher.core.settle import OpenFileIndex, QuiescenceDetector
+
+WRITING = "pos:\t0\nflags:\t0100001\nmnt_id:\t1\n"
+READING = "pos:\t0\nflags:\t0100000\nmnt_id:\t1\n"
+
+
+class FakeProc:
+    """A /proc with just the open files we say, for OpenFileIndex to walk."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root)
+
+    def open(self, pid: int, fd: int, path: str, fdinfo: str = WRITING) -> None:
+        for folder in ("fd", "fdinfo"):
+            os.makedirs(os.path.join(self.root, str(pid), folder), exist_ok=True)
+        os.symlink(
+            os.path.realpath(path), os.path.join(self.root, str(pid), "fd", str(fd))
+        )
+        with open(os.path.join(self.root, str(pid), "fdinfo", str(fd)), "w") as info:
+            info.write(fdinfo)
+
+    def close(self, pid: int, fd: int) -> None:
+        os.remove(os.path.join(self.root, str(pid), "fd", str(fd)))
+
+
+@pytest.fixture
+def proc(dirs):
+    return FakeProc(str(dirs / "proc"))
+
+
+@pytest.fixture
+def clock():
+    now = [time.time()]
+    return now
+
+
+@pytest.fixture
+def detector(dirs, proc, clock):
+    return QuiescenceDetector(
+        quiet_period=15,
+        proc_root=proc.root,
+        prefix=str(dirs / "incoming"),
+        clock=lambda: clock[0],
+    )
+
+
+def download(dirs, name: str, age: float = 0) -> str:
+    path = str(dirs / "incoming" / name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as movie:
+        movie.write(b"movie" * 100)
+    when = time.time() - age
+    os.utime(path, (when, when))
+    return path
+
+
+def test_open_file_index_only_counts_writers(dirs, proc):
+    writing = download(dirs, "Movie (2001)/a.mkv")
+    reading = download(dirs, "Movie (2001)/b.mkv")
+    elsewhere = download(dirs, "../movies/c.mkv")
+    proc.open(42, 7, writing)
+    proc.open(43, 3, reading, READING)
+    proc.open(44, 5, elsewhere)
+
+    index = OpenFileIndex(proc.root, str(dirs / "incoming"))
+    index.rebuild()
+    assert index.is_being_written(os.stat(writing))
+    assert not index.is_being_written(os.stat(reading))
+    assert not index.is_being_written(os.stat(elsewhere))
+    assert index.writers[(os.stat(writing).st_dev, os.stat(writing).st_ino)] == {42}
+
+
+def test_unreadable_fdinfo_counts_as_writing(dirs, proc):
+    path = download(dirs, "Movie (2001)/a.mkv")
+    proc.open(42, 7, path, "garbage\n")
+    index = OpenFileIndex(proc.root, str(dirs / "incoming"))
+    index.rebuild()
+    assert index.is_being_written(os.stat(path))
+
+
+def test_open_for_writing_is_not_settled(dirs, proc, detector, clock):
+    path = download(dirs, "Movie (2001)/a.mkv", age=3600)
+    proc.open(42, 7, path)
+    detector.begin_cycle()
+    assert not detector.folder_is_settled(DirectorySnapshot(os.path.dirname(path)))
+    assert path in detector.deferred
+
+    # the /proc walk only happens once a cycle
+    proc.close(42, 7)
+    assert not detector.is_settled(path)
+    detector.begin_cycle()
+    assert detector.is_settled(path)
+
+
+def test_unchanged_file_waits_for_the_quiet_period(dirs, detector, clock):
+    path = download(dirs, "Movie (2001).mkv")
+    detector.begin_cycle()
+    assert not detector.is_settled(path)
+
+    # the same size and mtime a moment later doesn't mean it's done
+    clock[0] += 2
+    detector.begin_cycle()
+    assert not detector.is_settled(path)
+
+    clock[0] += 14
+    detector.begin_cycle()
+    assert detector.is_settled(path)
+
+
+def test_changed_file_starts_the_quiet_period_over(dirs, detector, clock):
+    path = download(dirs, "Movie (2001).mkv")
+    detector.begin_cycle()
+    assert not detector.is_settled(path)
+
+    clock[0] += 10
+    with open(path, "ab") as movie:
+        movie.write(b"more")
+    os.utime(path, (clock[0], clock[0]))
+    detector.begin_cycle()
+    assert not detector.is_settled(path)
+
+    clock[0] += 10
+    detector.begin_cycle()
+    assert not detector.is_settled(path)
+
+    clock[0] += 6
+    detector.begin_cycle()
+    assert detector.is_settled(path)
+
+
+def test_old_file_is_settled_right_away(dirs, detector):
+    path = download(dirs, "Movie (2001).mkv", age=60)
+    detector.begin_cycle()
+    assert detector.is_settled(path)
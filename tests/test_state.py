@@ -0,0 +1,51 @@
+import os
+
+from filewatcher.core import settings
+from filewatcher.core.state import ScanState
+
+
+def remembered(dirs) -> ScanState:
+    (dirs / "incoming" / "Sample (2001)").mkdir()
+    state = ScanState(str(dirs / "state" / "scan_state.json"))
+    with os.scandir(dirs / "incoming") as entries:
+        for entry in entries:
+            state.remember(ScanState.FOLDERS, entry)
+    state.save()
+    return state
+
+
+def unchanged(dirs, state: ScanState) -> bool:
+    with os.scandir(dirs / "incoming") as entries:
+        return all(state.unchanged(ScanState.FOLDERS, entry) for entry in entries)
+
+
+def test_state_survives_a_restart(dirs):
+    remembered(dirs)
+    assert unchanged(dirs, ScanState(str(dirs / "state" / "scan_state.json")))
+
+
+def test_reordered_formats_keep_the_state(dirs, monkeypatch):
+    remembered(dirs)
+    monkeypatch.setattr(
+        settings,
+        "video_formats",
+        ", ".join(reversed(settings.video_formats.split(", "))),
+    )
+    assert unchanged(dirs, ScanState(str(dirs / "state" / "scan_state.json")))
+
+
+def test_changed_settings_throw_the_state_out(dirs, monkeypatch):
+    remembered(dirs)
+    monkeypatch.setattr(settings, "min_movie_size", "1")
+    state = ScanState(str(dirs / "state" / "scan_state.json"))
+    assert not unchanged(dirs, state)
+
+    # and it's replaced, so it isn't thrown out again next time
+    state.save()
+    assert not ScanState(str(dirs / "state" / "scan_state.json")).dirty
+
+
+def test_state_from_before_settings_were_saved_is_ignored(dirs):
+    path = dirs / "state" / "scan_state.json"
+    path.write_text('{"folders": {"Sample (2001)": [1, 2, 3]}, "files": {}}')
+    assert ScanState(str(path))._entries[ScanState.FOLDERS] == {}
@@ -0,0 +1,75 @@
+import sys
+
+import pytest
+
+from filewatcher.movies.titles import Title, TitleIndex, build_index
+
+DUMP = (
+    "tconst\ttitleType\tprimaryTitle\toriginalTitle\tstartYear\n"
+    "tt0133093\tmovie\tThe Matrix\tThe Matrix\t1999\n"
+    "tt0113277\tmovie\tHeat\tHeat\t1995\n"
+    "tt0093164\ttvMovie\tHeat\tHeat\t1986\n"
+    "tt0206300\ttvSeries\tHeat Wave\tHeat Wave\t1990\n"
+    "tt0568466\ttvEpisode\tThe Matrix\tThe Matrix\t2001\n"
+    "tt9999999\tmovie\tNo Year\tNo Year\t\\N\n"
+)
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    dump = tmp_path / "title.basics.tsv"
+    dump.write_text(DUMP, encoding="utf-8")
+    path = tmp_path / "titles.idx"
+    # no episodes, and nothing without a year
+    assert build_index(str(dump), str(path)) == 4
+    return path
+
+
+@pytest.fixture
+def index(index_path):
+    opened = TitleIndex(str(index_path))
+    yield opened
+    opened.close()
+
+
+def test_lookups(index):
+    assert len(index) == 4
+    assert index.exact("the.matrix") == [Title("The Matrix", 1999, "movie")]
+    assert index.exact("Heat") == [
+        Title("Heat", 1986, "tvMovie"),
+        Title("Heat", 1995, "movie"),
+    ]
+    assert index.exact("Heat W") == []
+    assert index.prefix("heat") == [
+        Title("Heat", 1986, "tvMovie"),
+        Title("Heat", 1995, "movie"),
+        Title("Heat Wave", 1990, "tvSeries"),
+    ]
+    assert index.prefix("heat", limit=1) == [Title("Heat", 1986, "tvMovie")]
+    assert index.prefix("nothing") == []
+
+
+def test_resolve(index):
+    assert index.resolve("The Matrix") == ("The Matrix", "1999")
+    assert index.resolve("The Matrx") == ("The Matrix", "1999")
+    # two movies it could be; that's the OMDb's call
+    assert index.resolve("Heat") is None
+    # and a show isn't a movie at all
+    assert index.resolve("Heat Wave") is None
+    assert index.resolve("Blade Runner") is None
+
+
+@pytest.mark.parametrize(
+    "offset,replacement",
+    [
+        (0, b"NOTTITLE"),
+        (8, b"b" if sys.byteorder == "little" else b"l"),
+    ],
+    ids=["magic", "byte order"],
+)
+def test_rejects_other_files(index_path, offset, replacement):
+    data = bytearray(index_path.read_bytes())
+    data[offset : offset + len(replacement)] = replacement
+    index_path.write_bytes(bytes(data))
+    with pytest.raises(ValueError):
+        TitleIndex(str(index_path))
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from filewatcher.core import settings, transfer
+
+
+@pytest.fixture
+def debug_log(monkeypatch):
+    log = []
+    monkeypatch.setattr(settings, "debug", True)
+    monkeypatch.setattr(settings, "debug_message", log.append)
+    return log
+
+
+def copying(log):
+    return [message for message in log if message.startswith("Copying")]
+
+
+def test_copies_report_progress(tmp_path, debug_log, monkeypatch):
+    monkeypatch.setattr(transfer, "CHUNK_SIZE", 1000)
+    monkeypatch.setattr(transfer, "PROGRESS_INTERVAL", 0)
+    source = tmp_path / "movie.mkv"
+    source.write_bytes(b"m" * 4000)
+
+    # resume={} makes it a copy, as it would be onto another disk
+    transfer.move(str(source), str(tmp_path / "copy.mkv"), resume={})
+    progress = copying(debug_log)
+    assert progress[-1].startswith(f"Copying {source}: 0 of 0 MB (100%")
+    assert len(progress) >= 4
+
+
+def test_quick_copies_stay_quiet(tmp_path, debug_log):
+    os.makedirs(tmp_path / "movie")
+    (tmp_path / "movie" / "movie.mkv").write_bytes(b"m" * 4000)
+    transfer.move(str(tmp_path / "movie"), str(tmp_path / "copy"), resume={})
+    assert copying(debug_log) == []
+
+
+def test_no_progress_without_debug(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "debug", False)
+    assert transfer._debug_progress(str(tmp_path)) is None
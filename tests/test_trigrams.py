@@ -0,0 +1,38 @@
+from filewatcher.movies.trigrams import TrigramIndex, installments
+
+
+def test_installments():
+    assert installments("Back to the Future Part III") == {3}
+    assert installments("Kill Bill: Vol. 2") == {2}
+    assert installments("Rocky IV") == {4}
+    assert installments("Ocean's Eleven") == {11}
+    assert installments("Part I") == {1}
+    # a pronoun, not a numeral
+    assert installments("I, Robot") == set()
+    assert installments("Blade Runner") == set()
+
+
+def test_sequels_never_match():
+    index = TrigramIndex.build(
+        [
+            ("Kill Bill Vol. 1 (2003)", "Kill Bill Vol. 1", 2003),
+            ("Back to the Future Part II (1989)", "Back to the Future Part II", 1989),
+            (
+                "Harry Potter and the Deathly Hallows Part 1 (2010)",
+                "Harry Potter and the Deathly Hallows Part 1",
+                2010,
+            ),
+            ("Blade Runner (1982)", "Blade Runner", 1982),
+        ]
+    )
+    assert index.search("Kill Bill Vol. 2", 2004, 0.85) == []
+    assert index.search("Back to the Future Part III", 1990, 0.85) == []
+    assert index.search("Harry Potter and the Deathly Hallows Part 2", 2011, 0.85) == []
+    assert index.search("Blade Runner 2049", 1982, 0.5) == []
+    # release variants still look alike
+    assert index.search("Blade Runner Final Cut", 1982, 0.85)[0][1] == (
+        "Blade Runner (1982)"
+    )
+    assert index.search("Back to the Future Part 2", 1989, 0.85)[0][1] == (
+        "Back to the Future Part II (1989)"
+    )
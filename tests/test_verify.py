@@ -0,0 +1,107 @@
+import errno
+import os
+
+import pytest
+
+from filewatcher.core import transfer, verify
+from filewatcher.core.verify import VerificationError, verify_copy
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as written:
+        written.write(data)
+
+
+def test_verify_copy_of_a_file(tmp_path):
+    write(tmp_path / "a.mkv", b"movie" * 1000)
+    write(tmp_path / "b.mkv", b"movie" * 1000)
+    digests = verify_copy(str(tmp_path / "a.mkv"), str(tmp_path / "b.mkv"))
+    assert list(digests) == [""]
+
+    write(tmp_path / "c.mkv", b"mOvie" * 1000)
+    with pytest.raises(VerificationError) as raised:
+        verify_copy(str(tmp_path / "a.mkv"), str(tmp_path / "c.mkv"))
+    assert raised.value.mismatched == ["a.mkv"]
+
+
+def test_verify_copy_of_a_folder(tmp_path):
+    for root in ("source", "copy"):
+        write(tmp_path / root / "movie.mkv", b"movie" * 1000)
+        write(tmp_path / root / "extras" / "trailer.mkv", b"trailer")
+    digests = verify_copy(str(tmp_path / "source"), str(tmp_path / "copy"))
+    assert sorted(digests) == [os.path.join("extras", "trailer.mkv"), "movie.mkv"]
+
+    write(tmp_path / "copy" / "extras" / "trailer.mkv", b"trailex")
+    with pytest.raises(VerificationError) as raised:
+        verify_copy(str(tmp_path / "source"), str(tmp_path / "copy"))
+    assert raised.value.mismatched == [os.path.join("extras", "trailer.mkv")]
+
+
+@pytest.fixture
+def cross_device(monkeypatch):
+    """Moves out of a folder called `incoming` have to be copied."""
+    rename = os.rename
+
+    def fake_rename(source, destination):
+        if os.path.basename(os.path.dirname(source)) == "incoming":
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        rename(source, destination)
+
+    monkeypatch.setattr(transfer.os, "rename", fake_rename)
+
+
+@pytest.mark.parametrize("is_folder", [False, True])
+def test_verified_move(tmp_path, cross_device, is_folder):
+    if is_folder:
+        source = tmp_path / "incoming" / "Movie (2000)"
+        write(source / "movie.mkv", b"movie" * 1000)
+    else:
+        source = tmp_path / "incoming" / "movie.mkv"
+        write(source, b"movie" * 1000)
+    destination = tmp_path / "library" / source.name
+    os.makedirs(destination.parent)
+
+    stats = transfer.move(str(source), str(destination), verify=True)
+
+    assert not stats.renamed and stats.bytes_copied == 5000
+    assert not source.exists()
+    copied = destination / "movie.mkv" if is_folder else destination
+    assert copied.read_bytes() == b"movie" * 1000
+    assert list(stats.hashes) == [str(copied)]
+
+
+def test_manifest_without_a_copy_reads_nothing(tmp_path, monkeypatch):
+    write(tmp_path / "Movie (2000)" / "movie.mkv", b"movie" * 1000)
+    folder = str(tmp_path / "Movie (2000)")
+
+    def hash_files(*args):
+        raise AssertionError("nothing should be read")
+
+    monkeypatch.setattr(verify, "hash_files", hash_files)
+    manifest = verify.write_manifest(folder)
+    assert manifest["files"]["movie.mkv"] == {
+        "size": 5000,
+        "mtime_ns": os.stat(tmp_path / "Movie (2000)" / "movie.mkv").st_mtime_ns,
+    }
+    assert verify.audit_manifest(folder) == []
+
+
+def test_deep_audit_fills_in_missing_checksums(tmp_path):
+    movie = tmp_path / "Movie (2000)" / "movie.mkv"
+    write(movie, b"movie" * 1000)
+    folder = str(tmp_path / "Movie (2000)")
+    verify.write_manifest(folder)
+
+    assert verify.audit_manifest(folder, deep=True) == []
+    digest = verify.hash_file(str(movie))
+    assert verify.load_manifest(folder)["files"]["movie.mkv"]["hash"] == digest
+
+    # same size, same mtime, different bytes
+    stat = os.stat(movie)
+    write(movie, b"mOvie" * 1000)
+    os.utime(movie, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert verify.audit_manifest(folder) == []
+    assert verify.audit_manifest(folder, deep=True) == [
+        "movie.mkv doesn't match its checksum"
+    ]
@@ -0,0 +1,115 @@
+import os
+
+import pytest
+
+from filewatcher.core import settings
+from filewatcher.core.fs import MemoryFileSystem
+from filewatcher.core.volumes import (
+    FreeSpace,
+    choose_library,
+    get_libraries,
+    get_roots,
+    placed,
+)
+from filewatcher.movies.library import get_library_index
+
+GB = 1000**3
+
+
+@pytest.fixture
+def two_libraries(dirs, monkeypatch):
+    """
+    An in-memory incoming directory and two libraries: `near` on the same
+    device as incoming, and `far` on one of its own.
+    """
+    fs = MemoryFileSystem()
+    settings.filesystem = fs
+    base = str(dirs)
+    fs.makedirs(os.path.join(base, "incoming"))
+    fs.makedirs(os.path.join(base, "near"))
+    fs.mount(os.path.join(base, "far"), size=100 * GB)
+    settings.movie_dirs = [os.path.join(base, "far"), os.path.join(base, "near")]
+    monkeypatch.setattr(settings, "title_index_path", "")
+    return fs
+
+
+def download(fs, name, size):
+    path = os.path.join(settings.incoming_dir, name, "movie.mkv")
+    fs.makedirs(os.path.dirname(path))
+    fs.create_file(path, size)
+
+
+def test_first_library_inside_another_ones_scope(two_libraries):
+    far, near = get_libraries()
+    outside = get_library_index()
+
+    with near.active():
+        assert settings.movie_dir == near.path
+        near_index = get_library_index()
+        with far.active():
+            assert settings.movie_dir == far.path
+            assert get_library_index() is outside
+        assert get_library_index() is near_index
+    assert near_index is not outside
+
+
+def test_first_root_inside_another_ones_scope(dirs):
+    settings.incoming_dirs = [str(dirs / "incoming"), str(dirs / "more")]
+    first, second = get_roots()
+    with second.active():
+        assert settings.incoming_dir == str(dirs / "more")
+        with first.active():
+            assert settings.incoming_dir == str(dirs / "incoming")
+            assert settings.incoming_state_dir == ""
+
+
+def test_same_device_is_preferred(two_libraries):
+    download(two_libraries, "Movie (2001)", GB)
+    assert choose_library("Movie (2001)").path.endswith("near")
+
+
+def test_most_free_space_when_nothing_is_on_the_same_device(two_libraries):
+    fs = two_libraries
+    base = os.path.dirname(settings.incoming_dir)
+    # the incoming directory moves to a disk of its own
+    fs.rmdir(settings.incoming_dir)
+    fs.mount(settings.incoming_dir)
+    settings.movie_dirs = [os.path.join(base, "far"), os.path.join(base, "elsewhere")]
+    fs.mount(os.path.join(base, "elsewhere"), size=120 * GB)
+
+    download(fs, "First (2001)", 30 * GB)
+    download(fs, "Second (2002)", 30 * GB)
+    assert choose_library("First (2001)").path.endswith("elsewhere")
+    # the first one's 30GB has already come off, so far has more room now
+    assert choose_library("Second (2002)").path.endswith("far")
+
+
+def test_library_that_already_has_it(two_libraries):
+    two_libraries.mkdir(os.path.join(settings.movie_dirs[0], "Movie (2001)"))
+    download(two_libraries, "Movie.2001.1080p", GB)
+    assert choose_library("Movie.2001.1080p").path.endswith("far")
+
+
+def test_placed(two_libraries):
+    download(two_libraries, "Movie (2001)", GB)
+
+    @placed
+    def import_(name):
+        return settings.movie_dir
+
+    assert import_("Movie (2001)").endswith("near")
+    assert settings.movie_dir.endswith("far")
+
+
+def test_free_space_is_kept_for_a_while(two_libraries):
+    clock = [0.0]
+    space = FreeSpace(ttl=60, clock=lambda: clock[0])
+    far = settings.movie_dirs[0]
+    assert space.free(far) == 100 * GB
+
+    two_libraries.create_file(os.path.join(far, "movie.mkv"), 10 * GB)
+    space.reserve(far, 5 * GB)
+    assert space.free(far) == 95 * GB
+
+    clock[0] += 60
+    assert space.free(far) == 90 * GB
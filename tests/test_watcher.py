@@ -0,0 +1,184 @@
+import os
+import sys
+
+import pytest
+
+from filewatcher.core import settings, watcher
+from filewatcher.core.fs import MemoryFileSystem
+from filewatcher.core.watcher import (
+    IN_Q_OVERFLOW,
+    AdaptivePollingWatcher,
+    InotifyWatcher,
+    PollingWatcher,
+    create_watcher,
+)
+
+
+class FakeTime:
+    """A clock, and a sleep that moves it along and runs `during` first."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+        self.during = {}
+        self.notified = False
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        action = self.during.pop(len(self.sleeps), None)
+        if action is not None:
+            action()
+        return self.notified
+
+
+@pytest.fixture
+def fake_time():
+    return FakeTime()
+
+
+@pytest.fixture
+def adaptive(dirs, fake_time):
+    return AdaptivePollingWatcher(
+        str(dirs / "incoming"),
+        min_interval=2,
+        max_interval=16,
+        full_scan_interval=900,
+        clock=fake_time.clock,
+        sleep=fake_time.sleep,
+    )
+
+
+def touch_incoming(dirs, name):
+    def touch():
+        (dirs / "incoming" / name).mkdir()
+        # make sure the mtime moves, however coarse the filesystem's is
+        stat = os.stat(dirs / "incoming")
+        os.utime(dirs / "incoming", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    return touch
+
+
+def test_adaptive_interval_doubles_while_nothing_happens(adaptive, fake_time):
+    assert adaptive.wait(100) == set()
+    assert fake_time.sleeps == [2, 4, 8, 16, 16, 16, 16, 16, 6]
+    assert adaptive.interval == 16
+
+    # it picks up where it left off next time
+    fake_time.sleeps.clear()
+    assert adaptive.wait(20) == set()
+    assert fake_time.sleeps == [16, 4]
+
+
+def test_adaptive_change_resets_the_interval(dirs, adaptive, fake_time):
+    fake_time.during[4] = touch_incoming(dirs, "Movie (2001)")
+    assert adaptive.wait(100) is None
+    assert fake_time.sleeps == [2, 4, 8, 16]
+    assert adaptive.interval == 2
+
+    fake_time.sleeps.clear()
+    assert adaptive.wait(3) == set()
+    assert fake_time.sleeps == [2, 1]
+
+
+def test_adaptive_full_scan_interval(adaptive, fake_time):
+    for _ in range(8):
+        assert adaptive.wait(100) == set()
+    # 900 seconds without a full rescan is long enough
+    assert adaptive.wait(100) is None
+    assert fake_time.now == 900
+
+
+def test_adaptive_notified(adaptive, fake_time):
+    adaptive.wait(10)
+    fake_time.notified = True
+    fake_time.sleeps.clear()
+    assert adaptive.wait(100) == set()
+    assert fake_time.sleeps == [16]
+    assert adaptive.interval == 2
+
+
+linux_only = pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="inotify is Linux only"
+)
+
+
+@pytest.fixture
+def inotify(dirs):
+    (dirs / "incoming" / "Old (2000)").mkdir()
+    (dirs / "incoming" / "settling.mkv").write_bytes(b"movie")
+    watching = InotifyWatcher(str(dirs / "incoming"))
+    yield watching
+    watching.close()
+
+
+@linux_only
+def test_inotify_reports_top_level_names(dirs, inotify):
+    incoming = dirs / "incoming"
+    (incoming / "Old (2000)" / "movie.mkv").write_bytes(b"movie")
+    (incoming / "New (2001)").mkdir()
+    (incoming / "New (2001)" / "extras").mkdir()
+    assert inotify.wait(5) == {"Old (2000)", "New (2001)"}
+
+    # the new folder (and the one inside it) is being watched now, too
+    (incoming / "New (2001)" / "extras" / "trailer.mkv").write_bytes(b"trailer")
+    assert inotify.wait(5) == {"New (2001)"}
+
+    assert inotify.wait(0.1) == set()
+
+
+@linux_only
+def test_inotify_nets_out_moves(dirs, inotify):
+    incoming = dirs / "incoming"
+    # moved away and right back is nothing new
+    os.rename(incoming / "settling.mkv", dirs / "settling.mkv")
+    os.rename(dirs / "settling.mkv", incoming / "settling.mkv")
+    # moved in from somewhere else is
+    (dirs / "Arrived (2002)").mkdir()
+    os.rename(dirs / "Arrived (2002)", incoming / "Arrived (2002)")
+    # and moved out isn't anything to look at
+    os.rename(incoming / "Old (2000)", dirs / "Old (2000)")
+    assert inotify.wait(5) == {"Arrived (2002)"}
+
+    # whatever was under the folder that left isn't ours any more
+    (dirs / "Old (2000)" / "movie.mkv").write_bytes(b"movie")
+    assert inotify.wait(0.5) == set()
+
+
+@linux_only
+def test_inotify_overflow_rescans_everything(dirs, inotify, monkeypatch):
+    real_batch = inotify._collect_batch
+    monkeypatch.setattr(
+        inotify, "_collect_batch", lambda: real_batch() + [(-1, IN_Q_OVERFLOW, "")]
+    )
+    (dirs / "incoming" / "New (2001)").mkdir()
+    assert inotify.wait(5) is None
+
+
+def test_create_watcher(dirs, monkeypatch):
+    monkeypatch.setattr(settings, "watch_mode", "poll")
+    assert isinstance(create_watcher(), PollingWatcher)
+
+    monkeypatch.setattr(settings, "watch_mode", "adaptive")
+    assert isinstance(create_watcher(), AdaptivePollingWatcher)
+
+    monkeypatch.setattr(settings, "watch_mode", "auto")
+    if sys.platform.startswith("linux"):
+        found = create_watcher()
+        assert isinstance(found, InotifyWatcher)
+        found.close()
+
+    def unavailable(root):
+        raise OSError("inotify is broken")
+
+    monkeypatch.setattr(watcher, "InotifyWatcher", unavailable)
+    assert isinstance(create_watcher(), AdaptivePollingWatcher)
+
+    # inotify can't see a tree that's only in memory
+    settings.filesystem = MemoryFileSystem()
+    settings.filesystem.makedirs(settings.incoming_dir)
+    monkeypatch.setattr(settings, "watch_mode", "inotify")
+    assert isinstance(create_watcher(), AdaptivePollingWatcher)
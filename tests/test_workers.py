@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+from filewatcher.core import filewatcher, settings
+from filewatcher.core.scheduler import get_work_scheduler
+from filewatcher.core.workers import CopyQueue, will_copy
+
+
+@pytest.fixture
+def copies_of(dirs, monkeypatch):
+    """Anything starting with "Copy" is a copy; a copy waits for `release`."""
+    release = threading.Event()
+    imported = []
+
+    def importer(name):
+        if name.startswith("Copy"):
+            assert release.wait(5)
+        imported.append(name)
+
+    monkeypatch.setattr(
+        filewatcher,
+        "will_copy",
+        lambda path: path.rsplit("/", 1)[-1].startswith("Copy"),
+    )
+    return release, imported, importer
+
+
+def test_same_disk_is_not_a_copy(dirs):
+    (dirs / "incoming" / "Movie (2001)").mkdir()
+    assert not will_copy(str(dirs / "incoming" / "Movie (2001)"))
+
+
+def test_renames_dont_wait_for_copies(copies_of):
+    release, imported, importer = copies_of
+    copies = CopyQueue(1)
+    filewatcher.import_or_queue(importer, copies, "Copy Me (2001)")
+    filewatcher.import_or_queue(importer, copies, "Rename Me (2002)")
+    assert imported == ["Rename Me (2002)"]
+
+    release.set()
+    copies.join()
+    assert imported == ["Rename Me (2002)", "Copy Me (2001)"]
+
+
+def test_failed_copy_backs_off(copies_of):
+    def importer(name):
+        raise OSError("disk full")
+
+    copies = CopyQueue(1)
+    filewatcher.import_or_queue(importer, copies, "Copy Me (2001)")
+    copies.join()
+    assert not get_work_scheduler().is_due("Copy Me (2001)")
+
+
+def test_process_folders_keeps_going_while_copying(dirs, copies_of, monkeypatch):
+    release, imported, importer = copies_of
+    monkeypatch.setattr(filewatcher, "rename_and_move", importer)
+    monkeypatch.setattr(
+        filewatcher,
+        "process_folder",
+        lambda directory, snapshot, state, importer: importer(directory),
+    )
+    monkeypatch.setattr(settings, "workers", "2")
+
+    names = ["Copy One (2001)", "Copy Two (2002)", "Rename (2003)"]
+    for name in names:
+        (dirs / "incoming" / name).mkdir()
+    copies = CopyQueue(1)
+    filewatcher.process_folders(names, state=None, copies=copies)
+    # both copies are still waiting, but the rename is done
+    assert imported == ["Rename (2003)"]
+
+    release.set()
+    copies.join()
+    assert sorted(imported) == sorted(names)